@@ -5,8 +5,8 @@ a = Analysis(
     ['run_chess_client.py'],
     pathex=[],
     binaries=[],
-    datas=[('client', 'client'), ('common', 'common')],
-    hiddenimports=['pygame', 'chess', 'chess.engine', 'tkinter', 'tkinter.simpledialog', 'tkinter.messagebox'],
+    datas=[('client/assets', 'client/assets')],
+    hiddenimports=['pygame', 'chess', 'chess.engine', 'tkinter', 'tkinter.messagebox'],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
@@ -16,19 +16,18 @@ a = Analysis(
 )
 pyz = PYZ(a.pure)
 
+# One folder rather than one file: a one-file build unpacks its whole bundle into a
+# temporary directory on every launch before any of the client runs
 exe = EXE(
     pyz,
     a.scripts,
-    a.binaries,
-    a.datas,
     [],
+    exclude_binaries=True,
     name='Chess',
     debug=False,
     bootloader_ignore_signals=False,
     strip=False,
-    upx=True,
-    upx_exclude=[],
-    runtime_tmpdir=None,
+    upx=False,
     console=False,
     disable_windowed_traceback=False,
     argv_emulation=False,
@@ -37,3 +36,12 @@ exe = EXE(
     entitlements_file=None,
     icon=['client\\assets\\Chess_logo.ico'],
 )
+coll = COLLECT(
+    exe,
+    a.binaries,
+    a.datas,
+    strip=False,
+    upx=False,
+    upx_exclude=[],
+    name='Chess',
+)
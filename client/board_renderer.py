@@ -0,0 +1,140 @@
+import os
+import pygame
+import chess
+
+ASSET_DIR = os.path.join(os.path.dirname(__file__), 'assets')
+PIECE_FILES = {
+    'K': 'Chess_klt60.png', 'Q': 'Chess_qlt60.png', 'R': 'Chess_rlt60.png', 'B': 'Chess_blt60.png', 'N': 'Chess_nlt60.png', 'P': 'Chess_plt60.png',
+    'k': 'Chess_kdt60.png', 'q': 'Chess_qdt60.png', 'r': 'Chess_rdt60.png', 'b': 'Chess_bdt60.png', 'n': 'Chess_ndt60.png', 'p': 'Chess_pdt60.png',
+}
+
+# Every piece pre-scaled to the sizes the GUI draws (board squares, promotion choices),
+# one row per size in ATLAS_SIZES order, pieces in PIECE_FILES order. An uncompressed
+# 32-bit BMP: it loads in under a millisecond, where the same atlas as a PNG took longer
+# to decode than loading and scaling the twelve piece files.
+# Rebuild with `python -m tools.build_sprite_atlas` after changing a piece or a size.
+ATLAS_FILE = os.path.join(ASSET_DIR, 'pieces_atlas.bmp')
+ATLAS_SIZES = (80, 48)
+
+LIGHT_BROWN = (240, 217, 181)
+DARK_BROWN = (181, 136, 99)
+SELECTED_COLOR = (255, 255, 0)
+LEGAL_MOVE_COLOR = (120, 200, 120)
+CHECK_COLOR = (255, 120, 120)  # light red
+
+# Scaled piece images, keyed by size, loaded once per process
+_piece_images = {}
+_atlas = []  # the decoded atlas surface, once loaded
+
+def load_piece_images(size):
+    images = _piece_images.get(size)
+    if images is None:
+        images = atlas_images(size) if size in ATLAS_SIZES else None
+        if images is None:
+            images = scale_piece_files(size)
+        _piece_images[size] = images
+    return images
+
+def atlas_images(size):
+    """
+    The pieces at size as views into the atlas, which is read on first use: one file
+    instead of twelve PNGs, and no scaling. None without an atlas.
+    """
+    if not _atlas:
+        if not os.path.exists(ATLAS_FILE):
+            return None
+        atlas = pygame.image.load(ATLAS_FILE)
+        if pygame.display.get_surface() is not None:
+            atlas = atlas.convert_alpha()
+        _atlas.append(atlas)
+    atlas = _atlas[0]
+    top = sum(ATLAS_SIZES[:ATLAS_SIZES.index(size)])
+    return {symbol: atlas.subsurface((column * size, top, size, size))
+            for column, symbol in enumerate(PIECE_FILES)}
+
+def scale_piece_files(size):
+    images = {}
+    for symbol, fname in PIECE_FILES.items():
+        img_path = os.path.join(ASSET_DIR, fname)
+        if os.path.exists(img_path):
+            img = pygame.image.load(img_path)
+            if pygame.display.get_surface() is not None:
+                img = img.convert_alpha()
+            images[symbol] = pygame.transform.smoothscale(img, (size, size))
+    return images
+
+class TextCache:
+    """
+    Rendered text surfaces keyed by font, text and color.
+    Chat lines, labels and clock readings repeat constantly, so each is rendered once.
+    """
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self.surfaces = {}
+
+    def render(self, font, text, color):
+        key = (id(font), text, color)
+        surface = self.surfaces.get(key)
+        if surface is None:
+            if len(self.surfaces) >= self.max_entries:
+                self.surfaces.clear()
+            surface = font.render(text, True, color)
+            self.surfaces[key] = surface
+        return surface
+
+class BoardRenderer:
+    """
+    Keeps the board (squares, highlights and pieces) pre-rendered on its own surface.
+    update() compares what each square should show with what was last drawn there,
+    repaints only the squares that differ and returns their rects, so the caller can
+    copy just those areas to the screen.
+    """
+    def __init__(self, square_size, flipped=False):
+        self.square_size = square_size
+        self.flipped = flipped
+        self.surface = pygame.Surface((square_size * 8, square_size * 8))
+        self.pieces = load_piece_images(square_size)
+        self.drawn = [None] * 64  # (piece symbol, highlight) last painted on each square
+
+    def square_rect(self, square):
+        col = chess.square_file(square)
+        row = 7 - chess.square_rank(square)
+        if self.flipped:
+            col = 7 - col
+            row = 7 - row
+        size = self.square_size
+        return pygame.Rect(col * size, row * size, size, size)
+
+    def update(self, board, selected_square=None, legal_moves=(), force=False):
+        """
+        Bring the board surface up to date. Returns the list of repainted rects.
+        """
+        check_square = board.king(board.turn) if board.is_check() else None
+        legal_moves = set(legal_moves or ())
+        dirty = []
+        for square in chess.SQUARES:
+            # Later highlights win: selection, then legal targets, then king in check
+            highlight = None
+            if square == selected_square:
+                highlight = SELECTED_COLOR
+            if square in legal_moves:
+                highlight = LEGAL_MOVE_COLOR
+            if square == check_square:
+                highlight = CHECK_COLOR
+            piece = board.piece_at(square)
+            state = (piece.symbol() if piece else None, highlight)
+            if state != self.drawn[square] or force:
+                self.drawn[square] = state
+                dirty.append(self.paint(square, state))
+        return dirty
+
+    def paint(self, square, state):
+        symbol, highlight = state
+        rect = self.square_rect(square)
+        color = highlight
+        if color is None:
+            color = LIGHT_BROWN if (rect.x + rect.y) // self.square_size % 2 == 0 else DARK_BROWN
+        self.surface.fill(color, rect)
+        if symbol in self.pieces:
+            self.surface.blit(self.pieces[symbol], rect)
+        return rect
@@ -1,13 +1,12 @@
 import socket
 import threading
-import pygame
 import sys
-import queue
 import os
-import tkinter as tk
-from tkinter import simpledialog, messagebox
-from common.protocol import make_message, parse_message
+from common.wire import JSON, ENCODINGS
+from common.protocol import make_message, make_join_room, make_resume, MessageDecoder
 import time
+# pygame, python-chess and the GUI modules are imported by load_gui(), which runs while
+# the welcome window is open
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
@@ -21,16 +20,23 @@ WINDOW_WIDTH, WINDOW_HEIGHT = 960, 720
 BOARD_SIZE = 640
 CHAT_HEIGHT = 80
 FONT_SIZE = 24
+# Longest the GUI sleeps when nothing is happening
+IDLE_WAKE_MS = 1000
+# Pauses between attempts to reconnect after the connection drops
+RECONNECT_DELAYS = (0.5, 1, 2, 4, 8, 15)
+# Longest the welcome window waits for a connection opened in advance
+CONNECT_TIMEOUT = 5
+# Seconds a connection opened in advance is kept unused before it is closed, so a
+# welcome window left open does not hold a connection on the server
+PRECONNECT_IDLE = 15
 
-# Thread-safe queue for incoming messages
-gui_message_queue = queue.Queue()
+# Events decoded by the receive thread, waiting for the GUI; created by load_gui()
+gui_inbox = None
 
 # Colors
 WHITE = (255, 255, 255)
 BLACK = (0, 0, 0)
 GRAY = (200, 200, 200)
-LIGHT_BROWN = (240, 217, 181)
-DARK_BROWN = (181, 136, 99)
 
 # Connect to server
 def connect_to_server(ip, port):
@@ -43,78 +49,186 @@ def connect_to_server(ip, port):
         print(f"Failed to connect: {e}")
         return None
 
-def receive_messages(sock):
+class Preconnect:
+    """
+    A connection to the server opened while the welcome window is still up, so the TCP
+    handshake is over by the time the player presses Connect. It is opened to the
+    address in the form when the window appears and again whenever that address is
+    edited; take() hands it over if it went to the address the player chose. A
+    connection still unused after PRECONNECT_IDLE seconds is closed, and take() then
+    returns None.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.address = None
+        self.done = None  # set once the attempt to self.address has finished
+        self.sock = None
+        self.expiry = None  # timer closing self.sock once it has been idle too long
+
+    def start(self, ip, port):
+        address = (ip, port)
+        with self.lock:
+            if address == self.address:
+                return
+            self.drop_locked()
+            self.address = address
+            self.done = done = threading.Event()
+        threading.Thread(target=self.open, args=(address, done), daemon=True).start()
+
+    def open(self, address, done):
+        try:
+            sock = socket.create_connection(address, timeout=CONNECT_TIMEOUT)
+            sock.settimeout(None)
+        except OSError:
+            sock = None
+        with self.lock:
+            current = done is self.done
+            if current:
+                self.sock = sock
+                if sock is not None:
+                    self.expiry = threading.Timer(PRECONNECT_IDLE, self.expire, args=(done,))
+                    self.expiry.daemon = True
+                    self.expiry.start()
+        done.set()
+        if sock is not None and not current:
+            sock.close()
+
+    def take(self, ip, port):
+        """
+        The socket opened to ip:port, waiting for an attempt still under way, or None.
+        """
+        with self.lock:
+            done = self.done if self.address == (ip, port) else None
+        if done is not None:
+            done.wait(CONNECT_TIMEOUT)
+        with self.lock:
+            sock = self.sock if done is not None and done is self.done else None
+            self.sock = None
+            self.drop_locked()
+        return sock
+
+    def expire(self, done):
+        with self.lock:
+            if done is self.done:
+                self.drop_locked()
+
+    def drop_locked(self):
+        if self.expiry is not None:
+            self.expiry.cancel()
+            self.expiry = None
+        if self.sock is not None:
+            self.sock.close()
+        self.sock = None
+        self.address = None
+        self.done = None
+
+def load_gui():
+    """
+    Import what the game window needs and create the inbox. pygame and python-chess take
+    most of the client's start-up time, so main() runs this on a thread while the player
+    fills in the welcome window.
+    """
+    global gui_inbox
+    import pygame
+    import chess
+    import common.chess_game
+    import client.board_renderer
+    import client.prediction
+    from client.events import EventInbox
+    gui_inbox = EventInbox()
+
+class ServerLink:
+    """
+    The connection to the server, and what it takes to resume the game after it drops:
+    the room, the session token and the sequence number of the last event seen.
+    The GUI sends through it while the receive thread swaps in a new socket.
+    """
+    def __init__(self, ip, port, sock):
+        self.ip = ip
+        self.port = port
+        self.sock = sock
+        self.room = None
+        self.session = None
+        self.encoding = JSON  # wire encoding the server chose for this client
+        self.last_seq = 0
+        self.closed = False
+
+    def send(self, msg_type, content):
+        self.sendall(make_message(msg_type, content, self.encoding))
+
+    def sendall(self, data):
+        try:
+            self.sock.sendall(data)
+        except OSError:
+            # Lost with the connection; after resuming, the board shows what the server has
+            pass
+
+    def close(self):
+        self.closed = True
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+    def reconnect(self):
+        """
+        Open a new connection and ask to resume the session. Returns False once every
+        attempt has failed.
+        """
+        if self.session is None or self.closed:
+            return False
+        for delay in RECONNECT_DELAYS:
+            time.sleep(delay)
+            sock = connect_to_server(self.ip, self.port)
+            if sock is None:
+                continue
+            try:
+                sock.sendall(make_resume(self.room, self.session, self.last_seq, ENCODINGS))
+            except OSError:
+                sock.close()
+                continue
+            self.sock = sock
+            return True
+        return False
+
+def receive_messages(link, decoder, pending=()):
+    from client.events import ChatLine
+    for msg_obj in pending:
+        dispatch_message(link, msg_obj)
     while True:
         try:
-            data = sock.recv(1024)
-            if not data:
-                gui_message_queue.put("Disconnected from server.")
-                break
-            msg_obj = parse_message(data.decode())
-            if msg_obj['type'] == 'chat':
-                gui_message_queue.put(f"{msg_obj['content'].get('sender', 'Server')}: {msg_obj['content'].get('text', '')}")
-            else:
-                gui_message_queue.put(data.decode())
+            messages = decoder.recv_from(link.sock)
         except Exception as e:
-            gui_message_queue.put(f"Error receiving: {e}")
-            break
+            gui_inbox.put(ChatLine(f"Error receiving: {e}"))
+            messages = None
+        if messages is None:
+            gui_inbox.put(ChatLine("Disconnected from server. Reconnecting..."))
+            if not link.reconnect():
+                gui_inbox.put(ChatLine("Could not reconnect."))
+                break
+            decoder = MessageDecoder()
+            continue
+        for msg_obj in messages:
+            dispatch_message(link, msg_obj)
 
-def draw_board(screen, board_fen=None, selected_square=None, legal_moves=None, flipped=False):
-    import chess
-    square_size = BOARD_SIZE // 8
-    king_in_check_square = None
-    if board_fen:
-        board = chess.Board(board_fen)
-        if board.is_check():
-            # Find the king of the side to move
-            king_color = board.turn
-            king_square = board.king(king_color)
-            king_in_check_square = king_square
-    for row in range(8):
-        for col in range(8):
-            draw_col = col if not flipped else 7 - col
-            draw_row = row if not flipped else 7 - row
-            color = LIGHT_BROWN if (draw_row + draw_col) % 2 == 0 else DARK_BROWN
-            square = chess.square(col, 7 - row)
-            # Highlight selected square
-            if selected_square == square:
-                color = (255, 255, 0)
-            # Highlight legal moves
-            if legal_moves and square in legal_moves:
-                color = (120, 200, 120)
-            # Highlight king in check
-            if king_in_check_square is not None and square == king_in_check_square:
-                color = (255, 120, 120)  # light red
-            pygame.draw.rect(screen, color, (draw_col * square_size, draw_row * square_size, square_size, square_size))
-    if board_fen:
-        piece_map = {
-            'K': 'Chess_klt60.png', 'Q': 'Chess_qlt60.png', 'R': 'Chess_rlt60.png', 'B': 'Chess_blt60.png', 'N': 'Chess_nlt60.png', 'P': 'Chess_plt60.png',
-            'k': 'Chess_kdt60.png', 'q': 'Chess_qdt60.png', 'r': 'Chess_rdt60.png', 'b': 'Chess_bdt60.png', 'n': 'Chess_ndt60.png', 'p': 'Chess_pdt60.png',
-        }
-        asset_dir = os.path.join(os.path.dirname(__file__), 'assets')
-        if not hasattr(draw_board, 'piece_images'):
-            piece_images = {}
-            for symbol, fname in piece_map.items():
-                img_path = os.path.join(asset_dir, fname)
-                if os.path.exists(img_path):
-                    img = pygame.image.load(img_path)
-                    img = pygame.transform.smoothscale(img, (square_size, square_size))
-                    piece_images[symbol] = img
-            draw_board.piece_images = piece_images
-        else:
-            piece_images = draw_board.piece_images
-        board = chess.Board(board_fen)
-        for i in range(64):
-            piece = board.piece_at(i)
-            if piece:
-                p = piece.symbol()
-                row, col = 7 - (i // 8), i % 8
-                draw_col = col if not flipped else 7 - col
-                draw_row = row if not flipped else 7 - row
-                if p in piece_images:
-                    screen.blit(piece_images[p], (draw_col * square_size, draw_row * square_size))
-
-def draw_chat_right(screen, font, chat_lines, input_text):
+def dispatch_message(link, msg_obj):
+    from client.events import ChatLine, decode_event
+    content = msg_obj.get('content')
+    if isinstance(content, dict):
+        if isinstance(content.get('seq'), int):
+            link.last_seq = max(link.last_seq, content['seq'])
+        if msg_obj.get('type') == 'ping':
+            link.send('pong', {'id': content.get('id')})
+            return
+        if msg_obj.get('type') == 'color' and content.get('resumed'):
+            gui_inbox.put(ChatLine("Reconnected."))
+            return
+    event = decode_event(msg_obj)
+    if event is not None:
+        gui_inbox.put(event)
+
+def draw_chat_right(screen, font, chat_lines, input_text, text_cache):
+    import pygame
     chat_x = BOARD_SIZE + 10
     chat_y = 10
     chat_width = 300
@@ -130,29 +244,46 @@ def draw_chat_right(screen, font, chat_lines, input_text):
             line = line[max_line_length:]
         wrapped_lines.append(line)
     for i, line in enumerate(wrapped_lines[-max_lines:]):
-        txt_surface = font.render(line, True, BLACK)
+        txt_surface = text_cache.render(font, line, BLACK)
         screen.blit(txt_surface, (chat_x, chat_y + i * FONT_SIZE))
     # Draw input text
-    input_surface = font.render("> " + input_text, True, BLACK)
+    input_surface = text_cache.render(font, "> " + input_text, BLACK)
     screen.blit(input_surface, (chat_x, chat_y + chat_height - 30))
 
-def gui_main(sock, player_color, player_name):
+def gui_main(link, player_color, player_name):
+    import pygame
     import chess
+    from common.chess_game import GameReplay
+    from client.board_renderer import BoardRenderer, TextCache, load_piece_images
+    from client.events import ChatLine, ChatBatch, BoardSnapshot, MoveDelta, GameOver, ServerError
+    from client.prediction import MovePredictor, APPLIED, STALE, GAP
     pygame.init()
     CHAT_WIDTH = 320
     screen = pygame.display.set_mode((BOARD_SIZE + CHAT_WIDTH, WINDOW_HEIGHT))
     pygame.display.set_caption(f"Chess - {player_name} ({player_color.title()})")
     font = pygame.font.SysFont(None, FONT_SIZE)
-    clock = pygame.time.Clock()
+    timer_font = pygame.font.SysFont(None, 36)
+    text_cache = TextCache()
 
     chat_lines = []
     input_text = ""
     input_active = True
-    board_fen = chess.STARTING_FEN
     error_message = ""
     selected_square = None
     legal_moves = []
-    board = chess.Board(board_fen)
+    # Local copy of the game, kept current by applying the server's move deltas; our own
+    # moves are shown at once and rolled back if the server rejects them
+    predictor = MovePredictor()
+    # The server's clocks from before our first unconfirmed move, restored on rollback
+    confirmed_clock = None
+    # Confirmed moves with board checkpoints, for stepping back through the game locally;
+    # None when the server's snapshot came without its history
+    history = GameReplay()
+    view_ply = None  # the ply being reviewed, or None for the live board
+    review_board = None
+    # Bumped whenever the local board changes, so the renderer knows to look at it
+    board_version = 0
+    resync_requested = False
     flipped = (player_color == 'black')
     promotion_pending = None
     promo_square = None
@@ -163,33 +294,41 @@ def gui_main(sock, player_color, player_name):
 
     # Time logic
     player_times = {'white': 5*60, 'black': 5*60}  # default 5 min, will be updated from server
-    last_update_time = time.time()
+    last_update_time = time.monotonic()
     active_timer = None
 
+    # Keys that step through the game's history
+    review_keys = (pygame.K_LEFT, pygame.K_RIGHT, pygame.K_HOME, pygame.K_END)
+
     def format_time(secs):
         mins = int(secs) // 60
         s = int(secs) % 60
         return f"{mins:02}:{s:02}"
 
-    def get_piece_image(symbol):
-        piece_map = {
-            'Q': 'Chess_qlt60.png', 'R': 'Chess_rlt60.png', 'B': 'Chess_blt60.png', 'N': 'Chess_blt60.png',
-            'q': 'Chess_qdt60.png', 'r': 'Chess_rdt60.png', 'b': 'Chess_bdt60.png', 'n': 'Chess_bdt60.png',
-        }
-        asset_dir = os.path.join(os.path.dirname(__file__), 'assets')
-        fname = piece_map[symbol]
-        img_path = os.path.join(asset_dir, fname)
-        img = pygame.image.load(img_path)
-        img = pygame.transform.smoothscale(img, (48, 48))
-        return img
+    # Rendering state: the board lives on the renderer's surface, and each screen
+    # region remembers what it last showed so it is only redrawn when that changes.
+    renderer = BoardRenderer(BOARD_SIZE // 8, flipped)
+    promo_images = load_piece_images(48)
+    board_rect = pygame.Rect(0, 0, BOARD_SIZE, BOARD_SIZE)
+    chat_rect = pygame.Rect(BOARD_SIZE, 0, CHAT_WIDTH, WINDOW_HEIGHT)
+    timer_rect = pygame.Rect(0, BOARD_SIZE, BOARD_SIZE, WINDOW_HEIGHT - BOARD_SIZE)
+    drawn_board = None
+    drawn_overlays = ()
+    drawn_chat = None
+    drawn_timers = None
+    overlay_rects = []
 
     def reset_game():
-        nonlocal board_fen, error_message, selected_square, legal_moves, board, promotion_pending, promo_square, promo_from, game_over, winner_name, opponent_connected
-        board_fen = chess.STARTING_FEN
+        nonlocal error_message, selected_square, legal_moves, board_version, promotion_pending, promo_square, promo_from, game_over, winner_name, opponent_connected, confirmed_clock, history, view_ply, review_board
         error_message = ""
         selected_square = None
         legal_moves = []
-        board = chess.Board(board_fen)
+        predictor.reset(chess.Board(), 0)
+        confirmed_clock = None
+        history = GameReplay()
+        view_ply = None
+        review_board = None
+        board_version += 1
         promotion_pending = None
         promo_square = None
         promo_from = None
@@ -197,18 +336,76 @@ def gui_main(sock, player_color, player_name):
         winner_name = None
         opponent_connected = False
 
+    def play(move):
+        """
+        Show the move at once and send it; the server's move event confirms it.
+        """
+        nonlocal error_message, selected_square, legal_moves, board_version, player_times, active_timer, last_update_time, confirmed_clock
+        selected_square = None
+        legal_moves = []
+        cseq = predictor.predict(move)
+        if cseq is None:
+            # Never sent: the server would only reject it
+            error_message = f"Illegal move: {move.uci()}"
+            return
+        link.send('move', {'move': move.uci(), 'cseq': cseq})
+        board_version += 1
+        error_message = ""
+        # Pass the clock to the opponent as the server will
+        now = time.monotonic()
+        if confirmed_clock is None:
+            confirmed_clock = (player_times, active_timer, last_update_time)
+        if active_timer == player_color:
+            player_times = dict(player_times)
+            player_times[player_color] = max(0, player_times[player_color] - (now - last_update_time))
+        active_timer = 'black' if player_color == 'white' else 'white'
+        last_update_time = now
+
+    def review(ply):
+        """
+        Show the position after ply from the local history, or the live board for None
+        or the last ply. No request goes to the server.
+        """
+        nonlocal view_ply, review_board, board_version, selected_square, legal_moves
+        if history is None:
+            return
+        if ply is None or ply >= len(history):
+            view_ply = None
+            review_board = None
+        else:
+            view_ply = max(0, ply)
+            review_board = history.board_at(view_ply)
+        board_version += 1
+        selected_square = None
+        legal_moves = []
+
+    def next_wake_ms():
+        # While a clock runs, wake when its displayed second changes; otherwise only for events
+        if active_timer and not game_over and opponent_connected and player_times[active_timer] > 0:
+            left = player_times[active_timer] - (time.monotonic() - last_update_time)
+            return max(10, int((left % 1) * 1000) + 5)
+        return IDLE_WAKE_MS
+
+    gui_inbox.attach()
     running = True
     while running:
-        for event in pygame.event.get():
+        # Sleep until input, a NETWORK_EVENT from the receive thread, or the next clock tick
+        events = [pygame.event.wait(next_wake_ms())]
+        events.extend(pygame.event.get())
+        for event in events:
             if event.type == pygame.QUIT:
                 running = False
+            elif event.type == pygame.KEYDOWN and event.key in review_keys:
+                if history is not None:
+                    current = len(history) if view_ply is None else view_ply
+                    review({pygame.K_LEFT: current - 1, pygame.K_RIGHT: current + 1,
+                            pygame.K_HOME: 0, pygame.K_END: None}[event.key])
             elif event.type == pygame.KEYDOWN and not game_over:
                 if input_active:
                     if event.key == pygame.K_RETURN:
                         if input_text.strip():
-                            msg = make_message('chat', {'text': input_text})
-                            sock.sendall(msg)
-                            chat_lines.append(f"You: {input_text}")
+                            # Shown when the server sends it back with the room's other chat
+                            link.send('chat', {'text': input_text})
                             input_text = ""
                     elif event.key == pygame.K_BACKSPACE:
                         input_text = input_text[:-1]
@@ -220,6 +417,10 @@ def gui_main(sock, player_color, player_name):
                     reset_game()
             elif event.type == pygame.MOUSEBUTTONDOWN and not game_over:
                 mouse_x, mouse_y = event.pos
+                if view_ply is not None:
+                    # A click while reviewing returns to the game instead of moving
+                    review(None)
+                    continue
                 if not opponent_connected:
                     error_message = "Waiting for the opponent to join."
                     continue
@@ -230,14 +431,10 @@ def gui_main(sock, player_color, player_name):
                         py = 100
                         if px <= mouse_x <= px+48 and py <= mouse_y <= py+48:
                             move = chess.Move(promo_from, promo_square, promotion={'q': chess.QUEEN, 'r': chess.ROOK, 'b': chess.BISHOP, 'n': chess.KNIGHT}[p])
-                            move_uci = move.uci()
-                            msg = make_message('move', {'move': move_uci})
-                            sock.sendall(msg)
                             promotion_pending = None
                             promo_square = None
                             promo_from = None
-                            selected_square = None
-                            legal_moves = []
+                            play(move)
                 elif mouse_x < BOARD_SIZE and mouse_y < BOARD_SIZE:
                     col = mouse_x // (BOARD_SIZE // 8)
                     row = 7 - (mouse_y // (BOARD_SIZE // 8))
@@ -245,7 +442,7 @@ def gui_main(sock, player_color, player_name):
                         col = 7 - col
                         row = 7 - row
                     square = chess.square(col, row)
-                    board = chess.Board(board_fen)
+                    board = predictor.board
                     if selected_square is None:
                         piece = board.piece_at(square)
                         if piece and ((board.turn and piece.color and player_color == 'white') or (not board.turn and not piece.color and player_color == 'black')):
@@ -258,47 +455,89 @@ def gui_main(sock, player_color, player_name):
                                 promo_square = square
                                 promo_from = selected_square
                             else:
-                                move = chess.Move(selected_square, square)
-                                move_uci = move.uci()
-                                msg = make_message('move', {'move': move_uci})
-                                sock.sendall(msg)
-                                selected_square = None
-                                legal_moves = []
+                                play(chess.Move(selected_square, square))
                         else:
                             selected_square = None
                             legal_moves = []
-        while not gui_message_queue.empty():
-            msg = gui_message_queue.get()
-            if msg.startswith('{'):
+        # Everything the receive thread decoded since the last wakeup, already coalesced
+        for net_event in gui_inbox.drain():
+            if isinstance(net_event, BoardSnapshot):
+                content = net_event.content
+                # Full snapshot, sent on join or after we asked to resync
+                predictor.reset(chess.Board(content.get('fen', chess.STARTING_FEN)),
+                                content.get('ply', len(content.get('history', []))))
+                confirmed_clock = None
                 try:
-                    msg_obj = parse_message(msg)
-                    if msg_obj['type'] == 'board':
-                        board_fen = msg_obj['content'].get('fen', board_fen)
-                        board = chess.Board(board_fen)
+                    history = GameReplay.from_uci(content['history'])
+                except (KeyError, ValueError):
+                    history = None
+                if history is not None and len(history) != predictor.ply:
+                    history = None
+                view_ply = None
+                review_board = None
+                board_version += 1
+                resync_requested = False
+                error_message = ""
+                selected_square = None
+                legal_moves = []
+                game_over = content.get('game_over', False)
+                winner_name = content.get('winner', None)
+                # Detect if both players are connected (if both white and black have joined)
+                if 'turn' in content:
+                    opponent_connected = True
+                # Update timers
+                if 'player_times' in content:
+                    player_times = content['player_times']
+                if 'turn' in content:
+                    active_timer = content['turn']
+                last_update_time = time.monotonic()
+            elif isinstance(net_event, MoveDelta):
+                content = net_event.content
+                # Delta for a single ply; anything out of order means we missed one
+                if resync_requested or not isinstance(content.get('ply'), int) or not isinstance(content.get('move'), str):
+                    continue
+                outcome = predictor.confirm(content['ply'], content.get('move'))
+                if outcome == GAP:
+                    link.send('resync', {})
+                    resync_requested = True
+                elif outcome != STALE:
+                    if history is not None:
+                        history.push(chess.Move.from_uci(content['move']))
+                    if outcome == APPLIED:
+                        # The opponent's move, or the server overruled our prediction
+                        board_version += 1
                         error_message = ""
                         selected_square = None
                         legal_moves = []
-                        game_over = msg_obj['content'].get('game_over', False)
-                        winner_name = msg_obj['content'].get('winner', None)
-                        # Detect if both players are connected (if both white and black have joined)
-                        if 'turn' in msg_obj['content']:
-                            opponent_connected = True
-                        # Update timers
-                        if 'player_times' in msg_obj['content']:
-                            player_times = msg_obj['content']['player_times']
-                        if 'turn' in msg_obj['content']:
-                            active_timer = msg_obj['content']['turn']
-                        last_update_time = time.time()
-                    elif msg_obj['type'] == 'error':
-                        error_message = msg_obj['content'].get('text', '')
-                    elif msg_obj['type'] == 'chat':
-                        chat_lines.append(f"{msg_obj['content'].get('sender', 'Server')}: {msg_obj['content'].get('text', '')}")
-                except Exception:
-                    chat_lines.append(msg)
-            else:
-                chat_lines.append(msg)
+                    if not predictor.pending:
+                        confirmed_clock = None
+                    game_over = content.get('game_over', False)
+                    winner_name = content.get('winner', None)
+                    opponent_connected = True
+                    player_times = content.get('player_times', player_times)
+                    active_timer = content.get('turn', active_timer)
+                    last_update_time = time.monotonic()
+            elif isinstance(net_event, GameOver):
+                if predictor.rollback():
+                    board_version += 1
+                confirmed_clock = None
+                game_over = True
+                winner_name = net_event.content.get('winner', None)
+                player_times = net_event.content.get('player_times', player_times)
+                last_update_time = time.monotonic()
+            elif isinstance(net_event, ServerError):
+                error_message = net_event.text
+                if net_event.cseq is not None and predictor.reject(net_event.cseq):
+                    board_version += 1
+                    if confirmed_clock is not None and not predictor.pending:
+                        player_times, active_timer, last_update_time = confirmed_clock
+                        confirmed_clock = None
+            elif isinstance(net_event, ChatLine):
+                chat_lines.append(net_event.text)
+            elif isinstance(net_event, ChatBatch):
+                chat_lines.extend(net_event.lines)
         # Timer update (client-side smooth display)
-        now = time.time()
+        now = time.monotonic()
         if active_timer and not game_over and opponent_connected:
             if player_times[active_timer] > 0:
                 elapsed = now - last_update_time
@@ -309,57 +548,88 @@ def gui_main(sock, player_color, player_name):
                 show_times = player_times.copy()
         else:
             show_times = player_times.copy()
-        # Draw everything
-        screen.fill(WHITE)
-        draw_board(screen, board_fen, selected_square, legal_moves, flipped)
-        draw_chat_right(screen, font, chat_lines, input_text)
-        # Draw timers (both at the bottom)
-        timer_font = pygame.font.SysFont(None, 36)
-        # Show your timer and opponent's timer side by side at the bottom
-        if player_color == 'white':
-            my_time = show_times['white']
-            opp_time = show_times['black']
-            my_label = "Your Time"
-            opp_label = "Opponent Time"
-        else:
-            my_time = show_times['black']
-            opp_time = show_times['white']
-            my_label = "Your Time"
-            opp_label = "Opponent Time"
-        # Draw a white rectangle at the bottom for timers
-        pygame.draw.rect(screen, WHITE, (0, BOARD_SIZE, BOARD_SIZE, WINDOW_HEIGHT - BOARD_SIZE))
-        my_time_surface = timer_font.render(f"{my_label}: {format_time(my_time)}", True, (0,0,0))
-        opp_time_surface = timer_font.render(f"{opp_label}: {format_time(opp_time)}", True, (0,0,0))
-        # Center both timers horizontally at the bottom
-        total_width = my_time_surface.get_width() + 40 + opp_time_surface.get_width()
-        start_x = (BOARD_SIZE - total_width) // 2
-        y_pos = BOARD_SIZE + 20
-        screen.blit(my_time_surface, (start_x, y_pos))
-        screen.blit(opp_time_surface, (start_x + my_time_surface.get_width() + 40, y_pos))
-        if promotion_pending:
-            promo_pieces = ['q', 'r', 'b', 'n']
-            for idx, p in enumerate(promo_pieces):
-                img = get_piece_image(p.upper() if player_color == 'white' else p)
-                px = BOARD_SIZE + 40 + idx * 60
-                py = 100
-                screen.blit(img, (px, py))
-        # Show waiting message in the bottom white area if opponent not connected
-        if not opponent_connected and not game_over:
-            # Only show the waiting message if the game hasn't started (i.e., both players not connected)
-            wait_surface = font.render("Waiting for the opponent to join...", True, (0,0,200))
-            pygame.draw.rect(screen, WHITE, (0, BOARD_SIZE, BOARD_SIZE, WINDOW_HEIGHT - BOARD_SIZE))
-            screen.blit(wait_surface, (20, BOARD_SIZE + 20))
+        dirty = []
+        if drawn_board is None:
+            # First frame: start from a blank window
+            screen.fill(WHITE)
+            dirty.append(screen.get_rect())
+        # Board: only squares whose piece or highlight changed are repainted and copied
+        board_state = (board_version, selected_square, tuple(legal_moves))
+        board_changed = board_state != drawn_board
+        if board_changed:
+            for rect in renderer.update(predictor.board if view_ply is None else review_board, selected_square, legal_moves):
+                screen.blit(renderer.surface, rect, rect)
+                dirty.append(rect)
+            drawn_board = board_state
+        # Text drawn over the board
+        overlays = []
+        if view_ply is not None:
+            overlays.append((f"Move {view_ply} of {len(history)}. Left/Right to step, End to return.", (0, 0, 160), (10, 10)))
         # Only show error_message if it's not the waiting-for-opponent message and opponent is connected
         if error_message and (opponent_connected or error_message != "Waiting for the opponent to join."):
-            err_surface = font.render(error_message, True, (200,0,0))
-            screen.blit(err_surface, (10, BOARD_SIZE - 60))
+            overlays.append((error_message, (200, 0, 0), (10, BOARD_SIZE - 60)))
         if game_over:
             end_text = f"{winner_name} Won the game! Press 'R' to reset." if winner_name else "Draw! Press 'R' to reset."
-            end_surface = font.render(end_text, True, (0, 128, 0))
-            screen.blit(end_surface, (BOARD_SIZE//2 - 120, BOARD_SIZE//2 - 20))
-        pygame.display.flip()
-        clock.tick(30)
-    sock.close()
+            overlays.append((end_text, (0, 128, 0), (BOARD_SIZE//2 - 120, BOARD_SIZE//2 - 20)))
+        overlays = tuple(overlays)
+        if overlays != drawn_overlays or (overlays and board_changed):
+            # Restore the squares under the old text, then draw the new text on top
+            for rect in overlay_rects:
+                screen.blit(renderer.surface, rect, rect)
+                dirty.append(rect)
+            screen.set_clip(board_rect)
+            overlay_rects = []
+            for text, color, pos in overlays:
+                rect = screen.blit(text_cache.render(font, text, color), pos).clip(board_rect)
+                overlay_rects.append(rect)
+                dirty.append(rect)
+            screen.set_clip(None)
+            drawn_overlays = overlays
+        # Chat panel, with the promotion choices drawn over it
+        chat_state = (len(chat_lines), input_text, promotion_pending)
+        if chat_state != drawn_chat:
+            draw_chat_right(screen, font, chat_lines, input_text, text_cache)
+            if promotion_pending:
+                promo_pieces = ['q', 'r', 'b', 'n']
+                for idx, p in enumerate(promo_pieces):
+                    img = promo_images[p.upper() if player_color == 'white' else p]
+                    px = BOARD_SIZE + 40 + idx * 60
+                    py = 100
+                    screen.blit(img, (px, py))
+            dirty.append(chat_rect)
+            drawn_chat = chat_state
+        # Timers (both at the bottom); redrawn only when a displayed second ticks over
+        if not opponent_connected and not game_over:
+            # Show waiting message in the bottom white area until the game has started
+            timer_state = ("Waiting for the opponent to join...",)
+        else:
+            # Show your timer and opponent's timer side by side at the bottom
+            if player_color == 'white':
+                my_time = show_times['white']
+                opp_time = show_times['black']
+            else:
+                my_time = show_times['black']
+                opp_time = show_times['white']
+            timer_state = (f"Your Time: {format_time(my_time)}", f"Opponent Time: {format_time(opp_time)}")
+        if timer_state != drawn_timers:
+            pygame.draw.rect(screen, WHITE, timer_rect)
+            if len(timer_state) == 1:
+                wait_surface = text_cache.render(font, timer_state[0], (0, 0, 200))
+                screen.blit(wait_surface, (20, BOARD_SIZE + 20))
+            else:
+                my_time_surface = text_cache.render(timer_font, timer_state[0], BLACK)
+                opp_time_surface = text_cache.render(timer_font, timer_state[1], BLACK)
+                # Center both timers horizontally at the bottom
+                total_width = my_time_surface.get_width() + 40 + opp_time_surface.get_width()
+                start_x = (BOARD_SIZE - total_width) // 2
+                y_pos = BOARD_SIZE + 20
+                screen.blit(my_time_surface, (start_x, y_pos))
+                screen.blit(opp_time_surface, (start_x + my_time_surface.get_width() + 40, y_pos))
+            dirty.append(timer_rect)
+            drawn_timers = timer_state
+        if dirty:
+            pygame.display.update(dirty)
+    link.close()
     pygame.quit()
     sys.exit()
 
@@ -413,12 +683,12 @@ def show_help_window(parent):
     help_win.grab_set()
     parent.wait_window(help_win)
 
-def get_connection_info():
+def get_connection_info(preconnect):
     import tkinter as tk
     from tkinter import messagebox
     root = tk.Tk()
     root.title("Welcome to Chess")
-    root.geometry("480x350")
+    root.geometry("480x390")
     root.configure(bg="#f0e6d2")
     # Greeting
     tk.Label(root, text="Hello Chess Master!!", font=("Arial", 20, "bold"), bg="#f0e6d2").pack(pady=10)
@@ -434,9 +704,20 @@ def get_connection_info():
     port_entry = tk.Entry(form, font=("Arial", 12))
     port_entry.grid(row=1, column=1, pady=5)
     port_entry.insert(0, str(default_server_port))
+    def on_address_changed(event=None):
+        try:
+            preconnect.start(ip_entry.get().strip(), int(port_entry.get().strip()))
+        except ValueError:
+            pass
+    ip_entry.bind("<FocusOut>", on_address_changed)
+    port_entry.bind("<FocusOut>", on_address_changed)
+    on_address_changed()
     tk.Label(form, text="Your Name:", font=("Arial", 12), bg="#f0e6d2").grid(row=2, column=0, sticky="e", pady=5)
     name_entry = tk.Entry(form, font=("Arial", 12))
     name_entry.grid(row=2, column=1, pady=5)
+    tk.Label(form, text="Room (optional):", font=("Arial", 12), bg="#f0e6d2").grid(row=3, column=0, sticky="e", pady=5)
+    room_entry = tk.Entry(form, font=("Arial", 12))
+    room_entry.grid(row=3, column=1, pady=5)
     # Buttons
     btn_frame = tk.Frame(root, bg="#f0e6d2")
     btn_frame.pack(pady=10)
@@ -444,6 +725,7 @@ def get_connection_info():
         ip = ip_entry.get().strip()
         port = port_entry.get().strip()
         name = name_entry.get().strip()
+        room = room_entry.get().strip()
         if not ip or not port or not name:
             messagebox.showerror("Error", "All fields are required.")
             return
@@ -456,6 +738,7 @@ def get_connection_info():
         nonlocal_ip[0] = ip
         nonlocal_port[0] = port_int
         nonlocal_name[0] = name
+        nonlocal_room[0] = room or None
     def on_help():
         show_help_window(root)
     connect_btn = tk.Button(btn_frame, text="Connect", font=("Arial", 13, "bold"), bg="#b8e994", command=on_connect, width=10)
@@ -468,31 +751,66 @@ def get_connection_info():
     nonlocal_ip = [None]
     nonlocal_port = [None]
     nonlocal_name = [None]
+    nonlocal_room = [None]
     root.mainloop()
     if not (nonlocal_ip[0] and nonlocal_port[0] and nonlocal_name[0]):
         sys.exit(0)
-    return nonlocal_ip[0], nonlocal_port[0], nonlocal_name[0]
+    return nonlocal_ip[0], nonlocal_port[0], nonlocal_name[0], nonlocal_room[0]
 
 def main():
-    ip, port, player_name = get_connection_info()
-    sock = connect_to_server(ip, port)
-    if not sock:
-        return
-    # Send player name to server
-    join_msg = make_message('join', {'name': player_name})
-    sock.sendall(join_msg)
-    # Receive color assignment
-    color_msg = sock.recv(1024)
-    color_info = parse_message(color_msg.decode())
+    # The game window's imports load while the player fills in the welcome window
+    loader = threading.Thread(target=load_gui, daemon=True)
+    loader.start()
+    preconnect = Preconnect()
+    ip, port, player_name, room_id = get_connection_info(preconnect)
+    # Send player name to server; without a room id the server seats us in its default room
+    if room_id:
+        join_msg = make_join_room(player_name, room_id, encodings=ENCODINGS)
+    else:
+        join_msg = make_message('join', {'name': player_name, 'encodings': list(ENCODINGS)})
+    sock = preconnect.take(ip, port)
+    if sock is not None:
+        try:
+            sock.sendall(join_msg)
+        except OSError:
+            # The server dropped the connection while the window was open
+            sock.close()
+            sock = None
+    if sock is None:
+        sock = connect_to_server(ip, port)
+        if not sock:
+            return
+        sock.sendall(join_msg)
+    loader.join()
+    # Receive color assignment; a connection opened early may have been pinged already
+    decoder = MessageDecoder()
+    pending = []
+    color_info = None
+    while color_info is None:
+        messages = decoder.recv_from(sock)
+        if messages is None:
+            print("Server closed the connection.")
+            return
+        for msg_obj in messages:
+            if color_info is not None:
+                pending.append(msg_obj)
+            elif msg_obj['type'] == 'ping':
+                sock.sendall(make_message('pong', {'id': (msg_obj.get('content') or {}).get('id')}))
+            else:
+                color_info = msg_obj
+    link = ServerLink(ip, port, sock)
     if color_info['type'] == 'color':
         player_color = color_info['content']['color']
+        link.room = color_info['content'].get('room')
+        link.session = color_info['content'].get('session')
+        link.encoding = color_info['content'].get('encoding', JSON)
     else:
-        print("Failed to get color assignment from server.")
+        print(f"Failed to get color assignment from server: {color_info['content'].get('text', '')}")
         return
     # Start thread to receive messages
-    threading.Thread(target=receive_messages, args=(sock,), daemon=True).start()
-    # Start GUI
-    gui_main(sock, player_color, player_name)
+    threading.Thread(target=receive_messages, args=(link, decoder, pending), daemon=True).start()
+    # Start GUI; it sends through the link, which outlives any one socket
+    gui_main(link, player_color, player_name)
 
 if __name__ == "__main__":
     main()
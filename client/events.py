@@ -0,0 +1,84 @@
+import collections
+import threading
+import pygame
+
+# Posted to the pygame event queue when the network thread has queued new events
+NETWORK_EVENT = pygame.USEREVENT + 1
+
+# What the receive thread hands to the GUI; each server frame is decoded into one of these once
+ChatLine = collections.namedtuple('ChatLine', 'text')
+ChatBatch = collections.namedtuple('ChatBatch', 'lines')
+BoardSnapshot = collections.namedtuple('BoardSnapshot', 'content')
+MoveDelta = collections.namedtuple('MoveDelta', 'content')
+GameOver = collections.namedtuple('GameOver', 'content')
+ServerError = collections.namedtuple('ServerError', 'text cseq')
+
+def decode_event(msg_obj):
+    """
+    Turn a parsed server message into the event the GUI acts on, or None to ignore it.
+    """
+    msg_type = msg_obj['type']
+    content = msg_obj.get('content')
+    if not isinstance(content, dict):
+        content = {}
+    if msg_type == 'board':
+        return BoardSnapshot(content)
+    if msg_type == 'move':
+        return MoveDelta(content)
+    if msg_type == 'game_over':
+        return GameOver(content)
+    if msg_type == 'error':
+        return ServerError(content.get('text', ''), content.get('cseq'))
+    if msg_type == 'chat':
+        return ChatLine(f"{content.get('sender', 'Server')}: {content.get('text', '')}")
+    if msg_type == 'chat_batch':
+        return ChatBatch([f"{line.get('sender', 'Server')}: {line.get('text', '')}"
+                          for line in content.get('lines') or [] if isinstance(line, dict)])
+    return None
+
+class EventInbox:
+    """
+    Events from the receive thread waiting for the GUI.
+    A board snapshot carries the whole game, so queuing one drops any snapshot or move
+    delta still waiting before it. The GUI is woken with one NETWORK_EVENT per batch
+    rather than checking the inbox every frame.
+    """
+    def __init__(self):
+        self.events = collections.deque()
+        self.lock = threading.Lock()
+        self.attached = False
+        self.coalesced = 0
+
+    def attach(self):
+        """
+        Called by the GUI once pygame is initialised; wakes it if events arrived before that.
+        """
+        with self.lock:
+            self.attached = True
+            wake = bool(self.events)
+        if wake:
+            self.wake()
+
+    def put(self, event):
+        with self.lock:
+            if isinstance(event, BoardSnapshot) and self.events:
+                kept = [e for e in self.events if not isinstance(e, (BoardSnapshot, MoveDelta))]
+                self.coalesced += len(self.events) - len(kept)
+                self.events = collections.deque(kept)
+            wake = self.attached and not self.events
+            self.events.append(event)
+        if wake:
+            self.wake()
+
+    def wake(self):
+        try:
+            pygame.event.post(pygame.event.Event(NETWORK_EVENT))
+        except pygame.error:
+            # Event queue full or display gone; the GUI's wait timeout picks the events up
+            pass
+
+    def drain(self):
+        with self.lock:
+            events = self.events
+            self.events = collections.deque()
+        return events
@@ -0,0 +1,94 @@
+import collections
+import itertools
+import chess
+
+# What reconciling a server move event did to the predicted board
+APPLIED = 'applied'      # the server's move was new to us; the board changed
+CONFIRMED = 'confirmed'  # it was our own predicted move; the board already shows it
+STALE = 'stale'          # a ply we already have
+GAP = 'gap'              # plies are missing; ask the server to resync
+
+class MovePredictor:
+    """
+    The board the player sees: the last position the server confirmed, with this
+    client's own moves applied on top as soon as they are made instead of a round trip
+    later.
+    Each predicted move gets a client sequence number (cseq) sent along with it. Move
+    events from the server confirm predictions in order; a different move for the
+    same ply, or an error naming a cseq, rolls the board back to the server's state.
+    """
+    def __init__(self):
+        self.cseqs = itertools.count(1)
+        self.reset(chess.Board(), 0)
+
+    def reset(self, board, ply):
+        """
+        Adopt a full snapshot from the server. Predictions made before it are dropped:
+        the snapshot is what the server has, and a move still in flight is answered
+        with its own event or error.
+        """
+        self.board = board
+        self.ply = ply
+        self.confirmed_ply = ply
+        self.pending = collections.deque()  # (cseq, ply, uci) not yet confirmed, oldest first
+
+    def is_legal(self, move):
+        return move in self.board.legal_moves
+
+    def predict(self, move):
+        """
+        Apply one of the player's moves locally. Returns its cseq, or None if the move is
+        not legal here, in which case it must not be sent.
+        """
+        if not self.is_legal(move):
+            return None
+        cseq = next(self.cseqs)
+        self.board.push(move)
+        self.ply += 1
+        self.pending.append((cseq, self.ply, move.uci()))
+        return cseq
+
+    def confirm(self, ply, move_uci):
+        """
+        Reconcile a move event from the server; returns APPLIED, CONFIRMED, STALE or GAP.
+        """
+        if ply <= self.confirmed_ply:
+            return STALE
+        if ply != self.confirmed_ply + 1:
+            return GAP
+        if self.pending:
+            # Pending moves always start at the ply after the confirmed one
+            if self.pending[0][2] == move_uci:
+                self.pending.popleft()
+                self.confirmed_ply = ply
+                return CONFIRMED
+            self.rollback()
+        try:
+            self.board.push_uci(move_uci)
+        except ValueError:
+            return GAP
+        self.ply = self.confirmed_ply = ply
+        return APPLIED
+
+    def reject(self, cseq=None):
+        """
+        Undo the move the server rejected and every move predicted after it; with no
+        cseq, undo them all. Returns the number of moves undone.
+        """
+        index = 0
+        if cseq is not None:
+            for index, (pending_cseq, _, _) in enumerate(self.pending):
+                if pending_cseq == cseq:
+                    break
+            else:
+                return 0
+        undone = 0
+        while len(self.pending) > index:
+            self.pending.pop()
+            self.board.pop()
+            self.ply -= 1
+            undone += 1
+        return undone
+
+    def rollback(self):
+        return self.reject()
@@ -1,39 +1,168 @@
+# This module will contain shared GUI utilities, chat logic, and other common code for both client and server.
+# Start with a placeholder for future shared code.
+
+# Example: Common message protocol (JSON), chat utilities, etc.
+
+from array import array
 import chess
 import chess.engine
+from common.position_cache import position_cache
+
+# Moves are stored as 16-bit codes: from square (6 bits), to square (6 bits) and the
+# promotion piece type (3 bits, 0 for none).
+def pack_move(move):
+    return move.from_square | (move.to_square << 6) | ((move.promotion or 0) << 12)
+
+def unpack_move(code):
+    return chess.Move(code & 0x3F, (code >> 6) & 0x3F, (code >> 12) or None)
 
 class ChessGame:
-    def __init__(self):
+    """
+    Server-side state of one game, kept small so a process can hold many thousands.
+    The history is a packed array('H') of move codes; the board does not keep its
+    own move stack, and UCI/SAN strings are only rendered when asked for.
+    """
+    __slots__ = ('board', 'winner', 'moves', 'repetitions', 'cache', 'position', 'game_over')
+
+    def __init__(self, cache=None):
         self.board = chess.Board()
-        self.turn = 'white'  # or 'black'
         self.winner = None
-        self.move_history = []
+        self.moves = array('H')
+        self.cache = position_cache if cache is None else cache
+        # Legal moves and terminal status of the current position, from the shared cache
+        self.position = self.cache.lookup(self.board)
+        # Zobrist keys of the positions since the last capture or pawn move
+        self.repetitions = array('Q', (self.position.key,))
+        self.game_over = False
+
+    @property
+    def turn(self):
+        return 'white' if self.board.turn == chess.WHITE else 'black'
+
+    @property
+    def move_history(self):
+        return self.get_move_history()
 
     def is_legal_move(self, move_uci):
-        try:
-            move = chess.Move.from_uci(move_uci)
-            return move in self.board.legal_moves
-        except Exception:
-            return False
+        # Moves come straight from clients; a list or dict would not even hash
+        return isinstance(move_uci, str) and move_uci in self.position.legal
 
     def push_move(self, move_uci):
-        if self.is_legal_move(move_uci):
-            move = chess.Move.from_uci(move_uci)
-            self.board.push(move)
-            self.move_history.append(move_uci)
-            if self.board.is_checkmate():
-                self.winner = 'white' if self.turn == 'black' else 'black'
-            self.turn = 'black' if self.turn == 'white' else 'white'
+        move = self.position.legal.get(move_uci) if isinstance(move_uci, str) else None
+        if move is None:
+            return False
+        mover = self.turn
+        board = self.board
+        board.push(move)
+        # The packed history is the only copy we keep
+        board.clear_stack()
+        self.moves.append(pack_move(move))
+        self.position = self.cache.lookup(board)
+        if board.halfmove_clock == 0:
+            # Positions before an irreversible move can never repeat
+            del self.repetitions[:]
+        self.repetitions.append(self.position.key)
+        if self.position.status == 'checkmate':
+            self.winner = mover
+        self.game_over = self.position.status is not None or self.history_ends_game()
+        return True
+
+    def history_ends_game(self):
+        """
+        The automatic draws that depend on how the position was reached: the
+        seventy-five-move rule and fivefold repetition.
+        """
+        if self.board.is_seventyfive_moves():
             return True
-        return False
+        return len(self.repetitions) >= 17 and self.repetitions.count(self.position.key) >= 5
 
     def get_board_fen(self):
         return self.board.fen()
 
     def get_move_history(self):
-        return self.move_history
+        return [unpack_move(code).uci() for code in self.moves]
+
+    def get_san_history(self):
+        board = chess.Board()
+        san = []
+        for code in self.moves:
+            move = unpack_move(code)
+            san.append(board.san(move))
+            board.push(move)
+        return san
+
+    def ply(self):
+        return len(self.moves)
 
     def is_game_over(self):
-        return self.board.is_game_over()
+        return self.game_over
 
     def get_winner(self):
         return self.winner
+
+CHECKPOINT_INTERVAL = 16
+
+class GameReplay:
+    """
+    A game's moves with a copy of the board every interval plies, so the position at
+    any ply is a checkpoint copy plus fewer than interval pushes instead of a replay
+    from the start. Moves can be appended as the game goes on.
+    """
+    __slots__ = ('interval', 'moves', 'checkpoints', 'board')
+
+    def __init__(self, interval=CHECKPOINT_INTERVAL):
+        self.interval = interval
+        self.moves = array('H')
+        self.board = chess.Board()  # the position after the last move
+        self.checkpoints = [self.board.copy(stack=False)]
+
+    @classmethod
+    def from_codes(cls, codes, interval=CHECKPOINT_INTERVAL):
+        replay = cls(interval)
+        for code in codes:
+            replay.push(unpack_move(code))
+        return replay
+
+    @classmethod
+    def from_uci(cls, history, interval=CHECKPOINT_INTERVAL):
+        replay = cls(interval)
+        for move_uci in history:
+            replay.push(chess.Move.from_uci(move_uci))
+        return replay
+
+    def push(self, move):
+        self.board.push(move)
+        self.board.clear_stack()
+        self.moves.append(pack_move(move))
+        if len(self.moves) % self.interval == 0:
+            self.checkpoints.append(self.board.copy(stack=False))
+
+    def extend_codes(self, codes):
+        """
+        Append the moves of codes past the ones already here; codes is the whole
+        history, such as a ChessGame's moves.
+        """
+        for code in codes[len(self.moves):]:
+            self.push(unpack_move(code))
+
+    def board_at(self, ply):
+        """
+        A new board with the position after ply moves; ply is clamped to the game.
+        """
+        ply = max(0, min(ply, len(self.moves)))
+        if ply == len(self.moves):
+            return self.board.copy(stack=False)
+        index = ply // self.interval
+        board = self.checkpoints[index].copy(stack=False)
+        for code in self.moves[index * self.interval:ply]:
+            board.push(unpack_move(code))
+        return board
+
+    def move_at(self, ply):
+        """
+        The move that led to ply (1 for the first move).
+        """
+        return unpack_move(self.moves[ply - 1])
+
+    def __len__(self):
+        return len(self.moves)
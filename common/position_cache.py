@@ -0,0 +1,74 @@
+import collections
+import threading
+import chess
+import chess.polyglot
+
+# About 5.5 KB a position (mostly the legal-move dict), so some 55 MiB when full;
+# python -m tools.bench_game_memory measures it
+DEFAULT_MAX_POSITIONS = 10_000
+
+class PositionInfo:
+    """
+    What a game needs to know about a position that does not depend on how it was reached.
+    legal: dict of UCI string -> chess.Move for every legal move
+    status: None, 'checkmate', 'stalemate' or 'insufficient_material'
+    """
+    __slots__ = ('key', 'legal', 'status', 'check')
+
+    def __init__(self, key, board):
+        self.key = key
+        self.legal = {move.uci(): move for move in board.legal_moves}
+        self.check = board.is_check()
+        if not self.legal:
+            self.status = 'checkmate' if self.check else 'stalemate'
+        elif board.is_insufficient_material():
+            self.status = 'insufficient_material'
+        else:
+            self.status = None
+
+class PositionCache:
+    """
+    Bounded LRU of PositionInfo keyed by the position's Zobrist hash, shared by all games.
+    Rooms playing the same openings hit the same entries, so validating a move in a
+    common position is a dict lookup instead of a legal-move generation.
+    """
+    def __init__(self, max_positions=DEFAULT_MAX_POSITIONS):
+        self.max_positions = max_positions
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def lookup(self, board):
+        key = chess.polyglot.zobrist_hash(board)
+        with self.lock:
+            info = self.entries.get(key)
+            if info is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return info
+            self.misses += 1
+        info = PositionInfo(key, board)
+        with self.lock:
+            self.entries[key] = info
+            if len(self.entries) > self.max_positions:
+                self.entries.popitem(last=False)
+        return info
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'positions': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+# Shared by every ChessGame in the process
+position_cache = PositionCache()
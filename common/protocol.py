@@ -1,19 +1,227 @@
 import json
+import struct
+from common.wire import BINARY, JSON, CODE_TYPES, encode_payload, decode_payload
 
-def make_message(msg_type, content):
+# Every frame on the wire is a 4-byte big-endian payload length followed by the payload.
+FRAME_HEADER = struct.Struct('!I')
+MAX_FRAME_SIZE = 1 << 20  # 1 MiB, far above any legitimate board/history payload
+RECV_SIZE = 64 * 1024
+JSON_TYPE_PREFIX = b'{"type":"'  # how every JSON payload from make_message starts
+
+def make_message(msg_type, content, encoding=JSON):
     """
-    Create a JSON-encoded message for sending over the socket.
+    Create a length-prefixed frame for sending over the socket.
     msg_type: 'chat', 'move', etc.
     content: dictionary with message data
+    encoding: BINARY packs the message with common.wire when it has a binary form;
+    anything else is JSON.
+    """
+    payload = encode_payload(msg_type, content) if encoding == BINARY else None
+    if payload is None:
+        payload = json.dumps({'type': msg_type, 'content': content}, separators=(',', ':')).encode()
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+def frame_type(frame):
+    """
+    The type of a frame built by make_message, read from its first bytes rather than by
+    parsing it; 'unknown' if they do not say.
     """
-    return json.dumps({'type': msg_type, 'content': content}).encode()
+    start = FRAME_HEADER.size + len(JSON_TYPE_PREFIX)
+    if frame[FRAME_HEADER.size:start] == JSON_TYPE_PREFIX:
+        end = frame.find(b'"', start)
+        if end > start:
+            return frame[start:end].decode(errors='replace')
+    elif len(frame) > FRAME_HEADER.size:
+        return CODE_TYPES.get(frame[FRAME_HEADER.size], 'unknown')
+    return 'unknown'
 
 def parse_message(data):
     """
-    Parse a JSON-encoded message received from the socket.
+    Parse a message payload (without the length prefix), JSON or binary.
     Returns a dictionary with 'type' and 'content'.
     """
     try:
-        return json.loads(data)
+        if data[:1] == b'{':
+            return json.loads(data)
+        return decode_payload(data)
     except Exception:
         return {'type': 'invalid', 'content': {}}
+
+class Frame:
+    """
+    A message sent to many connections, encoded at most once per wire encoding: a
+    broadcast to a room of JSON and binary clients encodes it twice, not per member.
+    Connections turn it into bytes with encode() as it is queued.
+    """
+    __slots__ = ('msg_type', 'content', 'json', 'binary')
+
+    def __init__(self, msg_type, content):
+        self.msg_type = msg_type
+        self.content = content
+        self.json = None
+        self.binary = None
+
+    def encode(self, encoding=JSON):
+        if encoding == BINARY:
+            if self.binary is None:
+                self.binary = make_message(self.msg_type, self.content, BINARY)
+            return self.binary
+        if self.json is None:
+            self.json = make_message(self.msg_type, self.content)
+        return self.json
+
+# Lobby messages (client -> server). A plain 'join' seats the client in the default room.
+#   create_room: {'name', 'room' (optional id), 'time_limit' (optional seconds)}
+#   join_room:   {'name', 'room', 'spectate' (optional bool)}
+#   list_rooms:  {}
+#   resume:      {'room', 'session', 'last_seq'} after a reconnect
+#   queue:       {'name'} to be paired with a player of similar rating, or {'cancel': True}
+# join, create_room, join_room, resume and queue may carry 'encodings', the wire encodings the
+# client can decode (see common.wire); the server picks one and game events are sent in
+# it from then on. Receivers tell the encodings apart by a frame's first byte.
+# The server answers create_room/join_room with 'color' ({'color', 'room', 'session',
+# 'encoding'}) and
+# list_rooms with 'rooms' ({'rooms': [summary, ...]}). A resume gets 'color' with
+# 'resumed': True followed by the events after last_seq, or a 'board' snapshot if they
+# are no longer buffered; an expired session gets an 'error'. A queued client gets
+# 'queued' ({'rating', 'waiting'}, or {'cancelled': True}) and, once paired, 'match'
+# ({'room', 'rating', 'opponent', 'opponent_rating'}) followed by 'color' for a new
+# rated room.
+def make_create_room(name, room_id=None, time_limit=None, encodings=None):
+    content = {'name': name}
+    if room_id is not None:
+        content['room'] = room_id
+    if time_limit is not None:
+        content['time_limit'] = time_limit
+    if encodings:
+        content['encodings'] = list(encodings)
+    return make_message('create_room', content)
+
+def make_join_room(name, room_id, spectate=False, encodings=None):
+    content = {'name': name, 'room': room_id, 'spectate': spectate}
+    if encodings:
+        content['encodings'] = list(encodings)
+    return make_message('join_room', content)
+
+def make_list_rooms():
+    return make_message('list_rooms', {})
+
+def make_queue(name, encodings=None):
+    content = {'name': name}
+    if encodings:
+        content['encodings'] = list(encodings)
+    return make_message('queue', content)
+
+def make_resume(room_id, session, last_seq, encodings=None):
+    content = {'room': room_id, 'session': session, 'last_seq': last_seq}
+    if encodings:
+        content['encodings'] = list(encodings)
+    return make_message('resume', content)
+
+# Game events (server -> client). Every room event carries 'seq', the room's event
+# sequence number, so a client can tell when it has missed one.
+#   board:     full snapshot {'seq', 'ply', 'fen', 'turn', 'history', 'game_over', 'winner',
+#              'player_times'}; sent on join and in reply to a client's 'resync'
+#   move:      one accepted ply {'seq', 'ply', 'move', 'turn', 'game_over', 'winner',
+#              'player_times'}; clients apply it to their local board
+#   game_over: the game ended without a move {'seq', 'reason', 'winner', 'player_times'}
+#   chat_batch: the room's chat lines of the last ~100 ms {'seq', 'lines': [{'sender', 'text'}]},
+#              the sender's own lines included. A client's 'chat' {'text'} is rate
+#              limited; one sent too fast is dropped and the first such gets an 'error'
+#   chat:      {'seq', 'sender', 'text'}; sent by older servers, one line per frame
+#   eval:      engine evaluation for spectators {'room', 'ply', 'fen', 'depth', 'nodes',
+#              'cp', 'mate', 'pv'}; scores are from white's side. Sent after each move
+#              when the server runs an engine, and in reply to a spectator's
+#              'analyse' {'ply' (optional), 'depth' (optional), 'time' (optional)}. Not sequenced.
+# The board snapshot that starts a game takes a sequence number of its own.
+
+# Replays. 'replay' {'ply', 'speed', 'game' (optional archive id), 'stop' (optional)}
+# from any room member starts, seeks, re-speeds or stops a playback of the room's game
+# (or of an archived one); the server answers with 'replay' {'ply', 'plies', 'move',
+# 'fen', 'speed'} every 1/speed seconds. Not sequenced; each frame stands alone.
+
+# A player's move (client -> server) is {'move': uci, 'cseq' (optional)}. cseq numbers
+# the moves a client has already shown on its own board; when the move is refused, the
+# 'error' reply carries the same cseq so the client knows which move to take back.
+# Accepted moves are confirmed by the ordinary 'move' event for that ply.
+
+# Heartbeat. The server sends 'ping' {'id'} to every connection every few seconds and
+# clients answer 'pong' {'id'} at once. The round trip sets how much of each move's
+# time is credited back to the network (bounded by the server's --max-lag-ms), and a
+# client that has answered pings before but then goes silent is disconnected.
+
+class MessageDecoder:
+    """
+    Incremental decoder for length-prefixed frames.
+    Feed it whatever the socket returned; it yields every complete message and keeps
+    any trailing partial frame for the next read. Consumed bytes are tracked with an
+    offset and only compacted once they make up most of the buffer, so a long payload
+    arriving in many small reads is not re-copied on every read.
+    """
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE, recv_size=RECV_SIZE):
+        self.buffer = bytearray()
+        self.offset = 0
+        self.max_frame_size = max_frame_size
+        self.recv_size = recv_size
+        # The receive chunk is only needed for blocking sockets, so it is allocated on
+        # first use; decoders fed from asyncio callbacks never pay for it.
+        self.chunk = None
+        self.chunk_view = None
+        # observe(message, frame bytes) is called for every decoded message when set
+        self.observe = None
+
+    def feed(self, data):
+        """
+        Append received bytes and return a list of all complete messages.
+        Raises ValueError if a frame announces a length above max_frame_size.
+        """
+        buffer = self.buffer
+        buffer += data
+        messages = []
+        offset = self.offset
+        end = len(buffer)
+        header_size = FRAME_HEADER.size
+        observe = self.observe
+        while end - offset >= header_size:
+            (length,) = FRAME_HEADER.unpack_from(buffer, offset)
+            if length > self.max_frame_size:
+                raise ValueError(f"Frame of {length} bytes exceeds limit of {self.max_frame_size}")
+            start = offset + header_size
+            if end - start < length:
+                break
+            message = parse_message(bytes(buffer[start:start + length]))
+            if observe is not None:
+                observe(message, header_size + length)
+            messages.append(message)
+            offset = start + length
+        if offset == end:
+            buffer.clear()
+            offset = 0
+        elif offset > end // 2:
+            del buffer[:offset]
+            offset = 0
+        self.offset = offset
+        return messages
+
+    def recv_from(self, sock):
+        """
+        Read one large chunk from a blocking socket into the reusable receive buffer.
+        Returns the list of complete messages (possibly empty), or None once the peer
+        has closed the connection.
+        """
+        if self.chunk is None:
+            self.chunk = bytearray(self.recv_size)
+            self.chunk_view = memoryview(self.chunk)
+        n = sock.recv_into(self.chunk)
+        if not n:
+            return None
+        return self.feed(self.chunk_view[:n])
+
+    def pending_bytes(self):
+        return len(self.buffer) - self.offset
+
+    def unconsumed(self):
+        """
+        The bytes of any partial frame still waiting for the rest of its data.
+        """
+        return bytes(self.buffer[self.offset:])
@@ -0,0 +1,181 @@
+import struct
+
+# Wire encodings, in the order the server prefers them. A client lists the ones it
+# understands in its join message; everyone else gets JSON.
+BINARY = 'binary'
+JSON = 'json'
+ENCODINGS = (BINARY, JSON)
+
+# A binary payload starts with its message code. JSON payloads always start with '{',
+# which no code uses, so a receiver can tell the two apart frame by frame.
+MOVE = 1       # server -> client: one accepted ply
+BOARD = 2      # server -> client: full snapshot, history as move codes
+GAME_OVER = 3  # server -> client: the game ended without a move
+PLAY = 5       # client -> server: a move
+CHAT_BATCH = 6 # server -> client: a room's chat lines from one window (4, one chat line, is retired)
+CODE_TYPES = {MOVE: 'move', BOARD: 'board', GAME_OVER: 'game_over', PLAY: 'move', CHAT_BATCH: 'chat_batch'}
+
+# Clocks travel as milliseconds, moves as the 16-bit codes ChessGame stores.
+# A snapshot keeps its FEN (u8 length + ASCII) so decoding it needs no replay.
+MOVE_EVENT = struct.Struct('!BIHHBII')     # code, seq, ply, move, flags, white, black
+BOARD_HEADER = struct.Struct('!BIHBIIIIB') # code, seq, ply, flags, white, black, increment, delay, FEN length
+GAME_OVER_EVENT = struct.Struct('!BIBBII') # code, seq, reason, flags, white, black
+CHAT_BATCH_HEADER = struct.Struct('!BIB') # code, seq, line count
+CHAT_LINE = struct.Struct('!BH')           # sender length, text length, then both in UTF-8
+PLAY_MOVE = struct.Struct('!BH')           # code, move
+PLAY_MOVE_SEQ = struct.Struct('!BHI')      # code, move, client sequence number
+
+# Flag bits shared by the game events
+BLACK_TO_MOVE = 1
+GAME_IS_OVER = 2
+BOTH_CONNECTED = 4
+WINNER_SHIFT = 3  # two bits: 0 none, 1 white, 2 black
+WINNERS = (None, 'white', 'black')
+REASONS = ('board', 'time')
+
+MOVE_KEYS = frozenset(('seq', 'ply', 'move', 'turn', 'game_over', 'winner', 'player_times'))
+BOARD_KEYS = frozenset(('seq', 'ply', 'fen', 'turn', 'history', 'game_over', 'winner', 'player_times',
+                        'increment', 'delay', 'both_connected'))
+GAME_OVER_KEYS = frozenset(('seq', 'reason', 'winner', 'player_times'))
+CHAT_BATCH_KEYS = frozenset(('seq', 'lines'))
+CHAT_LINE_KEYS = frozenset(('sender', 'text'))
+
+# UCI <-> move code tables; the same codes as common.chess_game.pack_move, without
+# building a chess.Move for every move on the wire. Spelled out rather than taken from
+# python-chess, so the client can speak the protocol before it has imported chess.
+SQUARE_NAMES = [file + rank for rank in '12345678' for file in 'abcdefgh']  # chess.SQUARE_NAMES
+SQUARE_INDEX = {name: index for index, name in enumerate(SQUARE_NAMES)}
+PROMOTION_INDEX = {'n': 2, 'b': 3, 'r': 4, 'q': 5}  # chess.KNIGHT .. chess.QUEEN
+PROMOTION_SYMBOL = {piece: symbol for symbol, piece in PROMOTION_INDEX.items()}
+
+def uci_to_code(uci):
+    code = SQUARE_INDEX[uci[0:2]] | (SQUARE_INDEX[uci[2:4]] << 6)
+    if len(uci) == 5:
+        code |= PROMOTION_INDEX[uci[4]] << 12
+    elif len(uci) != 4:
+        raise ValueError(f"Not a UCI move: {uci}")
+    return code
+
+def code_to_uci(code):
+    uci = SQUARE_NAMES[code & 0x3F] + SQUARE_NAMES[(code >> 6) & 0x3F]
+    return uci + PROMOTION_SYMBOL[code >> 12] if code >> 12 else uci
+
+def choose_encoding(offered):
+    """
+    The encoding to use with a client that offered the given list.
+    """
+    if isinstance(offered, list):
+        for encoding in ENCODINGS:
+            if encoding in offered:
+                return encoding
+    return JSON
+
+def ms(seconds):
+    return max(0, min(0xFFFFFFFF, int(seconds * 1000)))
+
+def flags_of(content):
+    flags = BLACK_TO_MOVE if content.get('turn') == 'black' else 0
+    if content.get('game_over'):
+        flags |= GAME_IS_OVER
+    if content.get('both_connected'):
+        flags |= BOTH_CONNECTED
+    return flags | (WINNERS.index(content.get('winner')) << WINNER_SHIFT)
+
+def apply_flags(content, flags):
+    content['turn'] = 'black' if flags & BLACK_TO_MOVE else 'white'
+    content['game_over'] = bool(flags & GAME_IS_OVER)
+    content['winner'] = WINNERS[(flags >> WINNER_SHIFT) & 3]
+    return content
+
+def encode_payload(msg_type, content):
+    """
+    The binary payload for a message, or None if this message has no binary form;
+    those are sent as JSON whatever the connection's encoding.
+    """
+    try:
+        keys = content.keys()
+        if msg_type == 'move':
+            if keys == {'move'}:
+                return PLAY_MOVE.pack(PLAY, uci_to_code(content['move']))
+            if keys == {'move', 'cseq'}:
+                return PLAY_MOVE_SEQ.pack(PLAY, uci_to_code(content['move']), content['cseq'])
+            if keys == MOVE_KEYS:
+                times = content['player_times']
+                return MOVE_EVENT.pack(MOVE, content['seq'], content['ply'],
+                                       uci_to_code(content['move']), flags_of(content),
+                                       ms(times['white']), ms(times['black']))
+        elif msg_type == 'board':
+            if keys <= BOARD_KEYS and 'history' in keys and 'fen' in keys:
+                times = content['player_times']
+                history = content['history']
+                fen = content['fen'].encode('ascii')
+                header = BOARD_HEADER.pack(BOARD, content['seq'], len(history), flags_of(content),
+                                           ms(times['white']), ms(times['black']),
+                                           ms(content.get('increment', 0)), ms(content.get('delay', 0)), len(fen))
+                return header + fen + struct.pack(f'!{len(history)}H', *map(uci_to_code, history))
+        elif msg_type == 'game_over':
+            if keys == GAME_OVER_KEYS:
+                times = content['player_times']
+                return GAME_OVER_EVENT.pack(GAME_OVER, content['seq'], REASONS.index(content['reason']),
+                                            flags_of(content), ms(times['white']), ms(times['black']))
+        elif msg_type == 'chat_batch':
+            if keys == CHAT_BATCH_KEYS:
+                lines = content['lines']
+                parts = [CHAT_BATCH_HEADER.pack(CHAT_BATCH, content['seq'], len(lines))]
+                for line in lines:
+                    if line.keys() != CHAT_LINE_KEYS:
+                        return None
+                    sender = line['sender'].encode()
+                    text = line['text'].encode()
+                    parts += (CHAT_LINE.pack(len(sender), len(text)), sender, text)
+                return b''.join(parts)
+    except (KeyError, ValueError, TypeError, AttributeError, struct.error):
+        pass
+    return None
+
+def decode_payload(data):
+    """
+    Decode a binary payload into the same {'type', 'content'} dict the JSON path gives.
+    Raises ValueError (or struct.error) if it is malformed.
+    """
+    code = data[0]
+    if code == MOVE:
+        _, seq, ply, move, flags, white, black = MOVE_EVENT.unpack_from(data)
+        content = {'seq': seq, 'ply': ply, 'move': code_to_uci(move),
+                   'player_times': {'white': white / 1000, 'black': black / 1000}}
+        return {'type': 'move', 'content': apply_flags(content, flags)}
+    if code == PLAY:
+        if len(data) >= PLAY_MOVE_SEQ.size:
+            _, move, cseq = PLAY_MOVE_SEQ.unpack_from(data)
+            return {'type': 'move', 'content': {'move': code_to_uci(move), 'cseq': cseq}}
+        _, move = PLAY_MOVE.unpack_from(data)
+        return {'type': 'move', 'content': {'move': code_to_uci(move)}}
+    if code == BOARD:
+        _, seq, ply, flags, white, black, increment, delay, fen_len = BOARD_HEADER.unpack_from(data)
+        start = BOARD_HEADER.size
+        fen = bytes(data[start:start + fen_len]).decode('ascii')
+        history = [code_to_uci(code) for code in struct.unpack_from(f'!{ply}H', data, start + fen_len)]
+        content = {'seq': seq, 'ply': ply, 'fen': fen, 'history': history,
+                   'player_times': {'white': white / 1000, 'black': black / 1000},
+                   'increment': increment / 1000, 'delay': delay / 1000,
+                   'both_connected': bool(flags & BOTH_CONNECTED)}
+        return {'type': 'board', 'content': apply_flags(content, flags)}
+    if code == GAME_OVER:
+        _, seq, reason, flags, white, black = GAME_OVER_EVENT.unpack_from(data)
+        content = {'seq': seq, 'reason': REASONS[reason], 'winner': WINNERS[(flags >> WINNER_SHIFT) & 3],
+                   'player_times': {'white': white / 1000, 'black': black / 1000}}
+        return {'type': 'game_over', 'content': content}
+    if code == CHAT_BATCH:
+        _, seq, count = CHAT_BATCH_HEADER.unpack_from(data)
+        start = CHAT_BATCH_HEADER.size
+        lines = []
+        for _ in range(count):
+            sender_len, text_len = CHAT_LINE.unpack_from(data, start)
+            start += CHAT_LINE.size
+            sender = bytes(data[start:start + sender_len]).decode(errors='replace')
+            start += sender_len
+            text = bytes(data[start:start + text_len]).decode(errors='replace')
+            start += text_len
+            lines.append({'sender': sender, 'text': text})
+        return {'type': 'chat_batch', 'content': {'seq': seq, 'lines': lines}}
+    raise ValueError(f"Unknown binary message code {code}")
@@ -1,5 +1,4 @@
 # Launcher script to run the chess client as a module for PyInstaller packaging
-import runpy
 import sys
 import os
 
@@ -19,4 +18,7 @@ if __name__ == "__main__":
         os.chdir(project_root)
         if project_root not in sys.path:
             sys.path.insert(0, project_root)
-    runpy.run_module("client.client_main", run_name="__main__")
+    # Imported directly rather than through runpy, so the bundle's compiled module is used
+    # as is; client_main itself defers pygame and chess until the welcome window is up
+    from client.client_main import main
+    main()
@@ -0,0 +1,207 @@
+import asyncio
+import collections
+import itertools
+import logging
+import threading
+import chess
+import chess.engine
+import chess.polyglot
+
+LIVE = 0      # the current position of a game in progress
+ARCHIVED = 1  # an earlier position, or a finished game
+DEFAULT_DEPTH = 12
+DEFAULT_TIME = 0.5
+DEFAULT_CACHE_SIZE = 4096
+MAX_PV = 8  # moves of the principal variation sent to clients
+
+log = logging.getLogger('server.analysis')
+
+class AnalysisRequest:
+    __slots__ = ('key', 'board', 'limit', 'callbacks')
+
+    def __init__(self, key, board, limit, callback):
+        self.key = key
+        self.board = board
+        self.limit = limit
+        self.callbacks = [callback]
+
+class AnalysisPool:
+    """
+    Long-lived UCI engine processes driven through chess.engine's async API on a
+    background event loop of their own.
+    Requests wait in one priority queue, live games ahead of archived positions, and
+    each idle engine takes the next one. Results are cached by the position's Zobrist
+    hash and search budget, and a request for a position already queued or being
+    searched joins it, so every spectator of a game shares one evaluation.
+    Callbacks go through dispatch, like the ClockScheduler's, so the asyncio server can
+    run them on its own loop.
+    """
+    def __init__(self, command, size=1, depth=DEFAULT_DEPTH, time_limit=DEFAULT_TIME, cache_size=DEFAULT_CACHE_SIZE):
+        self.command = command
+        self.size = size
+        self.depth = depth
+        self.time_limit = time_limit
+        self.cache_size = cache_size
+        self.cache = collections.OrderedDict()
+        self.inflight = {}  # key -> AnalysisRequest queued or being searched
+        self.counter = itertools.count()
+        self.loop = None
+        self.queue = None
+        self.thread = None
+        self.dispatch = None
+        self.engines = []
+        self.lock = threading.Lock()
+        self.searched = 0
+        self.hits = 0
+        self.joined = 0
+        self.failures = 0
+
+    def start(self, dispatch=None):
+        self.dispatch = dispatch
+        self.loop = asyncio.new_event_loop()
+        started = threading.Event()
+        self.thread = threading.Thread(target=self.run, args=(started,), daemon=True)
+        self.thread.start()
+        started.wait()
+
+    def run(self, started):
+        asyncio.set_event_loop(self.loop)
+        self.queue = asyncio.PriorityQueue()
+        for index in range(self.size):
+            self.loop.create_task(self.worker(index))
+        started.set()
+        self.loop.run_forever()
+
+    def limit(self, depth=None, time_limit=None):
+        """
+        The search budget of a request; a client may ask for less than the server's
+        default, never more.
+        """
+        if not isinstance(depth, int) or not 0 < depth <= self.depth:
+            depth = self.depth
+        if not isinstance(time_limit, (int, float)) or not 0 < time_limit <= self.time_limit:
+            time_limit = self.time_limit
+        return chess.engine.Limit(depth=depth, time=time_limit)
+
+    def submit(self, board, callback, priority=LIVE, depth=None, time_limit=None, key=None):
+        """
+        Evaluate board and call callback(result) once it is done. Thread safe; board is
+        copied, so the caller may keep playing on it.
+        """
+        limit = self.limit(depth, time_limit)
+        if key is None:
+            key = chess.polyglot.zobrist_hash(board)
+        key = (key, limit.depth, limit.time)
+        with self.lock:
+            result = self.cache.get(key)
+            if result is not None:
+                self.cache.move_to_end(key)
+                self.hits += 1
+            else:
+                request = self.inflight.get(key)
+                if request is not None:
+                    request.callbacks.append(callback)
+                    self.joined += 1
+                    return
+                request = AnalysisRequest(key, board.copy(stack=False), limit, callback)
+                self.inflight[key] = request
+        if result is not None:
+            self.deliver(callback, result)
+            return
+        entry = (priority, next(self.counter), request)
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, entry)
+
+    async def open_engine(self):
+        _, engine = await chess.engine.popen_uci(self.command)
+        return engine
+
+    async def worker(self, index):
+        engine = None
+        while True:
+            _, _, request = await self.queue.get()
+            result = None
+            try:
+                if engine is None:
+                    engine = await self.open_engine()
+                    self.engines.append(engine)
+                info = await engine.analyse(request.board, request.limit)
+                result = self.result(request.board, info)
+            except (chess.engine.EngineError, chess.engine.EngineTerminatedError, OSError) as e:
+                log.warning("Analysis engine %d failed: %s", index, e)
+                self.failures += 1
+                if engine is not None:
+                    self.engines.remove(engine)
+                    try:
+                        await engine.quit()
+                    except Exception:
+                        pass
+                engine = None
+            except Exception:
+                # Anything else fails this request only; the worker and its engine carry on
+                log.exception("Analysis engine %d failed on %s", index, request.board.fen())
+                self.failures += 1
+            finally:
+                # Whatever happened, later requests for the position must not wait on this one
+                self.finish(request, result)
+
+    def result(self, board, info):
+        score = info.get('score')
+        pv = info.get('pv') or []
+        content = {
+            'fen': board.fen(),
+            'depth': info.get('depth'),
+            'nodes': info.get('nodes'),
+            'pv': [move.uci() for move in pv[:MAX_PV]],
+            'cp': None,
+            'mate': None,
+        }
+        if score is not None:
+            white = score.white()
+            content['cp'] = white.score()
+            content['mate'] = white.mate()
+        return content
+
+    def finish(self, request, result):
+        with self.lock:
+            self.inflight.pop(request.key, None)
+            if result is not None:
+                self.searched += 1
+                self.cache[request.key] = result
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        if result is not None:
+            for callback in request.callbacks:
+                self.deliver(callback, result)
+
+    def deliver(self, callback, result):
+        try:
+            if self.dispatch is None:
+                callback(result)
+            else:
+                self.dispatch(callback, result)
+        except Exception as e:
+            log.exception("Analysis callback failed: %s", e)
+
+    def close(self):
+        if self.loop is None:
+            return
+
+        async def shutdown():
+            for engine in list(self.engines):
+                try:
+                    await asyncio.wait_for(engine.quit(), 1)
+                except Exception:
+                    pass
+            self.loop.stop()
+        asyncio.run_coroutine_threadsafe(shutdown(), self.loop)
+        self.thread.join(2)
+
+    def stats(self):
+        return {
+            'engines': len(self.engines),
+            'queued': self.queue.qsize() if self.queue is not None else 0,
+            'searched': self.searched,
+            'cache_hits': self.hits,
+            'shared': self.joined,
+            'failures': self.failures,
+        }
@@ -0,0 +1,285 @@
+import datetime
+import logging
+import os
+import sqlite3
+import struct
+import threading
+import time
+import chess
+import chess.pgn
+import chess.polyglot
+from common.chess_game import unpack_move
+
+RESULTS = {'white': '1-0', 'black': '0-1', None: '1/2-1/2'}
+DEFAULT_BATCH = 256  # games written per transaction at most
+DEFAULT_LIMIT = 100
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,
+    room TEXT,
+    white TEXT,
+    black TEXT,
+    result TEXT NOT NULL,
+    reason TEXT,
+    ended INTEGER NOT NULL,
+    plies INTEGER NOT NULL,
+    time_control TEXT,
+    moves BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS games_white ON games (white, id);
+CREATE INDEX IF NOT EXISTS games_black ON games (black, id);
+CREATE INDEX IF NOT EXISTS games_result ON games (result, id);
+CREATE INDEX IF NOT EXISTS games_ended ON games (ended);
+CREATE TABLE IF NOT EXISTS positions (
+    hash INTEGER NOT NULL,
+    game INTEGER NOT NULL,
+    ply INTEGER NOT NULL,
+    PRIMARY KEY (hash, game)
+) WITHOUT ROWID;
+"""
+SUMMARY = "id, room, white, black, result, reason, ended, plies, time_control"
+
+log = logging.getLogger('server.archive')
+
+def pack_moves(codes):
+    """
+    The moves column: the 16-bit move codes ChessGame keeps, little-endian.
+    """
+    return struct.pack(f'<{len(codes)}H', *codes)
+
+def unpack_moves(blob):
+    return struct.unpack(f'<{len(blob) // 2}H', blob)
+
+def position_key(board):
+    """
+    The board's Zobrist hash as the signed 64-bit integer SQLite stores.
+    """
+    key = chess.polyglot.zobrist_hash(board)
+    return key - (1 << 64) if key >= 1 << 63 else key
+
+def summary(row):
+    return dict(zip(('id', 'room', 'white', 'black', 'result', 'reason', 'ended', 'plies', 'time_control'), row))
+
+class FinishedGame:
+    __slots__ = ('room_id', 'white', 'black', 'result', 'reason', 'ended', 'codes', 'time_control')
+
+    def __init__(self, room_id, white, black, result, reason, ended, codes, time_control):
+        self.room_id = room_id
+        self.white = white
+        self.black = black
+        self.result = result
+        self.reason = reason
+        self.ended = ended
+        self.codes = codes
+        self.time_control = time_control
+
+class Archive:
+    """
+    Finished games in one SQLite database, searchable by player, result, date and by
+    any position reached.
+    Each game is one row with its moves packed as 16-bit codes (two bytes a ply); the
+    positions table maps every distinct position of a game to the first ply it was
+    reached at, so "games reaching this position" is one index range scan.
+    record() only queues the game: one writer thread replays it for the position
+    hashes and inserts whatever has queued in one transaction, off the move path.
+    Queries open a connection per thread; in WAL mode they never wait on the writer,
+    and several server workers can share one file.
+    """
+    def __init__(self, path, index_plies=None):
+        self.path = path
+        self.index_plies = index_plies  # index only the first N plies' positions; None for all
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        db = self.connect()
+        db.executescript(SCHEMA)
+        db.commit()
+        self.pending = []
+        self.cond = threading.Condition()
+        self.closed = False
+        self.thread = None
+        self.local = threading.local()
+        self.archived = 0
+        self.failures = 0
+
+    def connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        return db
+
+    def reader(self):
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = self.local.db = self.connect()
+        return db
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def record(self, room_id, white, black, winner, reason, codes, time_control=None, ended=None):
+        """
+        Queue a finished game. codes is the game's packed history; it is copied.
+        ended is a Unix time, now by default.
+        """
+        game = FinishedGame(room_id, white, black, RESULTS[winner], reason,
+                            int(time.time() if ended is None else ended), list(codes), time_control)
+        with self.cond:
+            self.pending.append(game)
+            self.cond.notify()
+
+    def run(self):
+        db = self.connect()
+        while True:
+            with self.cond:
+                while not self.pending and not self.closed:
+                    self.cond.wait()
+                batch = self.pending[:DEFAULT_BATCH]
+                del self.pending[:DEFAULT_BATCH]
+                if not batch and self.closed:
+                    break
+            try:
+                with db:
+                    for game in batch:
+                        self.insert(db, game)
+                self.archived += len(batch)
+            except sqlite3.Error as e:
+                log.error("Could not archive %d games: %s", len(batch), e)
+                self.failures += len(batch)
+        db.close()
+
+    def insert(self, db, game):
+        time_control = None
+        if game.time_control is not None:
+            base, increment, _ = game.time_control
+            time_control = f"{base:g}+{increment:g}"
+        cursor = db.execute(
+            "INSERT INTO games (room, white, black, result, reason, ended, plies, time_control, moves) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (game.room_id, game.white, game.black, game.result, game.reason, game.ended,
+             len(game.codes), time_control, pack_moves(game.codes)))
+        game_id = cursor.lastrowid
+        board = chess.Board()
+        seen = {position_key(board): 0}
+        codes = game.codes if self.index_plies is None else game.codes[:self.index_plies]
+        for ply, code in enumerate(codes, 1):
+            board.push(unpack_move(code))
+            seen.setdefault(position_key(board), ply)
+        db.executemany("INSERT OR IGNORE INTO positions (hash, game, ply) VALUES (?, ?, ?)",
+                       [(key, game_id, ply) for key, ply in seen.items()])
+        return game_id
+
+    def close(self):
+        """
+        Write what is still queued and stop the writer.
+        """
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        if self.thread is not None:
+            self.thread.join()
+
+    def by_player(self, name, limit=DEFAULT_LIMIT):
+        """
+        A player's most recent games, newest first.
+        """
+        rows = self.reader().execute(
+            f"SELECT * FROM (SELECT {SUMMARY} FROM games WHERE white = ? ORDER BY id DESC LIMIT ?) "
+            f"UNION ALL SELECT * FROM (SELECT {SUMMARY} FROM games WHERE black = ? ORDER BY id DESC LIMIT ?) "
+            "ORDER BY id DESC LIMIT ?", (name, limit, name, limit, limit))
+        return [summary(row) for row in rows]
+
+    def by_result(self, result, limit=DEFAULT_LIMIT):
+        rows = self.reader().execute(
+            f"SELECT {SUMMARY} FROM games WHERE result = ? ORDER BY id DESC LIMIT ?", (result, limit))
+        return [summary(row) for row in rows]
+
+    def by_date(self, start, end=None, limit=DEFAULT_LIMIT):
+        """
+        Games that ended between two datetimes (or Unix times), oldest first.
+        """
+        start = start.timestamp() if isinstance(start, datetime.datetime) else start
+        end = time.time() if end is None else end.timestamp() if isinstance(end, datetime.datetime) else end
+        rows = self.reader().execute(
+            f"SELECT {SUMMARY} FROM games WHERE ended >= ? AND ended < ? ORDER BY ended LIMIT ?",
+            (int(start), int(end), limit))
+        return [summary(row) for row in rows]
+
+    def with_position(self, board, limit=DEFAULT_LIMIT):
+        """
+        The most recent games that reached board's position (a chess.Board or a FEN),
+        each with the 'ply' it was first reached at.
+        """
+        if isinstance(board, str):
+            board = chess.Board(board)
+        rows = self.reader().execute(
+            f"SELECT {', '.join('g.' + column for column in SUMMARY.split(', '))}, p.ply "
+            "FROM positions p JOIN games g ON g.id = p.game WHERE p.hash = ? ORDER BY p.game DESC LIMIT ?",
+            (position_key(board), limit))
+        games = []
+        for row in rows:
+            game = summary(row)
+            game['ply'] = row[-1]
+            games.append(game)
+        return games
+
+    def game(self, game_id):
+        """
+        One game's summary and its moves in UCI, or None.
+        """
+        row = self.reader().execute(f"SELECT {SUMMARY}, moves FROM games WHERE id = ?", (game_id,)).fetchone()
+        if row is None:
+            return None
+        game = summary(row)
+        game['moves'] = [unpack_move(code).uci() for code in unpack_moves(row[-1])]
+        return game
+
+    def count(self):
+        return self.reader().execute("SELECT COUNT(*) FROM games").fetchone()[0]
+
+    def export_pgn(self, game_ids=None, player=None):
+        """
+        Yield one PGN text per game, oldest first. Rows are read from the cursor as
+        the generator is consumed, so exporting the whole archive takes constant memory.
+        """
+        query = f"SELECT {SUMMARY}, moves FROM games"
+        params = ()
+        if game_ids is not None:
+            game_ids = list(game_ids)
+            query += f" WHERE id IN ({', '.join('?' * len(game_ids))})"
+            params = tuple(game_ids)
+        elif player is not None:
+            query += " WHERE white = ? OR black = ?"
+            params = (player, player)
+        # A connection of its own, so the open cursor never blocks the caller's queries
+        db = self.connect()
+        try:
+            for row in db.execute(query + " ORDER BY id", params):
+                yield to_pgn(summary(row), unpack_moves(row[-1]))
+        finally:
+            db.close()
+
+    def stats(self):
+        with self.cond:
+            queued = len(self.pending)
+        return {'archived': self.archived, 'queued': queued, 'failures': self.failures}
+
+def to_pgn(game, codes):
+    pgn = chess.pgn.Game()
+    ended = datetime.datetime.fromtimestamp(game['ended'], datetime.timezone.utc)
+    pgn.headers['Event'] = f"Room {game['room']}"
+    pgn.headers['Site'] = 'Multiplayer_ChessGame'
+    pgn.headers['Date'] = ended.strftime('%Y.%m.%d')
+    pgn.headers['Round'] = '-'
+    pgn.headers['White'] = game['white'] or '?'
+    pgn.headers['Black'] = game['black'] or '?'
+    pgn.headers['Result'] = game['result']
+    if game['time_control']:
+        pgn.headers['TimeControl'] = game['time_control']
+    if game['reason'] == 'time':
+        pgn.headers['Termination'] = 'time forfeit'
+    node = pgn
+    for code in codes:
+        node = node.add_main_variation(unpack_move(code))
+    return str(pgn) + "\n"
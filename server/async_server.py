@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import time
+from common.protocol import MessageDecoder, Frame, frame_type
+from common.wire import JSON
+from server.metrics import metrics
+from server.outbound import OutboundQueue, CONTROL
+from server.shards import handoff_payload
+
+log = logging.getLogger('server.async')
+
+# Bytes the transport may buffer before it asks us to pause; past that, frames wait
+# in the connection's bounded OutboundQueue where the overflow policy applies.
+WRITE_BUFFER_HIGH = 64 * 1024
+
+class ClientProtocol(asyncio.Protocol):
+    """
+    One client connection served from the event loop through protocol callbacks.
+    Idle connections cost a transport and a decoder, with no thread or pending read task.
+    initial holds bytes another worker already read from the socket before handing it over.
+    """
+    def __init__(self, on_connect, on_message, on_disconnect, initial=b''):
+        self.on_connect = on_connect
+        self.on_message = on_message
+        self.on_disconnect = on_disconnect
+        self.transport = None
+        self.addr = None
+        self.name = None
+        self.color = None
+        self.room = None
+        self.session = None
+        self.encoding = JSON
+        # Kept by the heartbeat: smoothed round trip in seconds, and when the client last spoke
+        self.rtt = None
+        self.last_seen = time.monotonic()
+        self.replay = None  # server.replay.ReplayStream this client is watching
+        self.chat_bucket = None  # server.chat.TokenBucket, made with the client's first chat line
+        self.decoder = MessageDecoder()
+        self.decoder.observe = metrics.frame_in
+        self.outbound = OutboundQueue()
+        self.paused = False
+        self.closed = False
+        self.initial = initial
+        # Set by the message handler when this connection belongs to another worker
+        self.handoff = None
+
+    # Connection interface shared with server_main.SocketConnection
+    def send(self, data, kind=CONTROL):
+        if self.closed:
+            return
+        if type(data) is Frame:
+            msg_type = data.msg_type
+            data = data.encode(self.encoding)
+        else:
+            msg_type = frame_type(data)
+        metrics.bytes_out.inc_label(msg_type, len(data))
+        if self.paused or len(self.outbound):
+            if not self.outbound.push(data, kind):
+                # The client is not reading, so closing would wait on the write buffer forever
+                self.close()
+                self.transport.abort()
+            return
+        self.outbound.sent((data,))
+        self.transport.write(data)
+
+    def pause_writing(self):
+        self.paused = True
+
+    def resume_writing(self):
+        self.paused = False
+        frames = self.outbound.pop_all()
+        if frames and not self.closed:
+            self.transport.write(b''.join(frames))
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.outbound.close()
+            self.transport.close()
+
+    def hand_off(self, messages):
+        """
+        Pass the socket and the unhandled messages to self.handoff, then let go of the
+        socket without shutting the connection down.
+        """
+        try:
+            self.handoff(self.transport.get_extra_info('socket'), handoff_payload(messages, self.decoder))
+        except (OSError, ValueError) as e:
+            log.warning("Could not hand off %s: %s", self.addr, e)
+            # Disconnect as any other connection would
+            self.handoff = None
+            self.close()
+            return
+        self.closed = True
+        self.outbound.close()
+        self.transport.abort()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        transport.set_write_buffer_limits(high=WRITE_BUFFER_HIGH)
+        self.addr = transport.get_extra_info('peername')
+        self.on_connect(self)
+        if self.initial:
+            # Runs before the transport starts reading, so these bytes stay in order
+            initial, self.initial = self.initial, b''
+            self.data_received(initial)
+
+    def data_received(self, data):
+        try:
+            messages = self.decoder.feed(data)
+        except ValueError as e:
+            log.warning("Error with %s: %s", self.addr, e)
+            self.close()
+            return
+        for i, msg_obj in enumerate(messages):
+            if self.closed:
+                return
+            try:
+                if not self.on_message(self, msg_obj):
+                    if self.handoff is not None:
+                        self.hand_off(messages[i:])
+                    else:
+                        self.close()
+                    return
+            except Exception as e:
+                log.exception("Error handling message from %s: %s", self.addr, e)
+
+    def connection_lost(self, exc):
+        self.closed = True
+        self.outbound.close()
+        self.on_disconnect(self)
+
+def watch_inbox(loop, shard, on_connect, on_message, on_disconnect):
+    """
+    Serve connections that other workers hand to this one.
+    """
+    def adopt():
+        try:
+            sock, data = shard.receive_connection()
+        except OSError as e:
+            log.warning("Error receiving a handed-off connection: %s", e)
+            return
+        loop.create_task(loop.connect_accepted_socket(
+            lambda: ClientProtocol(on_connect, on_message, on_disconnect, data), sock))
+    loop.add_reader(shard.inbox.fileno(), adopt)
+
+async def run_server(host, port, on_connect, on_message, on_disconnect, on_start=None, sock=None):
+    loop = asyncio.get_running_loop()
+    if on_start is not None:
+        on_start(loop)
+    factory = lambda: ClientProtocol(on_connect, on_message, on_disconnect)
+    if sock is not None:
+        server = await loop.create_server(factory, sock=sock, backlog=1024)
+    else:
+        server = await loop.create_server(factory, host, port, reuse_address=True, backlog=1024)
+    log.info("Server listening on %s:%s (asyncio)", host, port)
+    async with server:
+        await server.serve_forever()
+
+def serve_asyncio(host, port, on_connect, on_message, on_disconnect, on_start=None, sock=None):
+    try:
+        asyncio.run(run_server(host, port, on_connect, on_message, on_disconnect, on_start, sock))
+    except KeyboardInterrupt:
+        log.info("Shutting down server.")
@@ -0,0 +1,76 @@
+import time
+from common.protocol import Frame
+from server.outbound import CHAT
+
+DEFAULT_WINDOW = 0.1  # seconds chat lines wait to be sent together
+DEFAULT_RATE = 1.0    # chat lines per second a sender may keep up
+DEFAULT_BURST = 5     # lines a sender may send at once after being quiet
+MAX_BATCH = 64        # lines in one chat_batch at most
+MAX_TEXT = 500        # characters kept of a chat line
+
+class TokenBucket:
+    """
+    A sender's chat allowance: burst lines at most, refilled at rate lines per second.
+    """
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.refused = 0  # lines refused since the last one that was let through
+
+    def take(self, now=None):
+        """
+        Spend one token; False if there is none left.
+        """
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            self.refused += 1
+            return False
+        self.tokens -= 1
+        self.refused = 0
+        return True
+
+class ChatBatcher:
+    """
+    One room's chat, sent as one chat_batch frame per window instead of one frame per
+    line. A room with a thousand members and ten chatty spectators then queues one
+    frame per member each window rather than ten, so chat cannot crowd out the move
+    events that share the send queues. The flush is a timer in the shared
+    ClockScheduler, armed by the first line of a window.
+    Lines are echoed to their sender too; a batch is the same bytes for every member.
+    """
+    def __init__(self, room, scheduler, window=DEFAULT_WINDOW):
+        self.room = room
+        self.scheduler = scheduler
+        self.window = window
+        self.lines = []
+        self.timer = None
+        self.batches = 0
+
+    def add(self, sender, text):
+        """
+        Queue one line. Called with the room lock held.
+        """
+        self.lines.append({'sender': sender, 'text': text[:MAX_TEXT]})
+        if len(self.lines) >= MAX_BATCH or self.window <= 0:
+            self.scheduler.cancel(self.timer)
+            self.flush_locked()
+        elif self.timer is None:
+            self.timer = self.scheduler.schedule(time.monotonic() + self.window, self.flush)
+
+    def flush(self):
+        with self.room.lock:
+            self.flush_locked()
+
+    def flush_locked(self):
+        self.timer = None
+        if not self.lines:
+            return
+        lines, self.lines = self.lines, []
+        self.batches += 1
+        self.room.next_seq()
+        self.room.publish(Frame('chat_batch', {'seq': self.room.seq, 'lines': lines}), kind=CHAT)
+
@@ -0,0 +1,158 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+log = logging.getLogger('server.clock')
+
+def other_color(color):
+    return 'black' if color == 'white' else 'white'
+
+class GameClock:
+    """
+    Chess clock for one game, driven by time.monotonic() so wall-clock adjustments
+    (NTP, DST) never add or remove time.
+    increment: seconds added after each move (Fischer).
+    delay: seconds at the start of each turn that are not charged (simple delay).
+    """
+    def __init__(self, base, increment=0, delay=0):
+        self.remaining = {'white': float(base), 'black': float(base)}
+        self.increment = increment
+        self.delay = delay
+        self.running = None
+        self.turn_started = None
+
+    def start(self, color, now=None):
+        self.running = color
+        self.turn_started = time.monotonic() if now is None else now
+
+    def stop(self, now=None):
+        """
+        Charge the running side for its time so far and stop the clock.
+        """
+        if self.running is not None:
+            now = time.monotonic() if now is None else now
+            self.remaining[self.running] = self.remaining_at(self.running, now)
+            self.running = None
+            self.turn_started = None
+
+    def remaining_at(self, color, now):
+        if color != self.running:
+            return self.remaining[color]
+        charged = max(0.0, now - self.turn_started - self.delay)
+        return max(0.0, self.remaining[color] - charged)
+
+    def press(self, color, now=None, lag=0.0):
+        """
+        End color's turn: charge its time, add the increment and start the opponent.
+        lag is how long the move spent on the network; it is not charged, though the
+        turn is never charged less than nothing. The opponent's clock starts at now.
+        Returns False, leaving the clock stopped, if color had already run out of time.
+        """
+        now = time.monotonic() if now is None else now
+        left = self.remaining_at(color, max(self.turn_started, now - lag) if lag else now)
+        if left <= 0:
+            self.stop(now)
+            return False
+        self.remaining[color] = left + self.increment
+        self.start(other_color(color), now)
+        return True
+
+    def deadline(self, lag=0.0):
+        """
+        Monotonic time at which the running side flags, or None if the clock is stopped.
+        lag is the network allowance its next move will get.
+        """
+        if self.running is None:
+            return None
+        return self.turn_started + self.delay + self.remaining[self.running] + lag
+
+    def snapshot(self, now=None):
+        now = time.monotonic() if now is None else now
+        return {color: self.remaining_at(color, now) for color in ('white', 'black')}
+
+class Timer:
+    __slots__ = ('when', 'callback', 'cancelled')
+
+    def __init__(self, when, callback):
+        self.when = when
+        self.callback = callback
+        self.cancelled = False
+
+class ClockScheduler:
+    """
+    One timer heap and one thread for every game's flag-fall deadline.
+    Cancelled timers are left in the heap and skipped when they come due, so both
+    schedule and cancel are cheap; the heap is rebuilt once they make up most of it.
+    Callbacks go through dispatch, which runs them inline on the scheduler thread by
+    default; the asyncio server hands them to the event loop instead.
+    """
+    def __init__(self):
+        self.heap = []
+        self.counter = itertools.count()
+        self.cancelled = 0
+        self.cond = threading.Condition(threading.Lock())
+        self.dispatch = None
+        self.thread = None
+
+    def schedule(self, when, callback):
+        timer = Timer(when, callback)
+        with self.cond:
+            heapq.heappush(self.heap, (when, next(self.counter), timer))
+            # Only wake the thread if this is now the earliest deadline
+            if self.heap[0][2] is timer:
+                self.cond.notify()
+        return timer
+
+    def cancel(self, timer):
+        if timer is None or timer.cancelled:
+            return
+        with self.cond:
+            timer.cancelled = True
+            self.cancelled += 1
+            if self.cancelled > 1024 and self.cancelled > len(self.heap) // 2:
+                self.heap = [entry for entry in self.heap if not entry[2].cancelled]
+                heapq.heapify(self.heap)
+                self.cancelled = 0
+
+    def pop_due(self, now):
+        due = []
+        heap = self.heap
+        while heap and heap[0][0] <= now:
+            timer = heapq.heappop(heap)[2]
+            if timer.cancelled:
+                self.cancelled -= 1
+            else:
+                # Marked so a late cancel() does not count it as a dead heap entry
+                timer.cancelled = True
+                due.append(timer)
+        return due
+
+    def start(self, dispatch=None):
+        self.dispatch = dispatch
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while True:
+                    now = time.monotonic()
+                    due = self.pop_due(now)
+                    if due:
+                        break
+                    timeout = self.heap[0][0] - now if self.heap else None
+                    self.cond.wait(timeout)
+            for timer in due:
+                try:
+                    if self.dispatch is None:
+                        timer.callback()
+                    else:
+                        self.dispatch(timer.callback)
+                except Exception as e:
+                    log.exception("Timer callback failed: %s", e)
+
+    def __len__(self):
+        return len(self.heap)
@@ -0,0 +1,76 @@
+import itertools
+import logging
+import threading
+import time
+from common.protocol import make_message
+from server.metrics import metrics
+from server.outbound import CONTROL
+
+DEFAULT_INTERVAL = 5.0
+DEFAULT_TIMEOUT = 20.0
+RTT_GAIN = 0.125  # weight of each new sample in the smoothed RTT, as TCP's SRTT
+PINGS_KEPT = 8    # pings a pong may still answer
+
+# Registered once for the process, however many Heartbeats are made
+rtt_seconds = metrics.histogram('chess_rtt_seconds', "Round trip of ping/pong samples")
+reaped_connections = metrics.counter('chess_reaped_connections_total', "Silent connections closed by the heartbeat")
+
+log = logging.getLogger('server.heartbeat')
+
+class Heartbeat:
+    """
+    Pings every connection each interval from the shared ClockScheduler and keeps a
+    smoothed round-trip time per connection (conn.rtt) from the pongs.
+    The same sweep closes connections that have answered a ping before but have sent
+    nothing for timeout seconds: a peer that vanished without a FIN would otherwise
+    keep its seat, and a blocking recv, forever. Clients that never answer pings are
+    left alone, so old clients keep working.
+    """
+    def __init__(self, scheduler, interval=DEFAULT_INTERVAL, timeout=DEFAULT_TIMEOUT):
+        self.scheduler = scheduler
+        self.interval = interval
+        self.timeout = timeout
+        self.connections = set()
+        self.sent = {}  # ping id -> monotonic send time
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def start(self):
+        if self.interval > 0:
+            self.scheduler.schedule(time.monotonic() + self.interval, self.sweep)
+
+    def add(self, conn):
+        conn.last_seen = time.monotonic()
+        conn.rtt = None
+        with self.lock:
+            self.connections.add(conn)
+
+    def discard(self, conn):
+        with self.lock:
+            self.connections.discard(conn)
+
+    def sweep(self):
+        now = time.monotonic()
+        ping_id = next(self.ids)
+        self.sent[ping_id] = now
+        self.sent.pop(ping_id - PINGS_KEPT, None)
+        frame = make_message('ping', {'id': ping_id})
+        with self.lock:
+            connections = list(self.connections)
+        for conn in connections:
+            if conn.rtt is not None and now - conn.last_seen > self.timeout:
+                log.info("Closing %s: silent for %.0fs", conn.addr, now - conn.last_seen)
+                reaped_connections.inc()
+                self.discard(conn)
+                conn.close()
+            else:
+                conn.send(frame, CONTROL)
+        self.scheduler.schedule(now + self.interval, self.sweep)
+
+    def pong(self, conn, content):
+        sent = self.sent.get(content.get('id'))
+        if sent is None:
+            return
+        sample = time.monotonic() - sent
+        rtt_seconds.observe(sample)
+        conn.rtt = sample if conn.rtt is None else conn.rtt + RTT_GAIN * (sample - conn.rtt)
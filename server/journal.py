@@ -0,0 +1,317 @@
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from common.chess_game import ChessGame, unpack_move
+
+# Every record is its body's length and crc32 followed by the body: the record type,
+# the room id (u8 length + UTF-8) and the type's fields. A torn or corrupt record at
+# the end of the last segment marks where a crash cut the journal off.
+RECORD_HEADER = struct.Struct('!II')
+RECORD_TYPE = struct.Struct('!B')
+ROOM_CREATED = 1  # time control: base, increment, delay in milliseconds
+JOINED = 2        # seat (0 white, 1 black, 2 spectator) and the player's name
+STARTED = 3       # both clocks in milliseconds
+MOVE = 4          # ply, packed move, both clocks after the move
+ENDED = 5         # reason and winner
+CLOSED = 6        # the last member left; the game is abandoned
+TIME_CONTROL = struct.Struct('!III')
+SEAT = struct.Struct('!B')
+CLOCKS = struct.Struct('!II')
+MOVE_FIELDS = struct.Struct('!HHII')
+END_FIELDS = struct.Struct('!BB')
+SEATS = ('white', 'black', 'spectator')
+WINNERS = (None, 'white', 'black')
+REASONS = ('board', 'time')
+
+SEGMENT_NAME = 'journal-{:08d}.log'
+DEFAULT_SEGMENT_BYTES = 16 * 1024 * 1024
+DEFAULT_FSYNC_INTERVAL = 0.05
+
+log = logging.getLogger('server.journal')
+
+def ms(seconds):
+    return max(0, min(0xFFFFFFFF, int(round(seconds * 1000))))
+
+def encode_record(record_type, room_id, fields=b''):
+    room = room_id.encode()
+    body = RECORD_TYPE.pack(record_type) + bytes((len(room),)) + room + fields
+    return RECORD_HEADER.pack(len(body), zlib.crc32(body)) + body
+
+def read_records(path):
+    """
+    Records of one segment as (type, room id, fields), plus the offset where the valid
+    records end.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    records = []
+    offset = 0
+    header_size = RECORD_HEADER.size
+    while offset + header_size <= len(data):
+        length, crc = RECORD_HEADER.unpack_from(data, offset)
+        start = offset + header_size
+        body = data[start:start + length]
+        if len(body) < length or length < 2 or zlib.crc32(body) != crc:
+            break
+        room_len = body[1]
+        room_id = body[2:2 + room_len].decode(errors='replace')
+        records.append((body[0], room_id, body[2 + room_len:]))
+        offset = start + length
+    return records, offset
+
+class RecoveredRoom:
+    """
+    State of one unfinished game rebuilt from the journal.
+    """
+    def __init__(self, room_id, time_control):
+        self.room_id = room_id
+        self.time_control = time_control
+        self.seats = {'white': None, 'black': None}
+        self.game = ChessGame()
+        self.remaining = {'white': float(time_control[0]), 'black': float(time_control[0])}
+        self.started = False
+        self.finished = False
+
+    def apply(self, record_type, fields):
+        if record_type == JOINED:
+            (seat,) = SEAT.unpack_from(fields)
+            if seat < 2:
+                self.seats[SEATS[seat]] = fields[SEAT.size:].decode(errors='replace')
+        elif record_type == STARTED:
+            if self.game.ply() == 0:
+                white, black = CLOCKS.unpack_from(fields)
+                self.remaining = {'white': white / 1000, 'black': black / 1000}
+            self.started = True
+        elif record_type == MOVE:
+            ply, code, white, black = MOVE_FIELDS.unpack_from(fields)
+            # Compaction can leave a copy of records already replayed; the ply skips them
+            if ply == self.game.ply() + 1 and self.game.push_move(unpack_move(code).uci()):
+                self.remaining = {'white': white / 1000, 'black': black / 1000}
+        elif record_type == ENDED:
+            self.finished = True
+
+class Journal:
+    """
+    Write-ahead log of room events, group-committed by one writer thread.
+    Callers only queue the encoded record; the writer writes everything queued in one
+    call and fsyncs at most once per fsync_interval, so many games share each fsync.
+    A power failure can lose up to fsync_interval of records; a crashed process loses
+    only what was still queued.
+    Segments roll over at segment_bytes. Sealed segments are then compacted: records of
+    games that have ended are dropped, and those of live games are copied forward.
+    """
+    def __init__(self, directory, fsync_interval=DEFAULT_FSYNC_INTERVAL, segment_bytes=DEFAULT_SEGMENT_BYTES):
+        self.directory = directory
+        self.fsync_interval = fsync_interval
+        self.segment_bytes = segment_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.pending = []
+        self.cond = threading.Condition()
+        self.live = set()  # rooms created and not yet ended or closed
+        self.file = None
+        self.segment = 0
+        self.segment_size = 0
+        self.dirty = False
+        self.last_fsync = time.monotonic()
+        self.closed = False
+        self.thread = None
+        self.records = 0
+        self.commits = 0
+        self.fsyncs = 0
+        self.compactions = 0
+
+    def segment_path(self, index):
+        return os.path.join(self.directory, SEGMENT_NAME.format(index))
+
+    def segment_indexes(self):
+        indexes = []
+        for name in os.listdir(self.directory):
+            if name.startswith('journal-') and name.endswith('.log'):
+                try:
+                    indexes.append(int(name[len('journal-'):-len('.log')]))
+                except ValueError:
+                    pass
+        return sorted(indexes)
+
+    def recover(self):
+        """
+        Replay every segment and return the unfinished games. The journal then continues
+        in a fresh segment, and the old ones are compacted down to those games.
+        """
+        rooms = {}
+        indexes = self.segment_indexes()
+        for index in indexes:
+            path = self.segment_path(index)
+            records, end = read_records(path)
+            if end < os.path.getsize(path):
+                log.warning("Dropping %d torn bytes at the end of %s", os.path.getsize(path) - end, path)
+                with open(path, 'r+b') as f:
+                    f.truncate(end)
+            for record_type, room_id, fields in records:
+                room = rooms.get(room_id)
+                if record_type == ROOM_CREATED:
+                    # Room ids are reused once a game has ended, so each creation starts over;
+                    # a copy left by compaction replays to the same game
+                    base, increment, delay = TIME_CONTROL.unpack_from(fields)
+                    rooms[room_id] = RecoveredRoom(room_id, (base / 1000, increment / 1000, delay / 1000))
+                elif record_type == CLOSED:
+                    rooms.pop(room_id, None)
+                elif room is not None:
+                    room.apply(record_type, fields)
+        # Rooms that never started were only waiting for a second player; they are not restored
+        recovered = [room for room in rooms.values()
+                     if room.started and not room.finished and not room.game.is_game_over()]
+        self.live = {room.room_id for room in recovered}
+        self.open_segment((indexes[-1] + 1) if indexes else 1)
+        if indexes:
+            self.compact()
+        return recovered
+
+    def start(self):
+        if self.file is None:
+            self.recover()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def append(self, record):
+        with self.cond:
+            if self.closed:
+                return
+            self.pending.append(record)
+            if len(self.pending) == 1:
+                self.cond.notify()
+
+    # One method per record type; each queues the record and tracks which games are live
+    def room_created(self, room_id, time_control):
+        base, increment, delay = time_control
+        with self.cond:
+            self.live.add(room_id)
+        self.append(encode_record(ROOM_CREATED, room_id, TIME_CONTROL.pack(ms(base), ms(increment), ms(delay))))
+
+    def joined(self, room_id, color, name):
+        self.append(encode_record(JOINED, room_id, SEAT.pack(SEATS.index(color)) + (name or '').encode()[:255]))
+
+    def started(self, room_id, remaining):
+        self.append(encode_record(STARTED, room_id, CLOCKS.pack(ms(remaining['white']), ms(remaining['black']))))
+
+    def move(self, room_id, ply, code, remaining):
+        self.append(encode_record(MOVE, room_id, MOVE_FIELDS.pack(ply, code, ms(remaining['white']), ms(remaining['black']))))
+
+    def ended(self, room_id, reason, winner):
+        with self.cond:
+            self.live.discard(room_id)
+        self.append(encode_record(ENDED, room_id, END_FIELDS.pack(REASONS.index(reason), WINNERS.index(winner))))
+
+    def closed_room(self, room_id):
+        with self.cond:
+            was_live = room_id in self.live
+            self.live.discard(room_id)
+        if was_live:
+            self.append(encode_record(CLOSED, room_id))
+
+    def open_segment(self, index):
+        self.segment = index
+        self.file = open(self.segment_path(index), 'ab')
+        self.segment_size = self.file.tell()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.pending and not self.closed:
+                    if self.dirty:
+                        # Nothing new to write, but the last batch still needs its fsync
+                        timeout = self.fsync_interval - (time.monotonic() - self.last_fsync)
+                        if timeout <= 0:
+                            break
+                        self.cond.wait(timeout)
+                    else:
+                        self.cond.wait()
+                batch, self.pending = self.pending, []
+                closing = self.closed
+            if batch:
+                self.write(batch)
+            if self.dirty and (closing or time.monotonic() - self.last_fsync >= self.fsync_interval):
+                self.sync()
+            if closing:
+                return
+            if self.segment_size >= self.segment_bytes:
+                self.roll()
+
+    def write(self, batch):
+        data = b''.join(batch)
+        self.file.write(data)
+        self.file.flush()
+        self.segment_size += len(data)
+        self.records += len(batch)
+        self.commits += 1
+        self.dirty = True
+
+    def sync(self):
+        os.fsync(self.file.fileno())
+        self.fsyncs += 1
+        self.dirty = False
+        self.last_fsync = time.monotonic()
+
+    def roll(self):
+        self.sync()
+        self.file.close()
+        self.open_segment(self.segment + 1)
+        self.compact()
+
+    def compact(self):
+        """
+        Rewrite every sealed segment into one holding only the records of live games,
+        from each one's latest ROOM_CREATED on, so a game that ended under a room id
+        since reused is dropped with the rest. The result replaces the newest sealed segment before the older ones are removed,
+        so a crash part way through leaves, at worst, records that replay skips.
+        """
+        sealed = [index for index in self.segment_indexes() if index < self.segment]
+        if not sealed:
+            return
+        with self.cond:
+            live = set(self.live)
+        games = {}  # room id -> the records of its latest game
+        for index in sealed:
+            records, _ = read_records(self.segment_path(index))
+            for record_type, room_id, fields in records:
+                if room_id in live:
+                    if record_type == ROOM_CREATED:
+                        games[room_id] = []
+                    games.setdefault(room_id, []).append(encode_record(record_type, room_id, fields))
+        kept = [record for records in games.values() for record in records]
+        target = self.segment_path(sealed[-1])
+        if kept:
+            tmp = target + '.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(b''.join(kept))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, target)
+            sealed = sealed[:-1]
+        for index in sealed:
+            os.remove(self.segment_path(index))
+        self.compactions += 1
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        if self.thread is not None:
+            self.thread.join()
+        elif self.file is not None and self.dirty:
+            self.sync()
+        if self.file is not None:
+            self.file.close()
+
+    def stats(self):
+        return {
+            'segment': self.segment,
+            'live_games': len(self.live),
+            'records': self.records,
+            'commits': self.commits,
+            'fsyncs': self.fsyncs,
+            'compactions': self.compactions,
+        }
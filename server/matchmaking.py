@@ -0,0 +1,260 @@
+import bisect
+import itertools
+import threading
+import time
+from server.metrics import metrics
+
+DEFAULT_RATING = 1500.0
+PROVISIONAL_GAMES = 30  # games played under the larger K factor
+PROVISIONAL_K = 40.0
+ESTABLISHED_K = 20.0
+
+DEFAULT_WINDOW = 100.0      # rating gap a player accepts on joining the queue
+DEFAULT_WIDEN = 25.0        # added to the gap for every second spent waiting
+DEFAULT_MAX_WINDOW = 600.0
+DEFAULT_SWEEP_INTERVAL = 1.0
+BUCKET_SIZE = 512           # keys per bucket of the queue index; a bucket of twice that is split
+WAIT_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0)
+
+# Registered once for the process; server_main exports the queue length of its matchmaker
+wait_seconds = metrics.histogram('chess_matchmaking_wait_seconds', "Time from joining the queue to a match",
+                                 WAIT_BUCKETS)
+matches = metrics.counter('chess_matchmaking_matches_total', "Pairs made by the matchmaker")
+
+def expected_score(rating, opponent):
+    return 1 / (1 + 10 ** ((opponent - rating) / 400))
+
+class Ratings:
+    """
+    Elo ratings by player name, kept in memory for the life of the process.
+    A player's first PROVISIONAL_GAMES games move their rating faster.
+    """
+    def __init__(self):
+        self.players = {}  # name -> [rating, games]
+        self.lock = threading.Lock()
+
+    def rating(self, name):
+        with self.lock:
+            return self.players.get(name, (DEFAULT_RATING, 0))[0]
+
+    def record(self, white, black, winner):
+        """
+        Update both players from a result (winner 'white', 'black' or None for a draw)
+        and return their new ratings.
+        """
+        score = {'white': 1.0, 'black': 0.0, None: 0.5}[winner]
+        with self.lock:
+            white_entry = self.players.setdefault(white, [DEFAULT_RATING, 0])
+            black_entry = self.players.setdefault(black, [DEFAULT_RATING, 0])
+            expected = expected_score(white_entry[0], black_entry[0])
+            for entry, delta in ((white_entry, score - expected), (black_entry, expected - score)):
+                entry[0] += (PROVISIONAL_K if entry[1] < PROVISIONAL_GAMES else ESTABLISHED_K) * delta
+                entry[1] += 1
+            return white_entry[0], black_entry[0]
+
+class Ticket:
+    __slots__ = ('conn', 'name', 'rating', 'joined', 'key')
+
+    def __init__(self, conn, name, rating, joined, seq):
+        self.conn = conn
+        self.name = name
+        self.rating = rating
+        self.joined = joined
+        self.key = (rating, seq)  # position in the index; seq keeps equal ratings apart
+
+class SortedKeys:
+    """
+    Ticket keys in order, in buckets of sorted keys with the last key of each bucket in
+    a list of its own. A key is found by a binary search over the bucket maxima and one
+    inside its bucket, and inserting or removing one shifts a single bucket of at most
+    2 * BUCKET_SIZE keys instead of the whole queue.
+    """
+    def __init__(self):
+        self.buckets = []
+        self.maxes = []
+
+    def locate(self, key):
+        """
+        (bucket, position) where key is, or would be inserted.
+        """
+        b = bisect.bisect_left(self.maxes, key)
+        if b == len(self.maxes):
+            # Past the last key: the end of the last bucket
+            b = max(b - 1, 0)
+            return b, len(self.buckets[b]) if self.buckets else 0
+        return b, bisect.bisect_left(self.buckets[b], key)
+
+    def at(self, b, i):
+        """
+        The key at position i of bucket b, where i may run one past either end of the
+        bucket into its neighbour. None past the ends of the index.
+        """
+        if i < 0:
+            return self.buckets[b - 1][-1] if b > 0 else None
+        if i >= len(self.buckets[b]):
+            i -= len(self.buckets[b])
+            b += 1
+            return self.buckets[b][i] if b < len(self.buckets) else None
+        return self.buckets[b][i]
+
+    def add(self, key):
+        if not self.buckets:
+            self.buckets.append([key])
+            self.maxes.append(key)
+            return
+        b, i = self.locate(key)
+        bucket = self.buckets[b]
+        bucket.insert(i, key)
+        self.maxes[b] = bucket[-1]
+        if len(bucket) > 2 * BUCKET_SIZE:
+            self.buckets[b:b + 1] = [bucket[:BUCKET_SIZE], bucket[BUCKET_SIZE:]]
+            self.maxes.insert(b, bucket[BUCKET_SIZE - 1])
+
+    def remove(self, key):
+        b, i = self.locate(key)
+        bucket = self.buckets[b]
+        del bucket[i]
+        if bucket:
+            self.maxes[b] = bucket[-1]
+        else:
+            del self.buckets[b]
+            del self.maxes[b]
+
+    def neighbours(self, key):
+        """
+        The keys just before and just after key, leaving key itself out if it is
+        present. Either is None at an end of the index.
+        """
+        if not self.buckets:
+            return None, None
+        b, i = self.locate(key)
+        after = i + 1 if self.at(b, i) == key else i
+        return self.at(b, i - 1), self.at(b, after)
+
+class Matchmaker:
+    """
+    Players waiting for a rated game, paired by rating.
+    The queue is indexed by (rating, seq) keys in a SortedKeys, so a player's
+    closest-rated opponent is found with one binary search and a look at the two
+    neighbours. A name can be queued once at a time. A player accepts a gap of window points on joining, widened by widen
+    points for every second of waiting up to max_window; two players are paired when
+    the gap fits the window of the one who has waited longer. A newcomer is paired
+    at once if they can be; a sweep from the shared ClockScheduler pairs those whose
+    windows have since grown wide enough.
+    on_match(first, second) is called with the two tickets, outside the queue lock,
+    first being the one who waited longer.
+    """
+    def __init__(self, scheduler, on_match, ratings=None, window=DEFAULT_WINDOW, widen=DEFAULT_WIDEN,
+                 max_window=DEFAULT_MAX_WINDOW, sweep_interval=DEFAULT_SWEEP_INTERVAL):
+        self.scheduler = scheduler
+        self.on_match = on_match
+        self.ratings = ratings or Ratings()
+        self.window = window
+        self.widen = widen
+        self.max_window = max_window
+        self.sweep_interval = sweep_interval
+        self.index = SortedKeys()
+        self.by_key = {}     # key -> Ticket
+        self.tickets = {}    # conn -> Ticket, oldest first
+        self.names = {}      # name -> Ticket
+        self.seqs = itertools.count()
+        self.lock = threading.Lock()
+        self.matched = 0
+
+    def start(self):
+        if self.sweep_interval > 0:
+            self.scheduler.schedule(time.monotonic() + self.sweep_interval, self.sweep)
+
+    def window_for(self, ticket, now):
+        return min(self.max_window, self.window + self.widen * (now - ticket.joined))
+
+    def add(self, conn, name, now=None):
+        """
+        Queue conn under name, or pair it straight away. Joining again moves a player
+        to the back of the queue. Returns the ticket, or None if another connection is
+        already queued under name, which would let a player be paired with themselves.
+        """
+        now = time.monotonic() if now is None else now
+        ticket = Ticket(conn, name, self.ratings.rating(name), now, next(self.seqs))
+        with self.lock:
+            queued = self.names.get(name)
+            if queued is not None and queued.conn is not conn:
+                return None
+            self.discard(conn)
+            partner = self.nearest(ticket, now)
+            if partner is not None:
+                self.discard(partner.conn)
+            else:
+                self.insert(ticket)
+        if partner is not None:
+            self.pair(partner, ticket, now)
+        return ticket
+
+    def remove(self, conn):
+        """
+        Take conn out of the queue; returns False if it was not queued.
+        """
+        with self.lock:
+            return self.discard(conn) is not None
+
+    def sweep(self, now=None):
+        """
+        Pair everyone whose window has grown to reach an opponent, oldest first.
+        """
+        scheduled = now is None
+        now = time.monotonic() if now is None else now
+        pairs = []
+        with self.lock:
+            for ticket in list(self.tickets.values()):
+                if self.tickets.get(ticket.conn) is not ticket:
+                    continue  # paired earlier in this sweep
+                partner = self.nearest(ticket, now)
+                if partner is not None:
+                    self.discard(ticket.conn)
+                    self.discard(partner.conn)
+                    pairs.append((ticket, partner))
+        for first, second in pairs:
+            self.pair(first, second, now)
+        if scheduled:
+            self.scheduler.schedule(now + self.sweep_interval, self.sweep)
+        return len(pairs)
+
+    def nearest(self, ticket, now):
+        """
+        The queued ticket closest in rating to ticket that either of the two accepts,
+        or None. Callers hold self.lock.
+        """
+        window = self.window_for(ticket, now)
+        best = None
+        best_gap = None
+        for key in self.index.neighbours(ticket.key):
+            if key is not None:
+                other = self.by_key[key]
+                gap = abs(other.rating - ticket.rating)
+                if gap <= max(window, self.window_for(other, now)) and (best is None or gap < best_gap):
+                    best, best_gap = other, gap
+        return best
+
+    def insert(self, ticket):
+        self.index.add(ticket.key)
+        self.by_key[ticket.key] = ticket
+        self.tickets[ticket.conn] = ticket
+        self.names[ticket.name] = ticket
+
+    def discard(self, conn):
+        ticket = self.tickets.pop(conn, None)
+        if ticket is not None:
+            self.index.remove(ticket.key)
+            del self.by_key[ticket.key]
+            del self.names[ticket.name]
+        return ticket
+
+    def pair(self, first, second, now):
+        self.matched += 1
+        matches.inc()
+        wait_seconds.observe(now - first.joined)
+        wait_seconds.observe(now - second.joined)
+        self.on_match(first, second)
+
+    def __len__(self):
+        return len(self.tickets)
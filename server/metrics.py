@@ -0,0 +1,257 @@
+import bisect
+import collections
+import http.server
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+import urllib.parse
+
+# Latency buckets in seconds, from 10 microseconds to 2.5 seconds
+LATENCY_BUCKETS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0, 2.5)
+DEFAULT_SAMPLE_INTERVAL = 0.005
+LOG_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+class Counter:
+    """
+    A monotonically increasing value, optionally split by one label.
+    Updated without a lock like the outbound counters: the GIL makes each increment
+    cheap, and a rare lost update under the threaded server does not matter here.
+    """
+    def __init__(self, name, help_text, label=None):
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self.value = 0
+        self.values = collections.defaultdict(int)
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def inc_label(self, label_value, amount=1):
+        self.values[label_value] += amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        if self.label is None:
+            lines.append(f"{self.name} {self.value}")
+        else:
+            for label_value, value in sorted(self.values.items()):
+                lines.append(f'{self.name}{{{self.label}="{label_value}"}} {value}')
+        return lines
+
+class Gauge:
+    """
+    A value read when metrics are scraped; fn returns it. kind is 'counter' for values
+    some other module already counts, such as the outbound queue totals.
+    """
+    def __init__(self, name, help_text, fn, kind='gauge'):
+        self.name = name
+        self.help = help_text
+        self.fn = fn
+        self.kind = kind
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", f"{self.name} {self.fn()}"]
+
+class Histogram:
+    """
+    Fixed buckets; observing is a bisect and two additions.
+    """
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{bound:g}"}} {cumulative}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {self.count}')
+        lines.append(f"{self.name}_sum {self.sum}")
+        lines.append(f"{self.name}_count {self.count}")
+        return lines
+
+class Metrics:
+    """
+    Everything the server exports, rendered as Prometheus text on request.
+    """
+    def __init__(self):
+        self.metrics = []
+        self.connections = self.counter('chess_connections_total', "Client connections accepted")
+        self.disconnections = self.counter('chess_disconnections_total', "Client connections closed")
+        self.moves = self.counter('chess_moves_total', "Moves accepted")
+        self.rejected = self.counter('chess_moves_rejected_total', "Moves refused as illegal or out of turn")
+        self.chat_limited = self.counter('chess_chat_limited_total', "Chat lines refused by a sender's rate limit")
+        self.validation = self.histogram('chess_move_validation_seconds', "Time to validate and apply a move")
+        self.fanout = self.histogram('chess_broadcast_seconds', "Time to queue one room event for every member")
+        self.bytes_in = self.counter('chess_bytes_in_total', "Frame bytes received, by message type", 'type')
+        self.bytes_out = self.counter('chess_bytes_out_total', "Frame bytes queued for clients, by message type", 'type')
+        self.gauge('chess_open_connections', "Client connections currently open",
+                   lambda: self.connections.value - self.disconnections.value)
+
+    def counter(self, name, help_text, label=None):
+        metric = Counter(name, help_text, label)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, help_text, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name, help_text, fn, kind='gauge'):
+        metric = Gauge(name, help_text, fn, kind)
+        self.metrics.append(metric)
+        return metric
+
+    def frame_in(self, msg_obj, size):
+        self.bytes_in.inc_label(msg_obj.get('type') if isinstance(msg_obj.get('type'), str) else 'invalid', size)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                lines.append(f"# {metric.name} unavailable: {e}")
+        return "\n".join(lines) + "\n"
+
+# Shared by every module of the server process
+metrics = Metrics()
+
+class SamplingProfiler:
+    """
+    Samples every thread's stack each interval and counts the collapsed stacks, in the
+    "frame;frame;frame count" form flame graph tools read. Costs nothing until started.
+    """
+    def __init__(self):
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.interval = DEFAULT_SAMPLE_INTERVAL
+        self.running = False
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def start(self, interval=DEFAULT_SAMPLE_INTERVAL):
+        with self.lock:
+            if self.running:
+                return False
+            self.stacks = collections.Counter()
+            self.samples = 0
+            self.interval = interval
+            self.running = True
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+            return True
+
+    def stop(self):
+        with self.lock:
+            self.running = False
+            thread, self.thread = self.thread, None
+        if thread is not None:
+            thread.join()
+        return self.report()
+
+    def run(self):
+        own = threading.get_ident()
+        while self.running:
+            sampled = []
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                names = []
+                while frame is not None:
+                    code = frame.f_code
+                    names.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                names.reverse()
+                sampled.append(";".join(names))
+            with self.lock:
+                self.stacks.update(sampled)
+                self.samples += 1
+            time.sleep(self.interval)
+
+    def report(self, limit=None):
+        with self.lock:
+            top = self.stacks.most_common(limit)
+        return "".join(f"{stack} {count}\n" for stack, count in top)
+
+profiler = SamplingProfiler()
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    """
+    GET /metrics                     Prometheus text
+    GET /profile/start?interval=S    start the sampling profiler
+    GET /profile/stop                stop it and return the collapsed stacks
+    GET /profile                     the stacks so far, most frequent first
+    """
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        if url.path == '/metrics':
+            self.reply(200, metrics.render(), 'text/plain; version=0.0.4')
+        elif url.path == '/profile/start':
+            query = urllib.parse.parse_qs(url.query)
+            try:
+                interval = float(query.get('interval', [DEFAULT_SAMPLE_INTERVAL])[0])
+            except ValueError:
+                interval = DEFAULT_SAMPLE_INTERVAL
+            started = profiler.start(max(0.001, interval))
+            self.reply(200 if started else 409, "started\n" if started else "already running\n")
+        elif url.path == '/profile/stop':
+            self.reply(200, profiler.stop())
+        elif url.path == '/profile':
+            self.reply(200, profiler.report(100))
+        else:
+            self.reply(404, "not found\n")
+
+    def reply(self, status, body, content_type='text/plain'):
+        data = body.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # Scrapes are not worth a log line each
+        pass
+
+def serve_metrics(host, port):
+    """
+    Serve /metrics and the profiler controls from a daemon thread.
+    """
+    server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def configure_logging(level='info'):
+    """
+    Route every log record through a queue to one writer thread, so a handler that logs
+    never waits on stdout. Called again in each forked worker, which needs its own
+    writer thread. Returns the listener; stop() it to flush on shutdown.
+    """
+    records = queue.SimpleQueue()
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    listener = logging.handlers.QueueListener(records, handler)
+    root = logging.getLogger()
+    for old in list(root.handlers):
+        root.removeHandler(old)
+    root.addHandler(logging.handlers.QueueHandler(records))
+    root.setLevel(getattr(logging, level.upper()))
+    listener.start()
+    return listener
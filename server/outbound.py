@@ -0,0 +1,195 @@
+import collections
+import threading
+
+# Frame kinds. State frames (snapshots, move deltas, game end) can be replaced by a fresh
+# snapshot; chat frames may be dropped; control frames (color, errors, lobby replies)
+# are always delivered.
+STATE = 'state'
+CHAT = 'chat'
+CONTROL = 'control'
+
+# What to do when a client's queue is full
+SNAPSHOT = 'snapshot'      # throw away everything queued and send one fresh snapshot
+COALESCE = 'coalesce'      # replace queued state frames with one snapshot, keep chat/control
+DISCONNECT = 'disconnect'  # drop the client
+POLICIES = (SNAPSHOT, COALESCE, DISCONNECT)
+
+DEFAULT_QUEUE_LIMIT = 256
+# Chat frames a threaded writer sends in one write. It keeps writing until the chat is
+# drained, and a state frame queued meanwhile goes out on the next write rather than
+# after all of it.
+CHAT_PER_WRITE = 16
+DEFAULT_POLICY = SNAPSHOT
+queue_limit = DEFAULT_QUEUE_LIMIT
+overflow_policy = DEFAULT_POLICY
+
+def configure(limit=None, policy=None):
+    global queue_limit, overflow_policy
+    if limit is not None:
+        queue_limit = limit
+    if policy is not None:
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown overflow policy: {policy}")
+        overflow_policy = policy
+
+class OutboundStats:
+    """
+    Process-wide send counters. Updated without a lock, so under heavy threading the
+    values are approximate, which is fine for monitoring.
+    """
+    def __init__(self):
+        self.queued = 0
+        self.max_depth = 0
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.frames_dropped = 0
+        self.snapshots = 0
+        self.disconnects = 0
+
+    def as_dict(self):
+        return dict(vars(self))
+
+    def summary(self):
+        return (f"queued={self.queued} max_depth={self.max_depth} sent={self.frames_sent} "
+                f"bytes={self.bytes_sent} dropped={self.frames_dropped} "
+                f"snapshots={self.snapshots} disconnects={self.disconnects}")
+
+stats = OutboundStats()
+
+class OutboundQueue:
+    """
+    Bounded queue of already-encoded frames for one client.
+    Frames are shared bytes objects, so queueing the same broadcast for many clients
+    never re-encodes or copies it. Producers never block: when the queue is full the
+    overflow policy decides what gives. The client's writer takes frames off with
+    pop_all (asyncio) or wait_batch (threads).
+    Chat waits in a deque of its own and goes out after the state and control frames
+    queued with it, and a full queue sheds chat before anything else, so a busy chat
+    never holds back a move.
+    """
+    def __init__(self, limit=None, policy=None):
+        self.limit = limit or queue_limit
+        self.policy = policy or overflow_policy
+        self.frames = collections.deque()  # (kind, frame) of state and control frames
+        self.chat = collections.deque()
+        self.snapshot = None  # callable returning a fresh snapshot frame, set once seated
+        self.dropped = 0
+        self.overflowed = False
+        self.closed = False
+        self.cond = threading.Condition(threading.Lock())
+
+    def __len__(self):
+        return len(self.frames) + len(self.chat)
+
+    def push(self, frame, kind=CONTROL):
+        """
+        Queue a frame, applying the overflow policy if the queue is full.
+        Returns False if the client must be disconnected.
+        """
+        with self.cond:
+            if self.closed or self.overflowed:
+                return False
+            if len(self) >= self.limit:
+                if kind != CHAT and self.chat:
+                    # Chat gives way to the game
+                    self.chat.popleft()
+                    self.discard(1)
+                    self.append(kind, frame)
+                    return True
+                if kind == STATE and self.snapshot is not None and self.policy != DISCONNECT:
+                    # The snapshot already reflects this frame, so it takes its place
+                    self.replace_with_snapshot()
+                    self.reject()
+                    return True
+                if kind == CONTROL or self.policy == DISCONNECT:
+                    # A control frame cannot be dropped, and queueing it past the limit
+                    # would let a client that never reads grow its queue without bound
+                    self.overflowed = True
+                    stats.disconnects += 1
+                    self.cond.notify_all()
+                    return False
+                self.reject()
+                return True
+            self.append(kind, frame)
+            return True
+
+    def append(self, kind, frame):
+        if kind == CHAT:
+            self.chat.append(frame)
+        else:
+            self.frames.append((kind, frame))
+        stats.queued += 1
+        if len(self) > stats.max_depth:
+            stats.max_depth = len(self)
+        self.cond.notify()
+
+    def replace_with_snapshot(self):
+        if self.policy == SNAPSHOT:
+            self.discard(len(self))
+            self.frames.clear()
+            self.chat.clear()
+        else:
+            kept = collections.deque(item for item in self.frames if item[0] != STATE)
+            self.discard(len(self.frames) - len(kept))
+            self.frames = kept
+        self.append(STATE, self.snapshot())
+        stats.snapshots += 1
+
+    def discard(self, count):
+        """
+        Account for queued frames that were thrown away.
+        """
+        self.dropped += count
+        stats.frames_dropped += count
+        stats.queued -= min(count, stats.queued)
+
+    def reject(self):
+        """
+        Account for an incoming frame that was never queued.
+        """
+        self.dropped += 1
+        stats.frames_dropped += 1
+
+    def pop_all(self):
+        """
+        Take every queued frame. Returns a list of bytes.
+        """
+        with self.cond:
+            return self.take(len(self.chat))
+
+    def wait_batch(self):
+        """
+        Block until frames are queued and take every state and control frame with up to
+        CHAT_PER_WRITE chat frames, or return None once closed. Chat left over is taken
+        by the next call, which does not block.
+        """
+        with self.cond:
+            while not self.frames and not self.chat and not self.closed and not self.overflowed:
+                self.cond.wait()
+            if self.closed or self.overflowed:
+                return None
+            return self.take(CHAT_PER_WRITE)
+
+    def take(self, chat_count):
+        """
+        Every state and control frame, then up to chat_count chat frames.
+        """
+        frames = [frame for _, frame in self.frames]
+        self.frames.clear()
+        for _ in range(min(chat_count, len(self.chat))):
+            frames.append(self.chat.popleft())
+        self.sent(frames)
+        return frames
+
+    def sent(self, frames):
+        stats.queued -= min(len(frames), stats.queued)
+        stats.frames_sent += len(frames)
+        stats.bytes_sent += sum(len(frame) for frame in frames)
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            stats.queued -= min(len(self), stats.queued)
+            self.frames.clear()
+            self.chat.clear()
+            self.cond.notify_all()
@@ -0,0 +1,225 @@
+import logging
+import socket
+import threading
+import time
+from common.chess_game import ChessGame
+from common.protocol import Frame, MessageDecoder, make_message, make_join_room, make_resume
+from common.wire import ENCODINGS
+from server.outbound import STATE, CHAT
+
+# Pauses between attempts to reach the upstream server, the last one repeated
+RECONNECT_DELAYS = (0.5, 1, 2, 4, 8)
+
+log = logging.getLogger('server.relay')
+
+def parse_upstream(address):
+    """
+    'host:port' as (host, port); raises ValueError if it is not one.
+    """
+    host, _, port = address.rpartition(':')
+    if not host or not port.isdigit():
+        raise ValueError(f"Expected host:port, got {address!r}")
+    return host, int(port)
+
+class RelayLink:
+    """
+    One spectator connection to a room on an upstream server (the origin or another
+    relay), feeding the upstream event stream into a local room of the same id.
+    Events keep the upstream's sequence numbers and are re-published to the local
+    members, so each upstream frame is received once and fanned out here, and relays
+    can be chained into a tree. The local room also keeps a ChessGame and clock in step
+    with the stream, so a late joiner gets its snapshot from this process.
+    The link reads on a thread of its own and hands events to apply through dispatch,
+    like the ClockScheduler's callbacks; after a dropped connection it resumes its
+    session and gets only the events it missed.
+    on_end() is called, outside the room lock, whenever the upstream says the game is over.
+    """
+    def __init__(self, upstream, room, name='relay', on_end=None):
+        self.host, self.port = parse_upstream(upstream)
+        self.room = room
+        self.name = name
+        self.on_end = on_end
+        self.session = None
+        self.last_seq = 0
+        self.sock = None
+        self.joined = False  # the upstream has accepted this connection's join or resume
+        self.send_lock = threading.Lock()
+        self.dispatch = None
+        self.thread = None
+        self.closed = False
+        self.received = 0
+        self.connects = 0
+
+    def start(self, dispatch=None):
+        self.dispatch = dispatch
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        attempt = 0
+        while not self.closed:
+            if self.subscribe():
+                attempt = 0
+                self.read()
+            if self.closed:
+                break
+            time.sleep(RECONNECT_DELAYS[min(attempt, len(RECONNECT_DELAYS) - 1)])
+            attempt += 1
+
+    def subscribe(self):
+        """
+        Connect and join the room as a spectator, or resume the session we had.
+        """
+        try:
+            sock = socket.create_connection((self.host, self.port), timeout=10)
+            sock.settimeout(None)
+        except OSError as e:
+            log.warning("Cannot reach upstream %s:%d: %s", self.host, self.port, e)
+            return False
+        if self.session is not None:
+            hello = make_resume(self.room.room_id, self.session, self.last_seq, list(ENCODINGS))
+        else:
+            hello = make_join_room(self.name, self.room.room_id, True, list(ENCODINGS))
+        try:
+            sock.sendall(hello)
+        except OSError:
+            sock.close()
+            return False
+        self.sock = sock
+        self.joined = False
+        self.connects += 1
+        return True
+
+    def read(self):
+        decoder = MessageDecoder()
+        while True:
+            try:
+                messages = decoder.recv_from(self.sock)
+            except OSError:
+                messages = None
+            if messages is None or not all(self.handle(msg_obj) for msg_obj in messages):
+                break
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+        if not self.closed:
+            log.warning("Lost upstream %s:%d; reconnecting", self.host, self.port)
+
+    def handle(self, msg_obj):
+        """
+        Answer what concerns the link itself here and pass game events on. Returns
+        False if the upstream refused us and the connection should be dropped.
+        """
+        msg_type = msg_obj['type']
+        content = msg_obj.get('content')
+        if not isinstance(content, dict):
+            return True
+        if msg_type == 'ping':
+            self.send('pong', {'id': content.get('id')})
+        elif msg_type == 'color':
+            self.session = content.get('session')
+            self.joined = True
+            log.info("Relaying room %s from %s:%d", self.room.room_id, self.host, self.port)
+        elif msg_type == 'error':
+            log.warning("Upstream: %s", content.get('text'))
+            if not self.joined:
+                # The room does not exist upstream (yet), or our session has expired:
+                # try again later with a fresh join
+                self.session = None
+                return False
+        else:
+            self.received += 1
+            if isinstance(content.get('seq'), int):
+                self.last_seq = max(self.last_seq, content['seq'])
+            if self.dispatch is None:
+                self.apply(msg_type, content)
+            else:
+                self.dispatch(self.apply, msg_type, content)
+        return True
+
+    def send(self, msg_type, content):
+        with self.send_lock:
+            try:
+                self.sock.sendall(make_message(msg_type, content))
+            except OSError:
+                pass
+
+    def apply(self, msg_type, content):
+        room = self.room
+        with room.lock:
+            if msg_type == 'board':
+                self.apply_snapshot(content)
+            elif msg_type == 'move':
+                self.apply_move(content)
+            elif msg_type == 'game_over':
+                room.forfeit_winner = content.get('winner')
+                room.upstream_over = True
+                self.set_clock(content.get('player_times'), None)
+                room.seq = content.get('seq', room.seq)
+                room.publish(Frame('game_over', content), kind=STATE)
+            elif msg_type in ('chat', 'chat_batch'):
+                room.seq = content.get('seq', room.seq)
+                room.publish(Frame(msg_type, content), kind=CHAT)
+            elif msg_type == 'eval':
+                room.broadcast(Frame('eval', content), kind=CHAT)
+            ended = room.upstream_over
+        if ended and self.on_end is not None:
+            self.on_end()
+
+    def apply_snapshot(self, content):
+        room = self.room
+        game = ChessGame()
+        for move_uci in content.get('history') or []:
+            if not game.push_move(move_uci):
+                log.warning("Upstream history of room %s has an illegal move %s", room.room_id, move_uci)
+                break
+        room.game = game
+        room.replay = None
+        room.clock.increment = content.get('increment', room.clock.increment)
+        room.clock.delay = content.get('delay', room.clock.delay)
+        over = content.get('game_over', False)
+        room.upstream_over = bool(over)
+        room.forfeit_winner = content.get('winner') if over and not game.is_game_over() else None
+        self.set_clock(content.get('player_times'), None if over else content.get('turn'))
+        room.started = True
+        # The events before a snapshot cannot be replayed on top of it
+        room.seq = content.get('seq', room.seq)
+        room.events.clear()
+        room.broadcast(Frame('board', content), kind=STATE)
+
+    def apply_move(self, content):
+        room = self.room
+        ply = content.get('ply')
+        if not isinstance(ply, int) or ply <= room.game.ply():
+            return
+        if ply != room.game.ply() + 1 or not room.game.push_move(content.get('move')):
+            self.send('resync', {})
+            return
+        self.set_clock(content.get('player_times'), None if content.get('game_over') else content.get('turn'))
+        room.seq = content.get('seq', room.seq)
+        room.publish(Frame('move', content), kind=STATE)
+
+    def set_clock(self, times, running):
+        """
+        Take the upstream's clocks as of now, with running's clock counting down.
+        """
+        clock = self.room.clock
+        if isinstance(times, dict):
+            clock.remaining = {color: float(times.get(color, clock.remaining[color])) for color in ('white', 'black')}
+        if running in ('white', 'black'):
+            clock.start(running)
+        else:
+            clock.running = None
+            clock.turn_started = None
+
+    def close(self):
+        self.closed = True
+        if self.sock is not None:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def stats(self):
+        return {'upstream': f"{self.host}:{self.port}", 'received': self.received, 'connects': self.connects}
@@ -0,0 +1,71 @@
+import threading
+import time
+from common.protocol import Frame
+from server.outbound import CHAT
+
+DEFAULT_SPEED = 2.0  # plies per second
+MAX_SPEED = 50.0
+
+class ReplayStream:
+    """
+    One connection's playback of a game from a common.chess_game.GameReplay, one ply
+    per 1/speed seconds, driven by the shared ClockScheduler.
+    Every frame carries the position's FEN, so frames can be queued like chat and
+    dropped for a slow client without breaking the ones after. Seeking starts from the
+    nearest checkpoint; stepping pushes one move onto the stream's own board.
+    The replay may be a live game's, extended while it streams; playback stops when
+    it catches up with the last move.
+    """
+    def __init__(self, conn, replay, scheduler, source):
+        self.conn = conn
+        self.replay = replay
+        self.scheduler = scheduler
+        self.source = source  # what is being replayed: ('room', id) or ('game', archive id)
+        self.ply = 0
+        self.speed = DEFAULT_SPEED
+        self.board = None
+        self.timer = None
+        self.stopped = False
+        # Steps run on the scheduler thread in the threaded server, requests on the reader
+        self.lock = threading.Lock()
+
+    def seek(self, ply, speed):
+        """
+        Jump to ply, send that position and play on at speed (0 pauses).
+        """
+        with self.lock:
+            self.scheduler.cancel(self.timer)
+            self.timer = None
+            self.stopped = False
+            self.ply = max(0, min(ply, len(self.replay)))
+            self.speed = speed
+            self.board = self.replay.board_at(self.ply)
+            last = self.replay.move_at(self.ply).uci() if self.ply else None
+            self.send(last)
+            self.schedule()
+
+    def step(self):
+        with self.lock:
+            self.timer = None
+            if self.stopped or self.ply >= len(self.replay):
+                return
+            self.ply += 1
+            move = self.replay.move_at(self.ply)
+            self.board.push(move)
+            self.board.clear_stack()
+            self.send(move.uci())
+            self.schedule()
+
+    def schedule(self):
+        if self.speed > 0 and self.ply < len(self.replay):
+            self.timer = self.scheduler.schedule(time.monotonic() + 1 / self.speed, self.step)
+
+    def send(self, move_uci):
+        self.conn.send(Frame('replay', {'ply': self.ply, 'plies': len(self.replay), 'move': move_uci,
+                                        'fen': self.board.fen(), 'speed': self.speed}), CHAT)
+
+    def stop(self):
+        with self.lock:
+            self.stopped = True
+            self.scheduler.cancel(self.timer)
+            self.timer = None
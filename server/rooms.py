@@ -0,0 +1,360 @@
+import collections
+import itertools
+import secrets
+import threading
+import time
+import uuid
+from common.chess_game import ChessGame
+from server.clock import GameClock
+from server.metrics import metrics
+from server.outbound import CONTROL
+
+DEFAULT_ROOM = 'main'
+TIME_LIMIT_SECONDS = 30 * 60  # 30 minutes per player
+MAX_LISTED_ROOMS = 100
+MAX_ROOM_ID_LENGTH = 64
+EVENT_BUFFER = 256  # recent events kept per room for clients that resume
+SEAT_GRACE_SECONDS = 60  # how long a disconnected player's seat is held
+
+class Room:
+    """
+    One game: its board, the two seats, spectators and the clocks.
+    Everything a move touches lives here, so handling a move or broadcasting an
+    update only ever walks this room's members.
+    """
+    def __init__(self, room_id, time_limit=TIME_LIMIT_SECONDS, increment=0, delay=0):
+        self.room_id = room_id
+        self.game = ChessGame()
+        self.seats = {'white': None, 'black': None}
+        self.spectators = set()
+        self.members = {}  # insertion-ordered set of connections
+        self.clock = GameClock(time_limit, increment, delay)
+        self.time_control = (time_limit, increment, delay)
+        self.replay = None  # GameReplay of the game for seeking, built on first use
+        self.chat = None  # server.chat.ChatBatcher, created with the room's first chat line
+        self.rated = False  # paired by the matchmaker; the result updates both ratings
+        # 'host:port' this room's game is relayed from, or None if it is played here
+        self.upstream = None
+        self.upstream_over = False  # the relayed game has ended upstream
+        self.flag_timer = None  # pending flag-fall timer in the shared ClockScheduler
+        self.started = False
+        self.forfeit_winner = None  # set when a player loses on time
+        # Names the seats are held for in a game restored from the journal
+        self.reserved = {'white': None, 'black': None}
+        # Session token -> (color, name) for every client that has joined
+        self.sessions = {}
+        # Seats of disconnected players waiting for them to resume: color -> monotonic expiry
+        self.held = {}
+        # Sessions of disconnected spectators, forgotten when the grace period is over:
+        # token -> monotonic expiry
+        self.spectator_expiry = {}
+        # Sequence number of the last event broadcast to the room, and the latest events
+        self.seq = 0
+        self.events = collections.deque(maxlen=EVENT_BUFFER)
+        self.lock = threading.RLock()
+
+    def add_member(self, conn, spectate=False, name=None):
+        """
+        Seat conn in the first free color (or as a spectator) and return the color.
+        A seat held for a returning player only goes to a client with that name.
+        """
+        with self.lock:
+            color = 'spectator'
+            if not spectate:
+                for seat in ('white', 'black'):
+                    if self.seats[seat] is None and seat not in self.held and self.reserved[seat] in (None, name):
+                        color = seat
+                        break
+            if color == 'spectator':
+                self.spectators.add(conn)
+            else:
+                self.seats[color] = conn
+                self.reserved[color] = None
+            self.members[conn] = None
+            conn.room = self
+            conn.color = color
+            conn.session = secrets.token_hex(16)
+            self.sessions[conn.session] = (color, name)
+            return color
+
+    def resume_member(self, conn, token):
+        """
+        Put conn back where session token was: its held seat, the seat an older connection
+        of the same session still occupies, or among the spectators.
+        Returns (color, replaced), where replaced is that older connection for the caller
+        to close; color is None if the session cannot be resumed.
+        """
+        with self.lock:
+            entry = self.sessions.get(token)
+            if entry is None:
+                return None, None
+            color, name = entry
+            replaced = None
+            if color == 'spectator':
+                self.spectators.add(conn)
+                self.spectator_expiry.pop(token, None)
+            else:
+                replaced = self.seats[color]
+                if replaced is None and color not in self.held:
+                    return None, None
+                if replaced is not None:
+                    if replaced.session != token:
+                        return None, None
+                    self.members.pop(replaced, None)
+                    replaced.room = None
+                self.seats[color] = conn
+                self.held.pop(color, None)
+            self.members[conn] = None
+            conn.room = self
+            conn.color = color
+            conn.name = name
+            conn.session = token
+            return color, replaced
+
+    def hold_seat(self, color, expiry):
+        self.held[color] = expiry
+
+    def hold_spectator(self, token, expiry):
+        self.spectator_expiry[token] = expiry
+
+    def release_expired(self, now=None):
+        """
+        Give up held seats whose grace period is over, and their sessions, and forget
+        spectators who have not come back in time. Returns the colors released.
+        """
+        now = time.monotonic() if now is None else now
+        released = [color for color, expiry in self.held.items() if expiry <= now]
+        for color in released:
+            del self.held[color]
+            for token, (seat, _) in list(self.sessions.items()):
+                if seat == color:
+                    del self.sessions[token]
+        expired = [token for token, expiry in self.spectator_expiry.items() if expiry <= now]
+        if expired:
+            # A session resumed on a new connection before the old one closed is still in use
+            watching = {member.session for member in self.spectators}
+            for token in expired:
+                del self.spectator_expiry[token]
+                if token not in watching:
+                    self.sessions.pop(token, None)
+        return released
+
+    def remove_member(self, conn):
+        with self.lock:
+            self.members.pop(conn, None)
+            self.spectators.discard(conn)
+            for seat, player in self.seats.items():
+                if player is conn:
+                    self.seats[seat] = None
+            conn.room = None
+
+    def next_seq(self):
+        self.seq += 1
+        return self.seq
+
+    def publish(self, message, sender=None, kind=CONTROL):
+        """
+        Broadcast an event built with next_seq() and keep it for clients that resume.
+        Callers hold self.lock.
+        """
+        self.events.append((self.seq, message))
+        self.broadcast(message, sender, kind)
+
+    def events_since(self, last_seq):
+        """
+        Frames of the events after last_seq, or None if some of them are no longer buffered.
+        """
+        if last_seq >= self.seq:
+            return []
+        if not self.events or self.events[0][0] > last_seq + 1:
+            return None
+        return [message for seq, message in self.events if seq > last_seq]
+
+    def is_game_over(self):
+        return self.forfeit_winner is not None or self.game.is_game_over()
+
+    def winner(self):
+        return self.forfeit_winner or self.game.get_winner()
+
+    def is_full(self):
+        return self.seats['white'] is not None and self.seats['black'] is not None
+
+    def is_empty(self):
+        return not self.members
+
+    def is_abandoned(self):
+        # A relayed room waits for spectators until its game has ended upstream
+        return not self.members and not self.held and (self.upstream is None or self.upstream_over)
+
+    def broadcast(self, message, sender=None, kind=CONTROL):
+        """
+        Queue one message for every member. A Frame is encoded once per wire encoding,
+        and those bytes are shared by all of the send queues. Callers hold self.lock.
+        """
+        started = time.perf_counter()
+        for member in self.members:
+            if member is not sender:
+                member.send(message, kind)
+        metrics.fanout.observe(time.perf_counter() - started)
+
+    def summary(self):
+        white = self.seats['white']
+        black = self.seats['black']
+        return {
+            'room': self.room_id,
+            'white': white.name if white else None,
+            'black': black.name if black else None,
+            'spectators': len(self.spectators),
+            'moves': self.game.ply(),
+            'started': self.started,
+            'game_over': self.is_game_over(),
+        }
+
+class RoomRegistry:
+    """
+    All rooms hosted by this process, keyed by room id.
+    Lock order is registry before room; rooms are dropped once their last member
+    has left and no seat is held for a disconnected player.
+    """
+    def __init__(self, time_limit=TIME_LIMIT_SECONDS, increment=0, delay=0):
+        self.rooms = {}
+        self.time_control = (time_limit, increment, delay)
+        # When sharded, owns(room_id) tells whether this worker hosts a room id
+        self.owns = None
+        # server.journal.Journal recording room creation and closing, if enabled
+        self.journal = None
+        self.lock = threading.Lock()
+
+    def new_room_id(self):
+        while True:
+            room_id = uuid.uuid4().hex[:8]
+            if room_id not in self.rooms and (self.owns is None or self.owns(room_id)):
+                return room_id
+
+    def create(self, conn, room_id=None, time_control=None):
+        """
+        Create a room with conn in its first seat and return (room, color),
+        or (None, None) if room_id is already taken.
+        """
+        with self.lock:
+            if room_id is None:
+                room_id = self.new_room_id()
+            elif room_id in self.rooms:
+                return None, None
+            room = self.new_room(room_id, time_control or self.time_control)
+            return room, room.add_member(conn)
+
+    def new_room(self, room_id, time_control):
+        # Callers hold self.lock
+        room = Room(room_id, *time_control)
+        self.rooms[room_id] = room
+        if self.journal is not None:
+            self.journal.room_created(room_id, time_control)
+        return room
+
+    def create_match(self, white, black, white_name, black_name):
+        """
+        Create a rated room with both of a matched pair seated.
+        """
+        with self.lock:
+            room = self.new_room(self.new_room_id(), self.time_control)
+            room.rated = True
+            room.add_member(white, name=white_name)
+            room.add_member(black, name=black_name)
+            return room
+
+    def restore(self, room_id, time_control, game):
+        """
+        Recreate a room for a game recovered from the journal, with no members yet.
+        """
+        with self.lock:
+            room = Room(room_id, *time_control)
+            room.game = game
+            self.rooms[room_id] = room
+            return room
+
+    def relayed(self, room_id, upstream):
+        """
+        Create the room a relay feeds from upstream; its members can only watch.
+        """
+        with self.lock:
+            room = Room(room_id, *self.time_control)
+            room.upstream = upstream
+            self.rooms[room_id] = room
+            return room
+
+    def get(self, room_id):
+        return self.rooms.get(room_id)
+
+    def resume(self, conn, room_id, token):
+        """
+        Return conn to the place it held under session token: (room, color, replaced)
+        as from Room.resume_member, or (None, None, None).
+        """
+        with self.lock:
+            room = self.rooms.get(room_id)
+            if room is None:
+                return None, None, None
+            color, replaced = room.resume_member(conn, token)
+            if color is None:
+                return None, None, None
+            return room, color, replaced
+
+    def join(self, conn, room_id, spectate=False, create=False, name=None):
+        """
+        Add conn to a room and return (room, color), or (None, None) if it does not exist.
+        """
+        with self.lock:
+            room = self.rooms.get(room_id)
+            if room is None:
+                if not create:
+                    return None, None
+                room = self.new_room(room_id, self.time_control)
+            return room, room.add_member(conn, spectate, name)
+
+    def leave(self, conn):
+        """
+        Remove conn from its room, dropping the room once it is abandoned.
+        Returns the room conn was in.
+        """
+        room = conn.room
+        if room is None:
+            return None
+        with self.lock:
+            room.remove_member(conn)
+            self.drop_if_abandoned(room)
+        return room
+
+    def release_holds(self, room):
+        """
+        Give up the room's seats whose grace period is over, dropping the room if nobody
+        is left. Returns the colors released.
+        """
+        with self.lock:
+            with room.lock:
+                released = room.release_expired()
+            self.drop_if_abandoned(room)
+        return released
+
+    def close_if_abandoned(self, room):
+        """
+        Drop room if it is abandoned; True if it is no longer hosted.
+        """
+        with self.lock:
+            self.drop_if_abandoned(room)
+            return self.rooms.get(room.room_id) is not room
+
+    def drop_if_abandoned(self, room):
+        # Callers hold self.lock
+        if room.is_abandoned() and self.rooms.get(room.room_id) is room:
+            del self.rooms[room.room_id]
+            if self.journal is not None:
+                self.journal.closed_room(room.room_id)
+
+    def list(self, limit=MAX_LISTED_ROOMS):
+        with self.lock:
+            rooms = list(itertools.islice(self.rooms.values(), limit))
+        return [room.summary() for room in rooms]
+
+    def __len__(self):
+        return len(self.rooms)
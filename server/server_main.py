@@ -1,170 +1,1026 @@
+import argparse
+import logging
+import os
+import shlex
+import signal
 import socket
+import sys
 import threading
 import time
-from common.protocol import make_message, parse_message
-from common.chess_game import ChessGame
+from common.protocol import make_message, MessageDecoder, Frame, frame_type
+from common.wire import JSON, choose_encoding
+from common.position_cache import position_cache
+from common.chess_game import GameReplay
+from server.rooms import RoomRegistry, DEFAULT_ROOM, TIME_LIMIT_SECONDS, MAX_ROOM_ID_LENGTH, SEAT_GRACE_SECONDS
+from server.clock import ClockScheduler, other_color
+from server import outbound
+from server.outbound import OutboundQueue, STATE, CHAT, CONTROL
+from server.shards import handoff_payload
+from server.analysis import AnalysisPool, LIVE, ARCHIVED
+from server.metrics import metrics, serve_metrics, configure_logging
+from server.heartbeat import Heartbeat, DEFAULT_INTERVAL, DEFAULT_TIMEOUT
+from server.replay import ReplayStream, DEFAULT_SPEED as DEFAULT_REPLAY_SPEED, MAX_SPEED as MAX_REPLAY_SPEED
+from server import chat
+from server.chat import ChatBatcher, TokenBucket
+from server import matchmaking
+from server.matchmaking import Matchmaker
+
+# SO_REUSEPORT lets every worker bind its own listening socket; without it the
+# supervisor opens one socket before forking and the workers share it
+REUSE_PORT = hasattr(socket, 'SO_REUSEPORT')
 
 HOST = '0.0.0.0'
 PORT = 5555
-clients = []
-players = []  # List of (client_socket, addr, name, color)
-game = ChessGame()
-
-# Add time control (e.g., 30 minutes per player)
-TIME_LIMIT_SECONDS = 30 * 60  # 30 minutes
-player_times = {'white': TIME_LIMIT_SECONDS, 'black': TIME_LIMIT_SECONDS}
-last_move_time = None
-current_timer_color = None
-
-# Broadcast message to all clients
-def broadcast(message, sender=None):
-    for client in clients:
-        if client != sender:
-            try:
-                client.sendall(message)
-            except Exception:
-                pass
-
-def handle_client(client_socket, addr):
-    global players, player_times, last_move_time, current_timer_color, game
-    print(f"Client connected: {addr}")
-    # Receive player name
-    try:
-        name_data = client_socket.recv(1024)
-        name_msg = parse_message(name_data.decode())
-        if name_msg['type'] == 'join':
-            player_name = name_msg['content'].get('name', f"Player_{len(players)+1}")
+LISTEN_BACKLOG = 1024
+# What a spectator of a relayed room may ask of the relay; the rest goes to the origin
+RELAY_MESSAGES = frozenset(('resync', 'replay', 'analyse'))
+# Routes 'queue' to one worker, which hosts the matchmaker and every room it creates
+MATCHMAKING_KEY = 'matchmaking'
+DEFAULT_MAX_LAG = 0.5
+registry = RoomRegistry()
+scheduler = ClockScheduler()
+shard = None  # this worker's server.shards.Shard when running under the supervisor
+journal = None  # server.journal.Journal when --journal is given
+archive = None  # server.archive.Archive when --archive is given
+relay = None  # server.relay.RelayLink when this process relays a game from --relay-upstream
+analysis = None  # server.analysis.AnalysisPool when --engine is given
+seat_grace = SEAT_GRACE_SECONDS  # seconds a disconnected player's seat waits for them to resume
+heartbeat = None  # server.heartbeat.Heartbeat pinging every connection
+matchmaker = None  # server.matchmaking.Matchmaker pairing the players who send 'queue'
+max_lag = DEFAULT_MAX_LAG  # largest network allowance a move gets, in seconds
+chat_window = chat.DEFAULT_WINDOW  # seconds a room's chat lines are gathered into one frame
+chat_rate = chat.DEFAULT_RATE  # chat lines per second, and in one burst, each sender may send
+chat_burst = chat.DEFAULT_BURST
+log = logging.getLogger('server.main')
+log_listener = None  # writes queued log records; stopped on shutdown so none are lost
+
+class SocketConnection:
+    """
+    A client served by its own reader thread over a blocking socket.
+    Sends only queue the frame; a dedicated writer thread drains the queue, so a slow
+    peer never blocks the thread that is broadcasting a move.
+    """
+    def __init__(self, sock, addr):
+        self.sock = sock
+        self.addr = addr
+        self.name = None
+        self.color = None
+        self.room = None
+        self.session = None
+        self.encoding = JSON
+        # Kept by the heartbeat: smoothed round trip in seconds, and when the client last spoke
+        self.rtt = None
+        self.last_seen = time.monotonic()
+        self.replay = None  # server.replay.ReplayStream this client is watching
+        self.chat_bucket = None  # server.chat.TokenBucket, made with the client's first chat line
+        self.outbound = OutboundQueue()
+        # Set by the message handler when this connection belongs to another worker
+        self.handoff = None
+        self.handed_off = False
+        self.writer = threading.Thread(target=self.write_loop, daemon=True)
+        self.writer.start()
+
+    def send(self, data, kind=CONTROL):
+        if type(data) is Frame:
+            msg_type = data.msg_type
+            data = data.encode(self.encoding)
         else:
-            player_name = f"Player_{len(players)+1}"
-    except Exception:
-        player_name = f"Player_{len(players)+1}"
-    # Assign color
-    if len(players) == 0:
-        color = 'white'
-    elif len(players) == 1:
-        color = 'black'
-    elif len(players) == 2:
-        color= 'spectator'
-    else:
-        client_socket.sendall(make_message('error', {'text': 'Game is full. Only two players allowed.'}))
-        client_socket.close()
-        return
-    players.append((client_socket, addr, player_name, color))
-    clients.append(client_socket)
-    # Notify client of their color
-    client_socket.sendall(make_message('color', {'color': color}))
-    print(f"Assigned {player_name} as {color}")
-    # If both players are connected, broadcast a board message to start the game
-    if len(players) == 2:
-        last_move_time = time.time()
-        current_timer_color = 'white'
-        board_msg = make_message('board', {
-            'fen': game.get_board_fen(),
-            'move': None,
-            'turn': game.turn,
-            'history': game.get_move_history(),
-            'game_over': game.is_game_over(),
-            'winner': game.get_winner(),
-            'both_connected': True,
-            'player_times': player_times
-        })
-        broadcast(board_msg)
-    try:
+            msg_type = frame_type(data)
+        metrics.bytes_out.inc_label(msg_type, len(data))
+        if not self.outbound.push(data, kind):
+            self.close()
+
+    def write_loop(self):
         while True:
-            data = client_socket.recv(1024)
-            if not data:
+            frames = self.outbound.wait_batch()
+            if frames is None:
                 break
             try:
-                msg_obj = parse_message(data.decode())
-                if msg_obj['type'] == 'chat':
-                    sender = player_name
-                    chat_msg = make_message('chat', {'sender': sender, 'text': msg_obj['content'].get('text', '')})
-                    broadcast(chat_msg, sender=client_socket)
-                    print(f"{sender}: {msg_obj['content'].get('text', '')}")
-                elif msg_obj['type'] == 'move':
-                    move_uci = msg_obj['content'].get('move')
-                    sender = player_name
-                    # Only allow move if it's this player's turn and color
-                    if (color == 'white' and game.turn == 'white') or (color == 'black' and game.turn == 'black'):
-                        now = time.time()
-                        # Update timer for the player who just moved
-                        if current_timer_color == color and last_move_time is not None:
-                            elapsed = now - last_move_time
-                            player_times[color] -= elapsed
-                            if player_times[color] <= 0:
-                                # Time out, other player wins
-                                winner = 'black' if color == 'white' else 'white'
-                                board_msg = make_message('board', {
-                                    'fen': game.get_board_fen(),
-                                    'move': move_uci,
-                                    'turn': game.turn,
-                                    'history': game.get_move_history(),
-                                    'game_over': True,
-                                    'winner': winner,
-                                    'player_times': player_times
-                                })
-                                broadcast(board_msg)
-                                break
-                        last_move_time = now
-                        current_timer_color = 'black' if color == 'white' else 'white'
-                        if move_uci and game.push_move(move_uci):
-                            board_msg = make_message('board', {
-                                'fen': game.get_board_fen(),
-                                'move': move_uci,
-                                'turn': game.turn,
-                                'history': game.get_move_history(),
-                                'game_over': game.is_game_over(),
-                                'winner': game.get_winner(),
-                                'player_times': player_times
-                            })
-                            broadcast(board_msg)
-                            print(f"Move {move_uci} accepted from {sender}")
-                        else:
-                            error_msg = make_message('error', {'text': f'Illegal move: {move_uci}'})
-                            client_socket.sendall(error_msg)
+                self.sock.sendall(frames[0] if len(frames) == 1 else b''.join(frames))
+            except OSError:
+                break
+        self.close()
+
+    def hand_off(self, messages, decoder):
+        """
+        Pass the socket and the unhandled messages to self.handoff, then let go of the
+        socket without shutting the connection down. If the other worker cannot take it,
+        self.handoff is cleared so the connection is closed like any other.
+        """
+        try:
+            self.handoff(self.sock, handoff_payload(messages, decoder))
+        except (OSError, ValueError) as e:
+            log.warning("Could not hand off %s: %s", self.addr, e)
+            self.handoff = None
+            return
+        self.handed_off = True
+        self.outbound.close()
+        self.sock.close()
+
+    def close(self):
+        self.outbound.close()
+        if self.handed_off:
+            return
+        try:
+            # Wakes the reader thread blocked in recv
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+def snapshot_message(room, **extra):
+    """
+    Full board state, sent only when a client joins or asks to resync.
+    """
+    game = room.game
+    history = game.get_move_history()
+    content = {
+        'seq': room.seq,
+        'ply': len(history),
+        'fen': game.get_board_fen(),
+        'turn': game.turn,
+        'history': history,
+        'game_over': room.is_game_over(),
+        'winner': room.winner(),
+        'player_times': room.clock.snapshot(),
+        'increment': room.clock.increment,
+        'delay': room.clock.delay,
+    }
+    content.update(extra)
+    return Frame('board', content)
+
+def move_event(room, move_uci, now):
+    """
+    Delta for one accepted move: the new ply and the clocks, not the whole history.
+    """
+    return Frame('move', {
+        'seq': room.next_seq(),
+        'ply': room.game.ply(),
+        'move': move_uci,
+        'turn': room.game.turn,
+        'game_over': room.is_game_over(),
+        'winner': room.winner(),
+        'player_times': room.clock.snapshot(now),
+    })
+
+def game_over_event(room, reason):
+    return Frame('game_over', {
+        'seq': room.next_seq(),
+        'reason': reason,
+        'winner': room.winner(),
+        'player_times': room.clock.snapshot(),
+    })
+
+def arm_flag_timer(room):
+    """
+    (Re)schedule the running side's flag fall in the shared scheduler.
+    Clock state is only pushed to clients when it changes: at the start, on each
+    move and when a flag falls; clients count down locally in between.
+    """
+    scheduler.cancel(room.flag_timer)
+    deadline = room.clock.deadline(lag_allowance(room.seats.get(room.clock.running)))
+    room.flag_timer = scheduler.schedule(deadline, lambda: flag_fall(room)) if deadline is not None else None
+
+def lag_allowance(conn):
+    """
+    Time a player's move is not charged for: the connection's smoothed round trip,
+    which covers the opponent's move reaching them and theirs coming back, capped at
+    max_lag so a client cannot buy itself time by answering pings late.
+    """
+    if conn is None or conn.rtt is None:
+        return 0.0
+    return min(conn.rtt, max_lag)
+
+def stop_clock(room):
+    room.clock.stop()
+    scheduler.cancel(room.flag_timer)
+    room.flag_timer = None
+
+def flag_fall(room):
+    with room.lock:
+        color = room.clock.running
+        if color is None or room.is_game_over():
+            return
+        if room.clock.remaining_at(color, time.monotonic() - lag_allowance(room.seats[color])) > 0:
+            # The deadline moved after this timer was scheduled, or the player's lag allowance grew
+            arm_flag_timer(room)
+            return
+        stop_clock(room)
+        room.forfeit_winner = other_color(color)
+        record_end(room, 'time')
+        room.publish(game_over_event(room, 'time'), kind=STATE)
+        log.info("%s lost on time in room %s", color, room.room_id)
+
+def record_end(room, reason):
+    if journal is not None:
+        journal.ended(room.room_id, reason, room.winner())
+    if archive is not None or room.rated:
+        names = player_names(room)
+    if archive is not None:
+        archive.record(room.room_id, names['white'], names['black'], room.winner(), reason,
+                       room.game.moves, room.time_control)
+    if room.rated and matchmaker is not None:
+        white, black = matchmaker.ratings.record(names['white'], names['black'], room.winner())
+        log.info("Room %s rated: %s %.0f, %s %.0f", room.room_id, names['white'], white, names['black'], black)
+
+def player_names(room):
+    """
+    The names the two seats were last taken under, whether or not the players are
+    still connected.
+    """
+    names = dict(room.reserved)
+    for color, name in room.sessions.values():
+        if color in names:
+            names[color] = name
+    return names
+
+def on_connect(conn):
+    metrics.connections.inc()
+    if heartbeat is not None:
+        heartbeat.add(conn)
+    log.info("Client connected: %s", conn.addr)
+
+def seat_client(conn, room, color, name):
+    """
+    Finish seating conn in room: tell it its color and start or catch it up on the game.
+    """
+    with room.lock:
+        conn.name = name or f"Player_{len(room.members)}"
+        room.sessions[conn.session] = (color, conn.name)
+        # Lets a backed-up send queue catch up with one snapshot instead of every delta
+        conn.outbound.snapshot = lambda: snapshot_message(room, both_connected=room.is_full()).encode(conn.encoding)
+        # Notify client of their color, and the session token it can resume with
+        conn.send(make_message('color', {'color': color, 'room': room.room_id, 'session': conn.session,
+                                         'encoding': conn.encoding}))
+        log.info("Assigned %s as %s in room %s", conn.name, color, room.room_id)
+        if journal is not None and color != 'spectator':
+            journal.joined(room.room_id, color, conn.name)
+        # If both players are connected, broadcast a board message to start the game
+        if not room.started and room.is_full():
+            room.started = True
+            # A game restored from the journal resumes with the side to move
+            room.clock.start(room.game.turn)
+            arm_flag_timer(room)
+            if journal is not None:
+                journal.started(room.room_id, room.clock.remaining)
+            room.next_seq()
+            room.publish(snapshot_message(room, both_connected=True), kind=STATE)
+        elif room.started:
+            conn.send(snapshot_message(room, both_connected=room.is_full()), STATE)
+            if color == 'spectator' and analysis is not None and not room.is_game_over():
+                ply = room.game.ply()
+                analysis.submit(room.game.board, lambda result: send_eval(room, ply, result, conn),
+                                key=room.game.position.key)
+
+def resume_session(conn, content):
+    """
+    Put a reconnecting client back in its seat and send it only what it missed: the
+    buffered events after its last_seq, or a snapshot once those have left the buffer.
+    """
+    room, color, replaced = registry.resume(conn, content.get('room'), content.get('session'))
+    if room is None:
+        conn.send(make_message('error', {'text': 'Session expired.'}))
+        return True
+    if replaced is not None:
+        # The old connection has not noticed it was dropped yet
+        replaced.close()
+    with room.lock:
+        conn.outbound.snapshot = lambda: snapshot_message(room, both_connected=room.is_full()).encode(conn.encoding)
+        conn.send(make_message('color', {'color': color, 'room': room.room_id, 'session': conn.session,
+                                         'encoding': conn.encoding, 'resumed': True}))
+        last_seq = content.get('last_seq')
+        missed = room.events_since(last_seq) if isinstance(last_seq, int) else None
+        if missed is None:
+            conn.send(snapshot_message(room, both_connected=room.is_full()), STATE)
+        else:
+            for frame in missed:
+                conn.send(frame, STATE)
+        log.info("%s resumed as %s in room %s (%s)", conn.name, color, room.room_id,
+                 'snapshot' if missed is None else f"{len(missed)} events")
+    return True
+
+def hold_seat(conn):
+    """
+    Keep a disconnecting player's seat in a running game for seat_grace seconds, so
+    they can resume it. Their clock keeps running meanwhile. A spectator's session is
+    kept as long, then forgotten.
+    """
+    room = conn.room
+    if room is None:
+        return
+    with room.lock:
+        color = conn.color
+        if color == 'spectator':
+            expiry = time.monotonic() + max(seat_grace, 0)
+            room.hold_spectator(conn.session, expiry)
+            scheduler.schedule(expiry, lambda: release_seats(room))
+            return
+        if seat_grace <= 0:
+            return
+        if color in room.seats and room.seats[color] is conn and room.started and not room.is_game_over():
+            expiry = time.monotonic() + seat_grace
+            room.hold_seat(color, expiry)
+            scheduler.schedule(expiry, lambda: release_seats(room))
+            log.info("Holding the %s seat in room %s for %gs", color, room.room_id, seat_grace)
+
+def release_seats(room):
+    released = registry.release_holds(room)
+    for color in released:
+        log.info("Released the %s seat in room %s", color, room.room_id)
+    if released and room.is_abandoned():
+        with room.lock:
+            stop_clock(room)
+        log.info("Nobody came back to room %s. Closing it.", room.room_id)
+
+def analyse_live(room):
+    """
+    Queue the position a move just reached; the evaluation goes to the room's spectators
+    unless the game has moved on by the time it is ready.
+    """
+    if not room.spectators or room.is_game_over():
+        return
+    ply = room.game.ply()
+    analysis.submit(room.game.board, lambda result: send_eval(room, ply, result), key=room.game.position.key)
+
+def analyse_request(conn, room, content):
+    """
+    A spectator asked for the evaluation of one ply of the game, the current one by default.
+    Positions the game has already left wait behind those of live games.
+    """
+    if analysis is None:
+        conn.send(make_message('error', {'text': 'Analysis is not enabled on this server.'}))
+        return
+    if conn.color != 'spectator':
+        conn.send(make_message('error', {'text': 'Analysis is only available to spectators.'}))
+        return
+    game = room.game
+    ply = content.get('ply', game.ply())
+    if not isinstance(ply, int) or not 0 <= ply <= game.ply():
+        conn.send(make_message('error', {'text': f'No such ply: {ply}'}))
+        return
+    live = ply == game.ply() and not room.is_game_over()
+    board = game.board if live else room_replay(room).board_at(ply)
+    analysis.submit(board, lambda result: send_eval(room, ply, result, conn),
+                    priority=LIVE if live else ARCHIVED,
+                    depth=content.get('depth'), time_limit=content.get('time'))
+
+def within_chat_rate(conn):
+    """
+    Take one of conn's chat tokens. A sender that has run out is told to slow down
+    once, not once per refused line, so a flood gets no reply traffic of its own.
+    """
+    if conn.chat_bucket is None:
+        conn.chat_bucket = TokenBucket(chat_rate, chat_burst)
+    if conn.chat_bucket.take():
+        return True
+    metrics.chat_limited.inc()
+    if conn.chat_bucket.refused == 1:
+        conn.send(make_message('error', {'text': 'You are sending messages too fast.'}))
+    return False
+
+def chat_request(conn, room, content):
+    """
+    Pass a chat line to the room's batcher if the sender is within its rate limit.
+    Called with the room lock held.
+    """
+    text = content.get('text')
+    if not isinstance(text, str) or not text or not within_chat_rate(conn):
+        return
+    if room.chat is None:
+        room.chat = ChatBatcher(room, scheduler, chat_window)
+    room.chat.add(conn.name, text)
+    log.debug("%s: %s", conn.name, text)
+
+def room_replay(room):
+    """
+    The room's GameReplay, brought up to the game's current ply. Called with the room lock held.
+    """
+    if room.replay is None:
+        room.replay = GameReplay()
+    room.replay.extend_codes(room.game.moves)
+    return room.replay
+
+def replay_request(conn, room, content):
+    """
+    Stream the room's game, or an archived game, to conn from content's 'ply' at
+    'speed' plies per second. A request for what is already streaming seeks it or
+    changes its speed; 'stop' ends it.
+    """
+    if content.get('stop'):
+        if conn.replay is not None:
+            conn.replay.stop()
+            conn.replay = None
+        return
+    speed = content.get('speed', DEFAULT_REPLAY_SPEED)
+    if not isinstance(speed, (int, float)) or not 0 <= speed <= MAX_REPLAY_SPEED:
+        conn.send(make_message('error', {'text': f'Replay speed must be between 0 and {MAX_REPLAY_SPEED:g}.'}))
+        return
+    game_id = content.get('game')
+    if game_id is not None:
+        if archive is None:
+            conn.send(make_message('error', {'text': 'The game archive is not enabled on this server.'}))
+            return
+        source = ('game', game_id)
+    else:
+        source = ('room', room.room_id)
+    stream = conn.replay
+    if stream is None or stream.source != source:
+        if game_id is not None:
+            archived = archive.game(game_id) if isinstance(game_id, int) else None
+            if archived is None:
+                conn.send(make_message('error', {'text': f'No archived game {game_id}.'}))
+                return
+            replay = GameReplay.from_uci(archived['moves'])
+        else:
+            replay = room_replay(room)
+        if stream is not None:
+            stream.stop()
+        stream = conn.replay = ReplayStream(conn, replay, scheduler, source)
+    elif game_id is None:
+        room_replay(room)
+    ply = content.get('ply', stream.ply)
+    if not isinstance(ply, int):
+        conn.send(make_message('error', {'text': f'No such ply: {ply}'}))
+        return
+    stream.seek(ply, speed)
+
+def send_eval(room, ply, result, conn=None):
+    """
+    Send an evaluation to one spectator, or to all of them if the game is still at ply.
+    Evaluations are queued like chat, so a slow spectator drops them before board state.
+    """
+    with room.lock:
+        if conn is not None:
+            targets = [conn] if conn.room is room else []
+        else:
+            targets = room.spectators if room.game.ply() == ply else ()
+        if not targets:
+            return
+        frame = Frame('eval', dict(result, room=room.room_id, ply=ply))
+        for member in targets:
+            member.send(frame, CHAT)
+
+def parse_time_control(content):
+    """
+    Time control requested in create_room, falling back to the server default.
+    """
+    base, increment, delay = registry.time_control
+    values = []
+    for key, default in (('time_limit', base), ('increment', increment), ('delay', delay)):
+        value = content.get(key, default)
+        if not isinstance(value, (int, float)) or value < 0:
+            value = default
+        values.append(value)
+    if values[0] <= 0:
+        values[0] = base
+    return tuple(values)
+
+def lobby_room_id(msg_type, content):
+    """
+    The room a lobby message is about, or None if any worker can answer it.
+    """
+    if msg_type in ('create_room', 'join_room', 'resume'):
+        room_id = content.get('room')
+        return room_id if isinstance(room_id, str) else None
+    if msg_type == 'list_rooms':
+        return None
+    if msg_type == 'queue':
+        return MATCHMAKING_KEY
+    return DEFAULT_ROOM
+
+def handle_lobby_message(conn, msg_type, content):
+    """
+    Handle a message from a client that is not in a room yet.
+    """
+    name = content.get('name')
+    # Game events go out in the best encoding the client offered; replies here are JSON
+    conn.encoding = choose_encoding(content.get('encodings'))
+    if msg_type == 'list_rooms':
+        conn.send(make_message('rooms', {'rooms': registry.list()}))
+        return True
+    if msg_type == 'resume':
+        return resume_session(conn, content)
+    if relay is not None:
+        return join_relay(conn, msg_type, content, name)
+    if msg_type == 'queue':
+        return queue_request(conn, content, name)
+    if matchmaker is not None:
+        # Joining a room any other way leaves the matchmaking queue
+        matchmaker.remove(conn)
+    if msg_type == 'create_room':
+        room_id = content.get('room')
+        if room_id is not None and (not isinstance(room_id, str) or not 0 < len(room_id) <= MAX_ROOM_ID_LENGTH):
+            conn.send(make_message('error', {'text': f"Room ids are 1 to {MAX_ROOM_ID_LENGTH} characters."}))
+            return True
+        room, color = registry.create(conn, room_id, parse_time_control(content))
+        if room is None:
+            conn.send(make_message('error', {'text': f"Room {content.get('room')} already exists."}))
+            return True
+    elif msg_type == 'join_room':
+        room, color = registry.join(conn, content.get('room'), spectate=bool(content.get('spectate')), name=name)
+        if room is None:
+            conn.send(make_message('error', {'text': f"No such room: {content.get('room')}"}))
+            return True
+    else:
+        # A plain 'join' (or any other first message) seats the client in the default room
+        if msg_type != 'join':
+            name = None
+        room, color = registry.join(conn, DEFAULT_ROOM, create=True, name=name)
+    seat_client(conn, room, color, name)
+    return True
+
+def queue_request(conn, content, name):
+    """
+    Put conn in the matchmaking queue, or take it out with {'cancel': true}.
+    """
+    if content.get('cancel'):
+        matchmaker.remove(conn)
+        conn.send(make_message('queued', {'cancelled': True}))
+        return True
+    if not isinstance(name, str) or not name:
+        conn.send(make_message('error', {'text': 'Rated games need a player name.'}))
+        return True
+    ticket = matchmaker.add(conn, name)
+    if ticket is None:
+        conn.send(make_message('error', {'text': f"{name} is already waiting for a game."}))
+    elif conn.room is None:
+        conn.send(make_message('queued', {'rating': round(ticket.rating), 'waiting': len(matchmaker)}))
+    return True
+
+def start_match(first, second):
+    """
+    The matchmaker's on_match: seat the pair in a new rated room and start the game.
+    The player who waited longer gets white.
+    """
+    room = registry.create_match(first.conn, second.conn, first.name, second.name)
+    log.info("Matched %s (%.0f) and %s (%.0f) in room %s", first.name, first.rating,
+             second.name, second.rating, room.room_id)
+    for ticket, opponent in ((first, second), (second, first)):
+        ticket.conn.send(make_message('match', {'room': room.room_id, 'rating': round(ticket.rating),
+                                                'opponent': opponent.name,
+                                                'opponent_rating': round(opponent.rating)}))
+    seat_client(first.conn, room, 'white', first.name)
+    seat_client(second.conn, room, 'black', second.name)
+
+def join_relay(conn, msg_type, content, name):
+    """
+    A relay hosts only the room it relays, and everyone who joins it is a spectator.
+    """
+    room_id = relay.room.room_id
+    if msg_type in ('create_room', 'queue') or (msg_type == 'join_room' and content.get('room') != room_id):
+        conn.send(make_message('error', {'text': f"This server only relays room {room_id}."}))
+        return True
+    if msg_type not in ('join', 'join_room'):
+        name = None
+    room, color = registry.join(conn, room_id, spectate=True, name=name)
+    if room is None:
+        conn.send(make_message('error', {'text': f"The game relayed in room {room_id} has ended."}))
+        return True
+    seat_client(conn, room, color, name)
+    return True
+
+def close_relayed_room():
+    """
+    Once the relayed game is over and nobody is left watching, drop its room and stop
+    following the upstream.
+    """
+    if not relay.closed and registry.close_if_abandoned(relay.room):
+        relay.close()
+        log.info("The game relayed in room %s has ended and its spectators have left; stopped relaying.",
+                 relay.room.room_id)
+
+def reject_move(conn, text, cseq=None):
+    """
+    Tell a player their move was refused. A client that shows its moves before the
+    server confirms them sends a cseq with each; echoing it says which one to undo.
+    """
+    metrics.rejected.inc()
+    content = {'text': text}
+    if cseq is not None:
+        content['cseq'] = cseq
+    conn.send(make_message('error', content))
+
+def apply_move(game, move_uci):
+    started = time.perf_counter()
+    accepted = game.push_move(move_uci)
+    metrics.validation.observe(time.perf_counter() - started)
+    if accepted:
+        metrics.moves.inc()
+    return accepted
+
+def handle_message(conn, msg_obj):
+    """
+    Apply one message from a client.
+    Returns False if the connection should be closed.
+    """
+    msg_type = msg_obj.get('type')
+    content = msg_obj.get('content') or {}
+    conn.last_seen = time.monotonic()
+    if not isinstance(msg_type, str) or not isinstance(content, dict):
+        conn.send(make_message('error', {'text': 'A message needs a string type and an object as its content.'}))
+        return True
+    if msg_type == 'pong':
+        if heartbeat is not None:
+            heartbeat.pong(conn, content)
+        return True
+    room = conn.room
+    if room is None:
+        if shard is not None:
+            owner = shard.owner(lobby_room_id(msg_type, content))
+            if owner != shard.index:
+                # Returning False makes the connection hand itself to the owning worker
+                conn.handoff = lambda sock, data: shard.send_connection(owner, sock, data)
+                return False
+        return handle_lobby_message(conn, msg_type, content)
+    with room.lock:
+        if room.upstream is not None and msg_type not in RELAY_MESSAGES:
+            conn.send(make_message('error', {'text': f"Room {room.room_id} is relayed; it can only be watched here."}))
+            return True
+        game = room.game
+        color = conn.color
+        if msg_type == 'chat':
+            chat_request(conn, room, content)
+        elif msg_type == 'resync':
+            conn.send(snapshot_message(room, both_connected=room.is_full()), STATE)
+        elif msg_type == 'analyse':
+            analyse_request(conn, room, content)
+        elif msg_type == 'replay':
+            replay_request(conn, room, content)
+        elif msg_type == 'move':
+            move_uci = content.get('move')
+            cseq = content.get('cseq')
+            sender = conn.name
+            if room.is_game_over():
+                reject_move(conn, 'The game is over.', cseq)
+            # Only allow move if it's this player's turn and color
+            elif (color == 'white' and game.turn == 'white') or (color == 'black' and game.turn == 'black'):
+                now = time.monotonic()
+                lag = lag_allowance(conn)
+                if room.clock.running == color and room.clock.remaining_at(color, now - lag) <= 0:
+                    # Time ran out before the scheduler got to it; the other player wins
+                    stop_clock(room)
+                    room.forfeit_winner = other_color(color)
+                    record_end(room, 'time')
+                    room.publish(game_over_event(room, 'time'), kind=STATE)
+                elif move_uci and apply_move(game, move_uci):
+                    if room.clock.running == color:
+                        room.clock.press(color, now, lag)
+                    if journal is not None:
+                        journal.move(room.room_id, game.ply(), game.moves[-1], room.clock.remaining)
+                    if room.is_game_over():
+                        stop_clock(room)
+                        record_end(room, 'board')
                     else:
-                        error_msg = make_message('error', {'text': 'Not your turn or wrong color.'})
-                        client_socket.sendall(error_msg)
+                        arm_flag_timer(room)
+                    room.publish(move_event(room, move_uci, now), kind=STATE)
+                    if analysis is not None:
+                        analyse_live(room)
+                    log.debug("Move %s accepted from %s", move_uci, sender)
                 else:
-                    broadcast(data, sender=client_socket)
-            except Exception as e:
-                print(f"Error parsing message from {addr}: {e}")
+                    reject_move(conn, f'Illegal move: {move_uci}', cseq)
+            else:
+                reject_move(conn, 'Not your turn or wrong color.', cseq)
+        elif msg_type != 'invalid' and within_chat_rate(conn):
+            # Anything else is passed on to the room as it is, under the chat rate limit
+            room.broadcast(make_message(msg_type, content), sender=conn, kind=CHAT)
+        return True
+
+def on_disconnect(conn):
+    if heartbeat is not None:
+        heartbeat.discard(conn)
+    if conn.replay is not None:
+        conn.replay.stop()
+    if conn.handoff is not None:
+        return
+    metrics.disconnections.inc()
+    log.info("Client disconnected: %s", conn.addr)
+    if matchmaker is not None:
+        matchmaker.remove(conn)
+    hold_seat(conn)
+    room = registry.leave(conn)
+    if relay is not None and room is relay.room:
+        close_relayed_room()
+    if room is not None and room.is_abandoned():
+        with room.lock:
+            stop_clock(room)
+        log.info("All clients left room %s. Closing it.", room.room_id)
+
+def handle_client(client_socket, addr, initial=b''):
+    """
+    Serve one client; initial holds bytes another worker already read from the socket.
+    """
+    # Moves are small writes; without this, Nagle's algorithm holds one back until the
+    # client's delayed ACK for the previous one
+    client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    conn = SocketConnection(client_socket, addr)
+    on_connect(conn)
+    decoder = MessageDecoder()
+    decoder.observe = metrics.frame_in
+    try:
+        messages = decoder.feed(initial) if initial else []
+        connected = True
+        while connected:
+            for i, msg_obj in enumerate(messages):
+                try:
+                    if not handle_message(conn, msg_obj):
+                        if conn.handoff is not None:
+                            conn.hand_off(messages[i:], decoder)
+                        connected = False
+                        break
+                except Exception as e:
+                    log.exception("Error handling message from %s: %s", addr, e)
+            if connected:
+                messages = decoder.recv_from(client_socket)
+                connected = messages is not None
     except Exception as e:
-        print(f"Error with {addr}: {e}")
+        log.warning("Error with %s: %s", addr, e)
     finally:
-        print(f"Client disconnected: {addr}")
-        clients.remove(client_socket)
-        for i, (sock, _, _, _) in enumerate(players):
-            if sock == client_socket:
-                players.pop(i)
-                break
-        client_socket.close()
-        # If all clients have disconnected, reset everything for a new game
-        if len(clients) == 0:
-            print("All clients disconnected. Resetting server for a new game...")
-            # Reset game state
-            game = ChessGame()
-            player_times['white'] = TIME_LIMIT_SECONDS
-            player_times['black'] = TIME_LIMIT_SECONDS
-            last_move_time = None
-            current_timer_color = None
-            players.clear()
-
-def main():
-    global game, player_times, last_move_time, current_timer_color, players
-    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        on_disconnect(conn)
+        conn.close()
+
+def listen_socket(host, port, reuse_port=False):
+    # Accepted sockets inherit the protocol number, and asyncio only sets TCP_NODELAY on
+    # sockets that name IPPROTO_TCP
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP)
     server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    server.bind((HOST, PORT))
-    server.listen(10)
-    print(f"Server listening on {HOST}:{PORT}")
+    if reuse_port:
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    server.bind((host, port))
+    server.listen(LISTEN_BACKLOG)
+    return server
+
+def adopt_connections():
+    """
+    Serve connections that other workers hand to this one (threaded mode).
+    """
+    while True:
+        try:
+            client_socket, initial = shard.receive_connection()
+            client_socket.setblocking(True)
+            addr = client_socket.getpeername()
+        except OSError as e:
+            log.warning("Error receiving a handed-off connection: %s", e)
+            continue
+        threading.Thread(target=handle_client, args=(client_socket, addr, initial), daemon=True).start()
+
+def serve_threaded(host, port, server=None):
+    if server is None:
+        server = listen_socket(host, port)
+    if shard is not None:
+        threading.Thread(target=adopt_connections, daemon=True).start()
+    log.info("Server listening on %s:%s (threaded)", host, port)
     try:
         while True:
             client_socket, addr = server.accept()
             threading.Thread(target=handle_client, args=(client_socket, addr), daemon=True).start()
     except KeyboardInterrupt:
-        print("Shutting down server.")
+        log.info("Shutting down server.")
     finally:
         server.close()
 
+def report_stats(interval):
+    while True:
+        time.sleep(interval)
+        cache = position_cache.stats()
+        prefix = ""
+        if shard is not None:
+            prefix = f"[worker {shard.index}] handed off {shard.handed_off}, adopted {shard.adopted} "
+        log.info("%sRooms: %d Outbound: %s Positions: %d hit_rate=%.2f", prefix, len(registry),
+                 outbound.stats.summary(), cache['positions'], cache['hit_rate'])
+        if journal is not None:
+            log.info("%sJournal: %s", prefix, journal.stats())
+        if analysis is not None:
+            log.info("%sAnalysis: %s", prefix, analysis.stats())
+        if relay is not None:
+            log.info("Relay: %s", relay.stats())
+
+def register_gauges():
+    """
+    Export the counters other modules already keep, read when metrics are scraped.
+    """
+    stats = outbound.stats
+    metrics.gauge('chess_rooms', "Rooms hosted by this process", lambda: len(registry))
+    metrics.gauge('chess_send_queue_frames', "Frames waiting in all send queues", lambda: stats.queued)
+    metrics.gauge('chess_send_queue_max_depth', "Deepest any one send queue has been", lambda: stats.max_depth)
+    metrics.gauge('chess_frames_dropped_total', "Frames dropped by the overflow policy", lambda: stats.frames_dropped, 'counter')
+    metrics.gauge('chess_queue_snapshots_total', "Backed-up queues replaced by a snapshot", lambda: stats.snapshots, 'counter')
+    metrics.gauge('chess_slow_disconnects_total', "Clients dropped for a full send queue", lambda: stats.disconnects, 'counter')
+    metrics.gauge('chess_position_cache_hit_rate', "Hit rate of the shared legal-move cache",
+                  lambda: position_cache.stats()['hit_rate'])
+    if shard is not None:
+        metrics.gauge('chess_handed_off_total', "Connections passed to another worker", lambda: shard.handed_off, 'counter')
+        metrics.gauge('chess_adopted_total', "Connections taken over from another worker", lambda: shard.adopted, 'counter')
+    if journal is not None:
+        metrics.gauge('chess_journal_fsyncs_total', "Journal fsyncs", lambda: journal.fsyncs, 'counter')
+        metrics.gauge('chess_journal_records_total', "Journal records written", lambda: journal.records, 'counter')
+    if archive is not None:
+        metrics.gauge('chess_archived_games_total', "Finished games written to the archive", lambda: archive.archived, 'counter')
+    if relay is not None:
+        metrics.gauge('chess_relay_frames_total', "Events received from the relay's upstream", lambda: relay.received, 'counter')
+        metrics.gauge('chess_relay_connects_total', "Connections made to the relay's upstream", lambda: relay.connects, 'counter')
+    if matchmaker is not None:
+        metrics.gauge('chess_matchmaking_queued', "Players waiting for a match", lambda: len(matchmaker))
+    if analysis is not None:
+        metrics.gauge('chess_analysis_searches_total', "Positions searched by the engine pool", lambda: analysis.searched, 'counter')
+        metrics.gauge('chess_analysis_queued', "Analysis requests waiting for an engine", lambda: analysis.stats()['queued'])
+
+def open_journal(directory, fsync_interval, segment_bytes):
+    """
+    Start journaling to directory and restore the unfinished games it holds.
+    Restored games wait, clocks stopped, for their players to join again under the
+    same names.
+    """
+    global journal
+    from server.journal import Journal
+    journal = Journal(directory, fsync_interval, segment_bytes)
+    recovered = journal.recover()
+    for state in recovered:
+        room = registry.restore(state.room_id, state.time_control, state.game)
+        room.clock.remaining = dict(state.remaining)
+        room.reserved = dict(state.seats)
+    journal.start()
+    registry.journal = journal
+    if recovered:
+        log.info("Restored %d games from %s", len(recovered), directory)
+
+def main(argv=None):
+    global seat_grace, max_lag, chat_window, chat_rate, chat_burst, log_listener
+    parser = argparse.ArgumentParser(description="Multiplayer chess server")
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--mode', choices=['asyncio', 'threaded'], default='asyncio',
+                        help="asyncio serves every connection from one event loop; threaded starts one thread per connection")
+    parser.add_argument('--queue-limit', type=int, default=outbound.DEFAULT_QUEUE_LIMIT,
+                        help="maximum frames queued for one client before the overflow policy applies")
+    parser.add_argument('--overflow', choices=outbound.POLICIES, default=outbound.DEFAULT_POLICY,
+                        help="what to do when a client's send queue is full")
+    parser.add_argument('--stats-interval', type=float, default=0,
+                        help="print send queue and position cache counters every N seconds (0 disables)")
+    parser.add_argument('--time-limit', type=float, default=TIME_LIMIT_SECONDS,
+                        help="default seconds on each player's clock")
+    parser.add_argument('--increment', type=float, default=0,
+                        help="default seconds added after each move")
+    parser.add_argument('--delay', type=float, default=0,
+                        help="default seconds per move before the clock starts running")
+    parser.add_argument('--position-cache', type=int, default=position_cache.max_positions,
+                        help="positions kept in the shared legal-move cache, about 5.5 KB each")
+    parser.add_argument('--seat-grace', type=float, default=SEAT_GRACE_SECONDS,
+                        help="seconds a disconnected player's seat is held for them to resume (0 disables)")
+    parser.add_argument('--archive', metavar='FILE',
+                        help="write finished games to this SQLite archive (workers may share one file)")
+    parser.add_argument('--archive-index-plies', type=int, default=None,
+                        help="index the positions of only each archived game's first N plies")
+    parser.add_argument('--engine', metavar='COMMAND',
+                        help="UCI engine command line; evaluations of live games are sent to spectators")
+    parser.add_argument('--engine-pool', type=int, default=1,
+                        help="engine processes per worker")
+    parser.add_argument('--analysis-depth', type=int, default=12,
+                        help="deepest search a position gets")
+    parser.add_argument('--analysis-time', type=float, default=0.5,
+                        help="longest search a position gets, in seconds")
+    parser.add_argument('--ping-interval', type=float, default=DEFAULT_INTERVAL,
+                        help="seconds between heartbeat pings (0 disables pings and reaping)")
+    parser.add_argument('--idle-timeout', type=float, default=DEFAULT_TIMEOUT,
+                        help="close a connection that answers pings but has been silent this long")
+    parser.add_argument('--max-lag-ms', type=float, default=DEFAULT_MAX_LAG * 1000,
+                        help="largest share of a move's time credited back to the network")
+    parser.add_argument('--chat-window-ms', type=float, default=chat.DEFAULT_WINDOW * 1000,
+                        help="chat lines arriving within this window go out to the room as one frame")
+    parser.add_argument('--chat-rate', type=float, default=chat.DEFAULT_RATE,
+                        help="chat lines per second each sender may keep up")
+    parser.add_argument('--chat-burst', type=int, default=chat.DEFAULT_BURST,
+                        help="chat lines each sender may send at once")
+    parser.add_argument('--match-window', type=float, default=matchmaking.DEFAULT_WINDOW,
+                        help="rating gap a player in the matchmaking queue accepts at first")
+    parser.add_argument('--match-widen', type=float, default=matchmaking.DEFAULT_WIDEN,
+                        help="rating points the accepted gap widens by per second of waiting")
+    parser.add_argument('--match-max-window', type=float, default=matchmaking.DEFAULT_MAX_WINDOW,
+                        help="widest rating gap the matchmaker ever accepts")
+    parser.add_argument('--metrics-port', type=int, default=0,
+                        help="serve Prometheus metrics and profiler controls on this port (worker N uses port + N)")
+    parser.add_argument('--metrics-host', default='127.0.0.1')
+    parser.add_argument('--log-level', choices=('debug', 'info', 'warning', 'error'), default='info',
+                        help="debug also logs every move and chat line")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="worker processes, each hosting its share of the rooms (0 for one per core)")
+    parser.add_argument('--journal', metavar='DIR',
+                        help="journal games to DIR and restore unfinished ones on startup")
+    parser.add_argument('--journal-fsync-ms', type=float, default=50,
+                        help="longest a journaled record waits for fsync")
+    parser.add_argument('--journal-segment-mb', type=float, default=16,
+                        help="journal segment size before it is sealed and compacted")
+    parser.add_argument('--relay-upstream', metavar='HOST:PORT',
+                        help="relay one game from this server (the origin or another relay) to spectators here")
+    parser.add_argument('--relay-room', default=DEFAULT_ROOM,
+                        help="id of the room to relay")
+    parser.add_argument('--relay-name', default='relay',
+                        help="name the relay watches the upstream game under")
+    args = parser.parse_args(argv)
+    log_listener = configure_logging(args.log_level)
+    position_cache.max_positions = args.position_cache
+    outbound.configure(args.queue_limit, args.overflow)
+    registry.time_control = (args.time_limit, args.increment, args.delay)
+    seat_grace = args.seat_grace
+    max_lag = args.max_lag_ms / 1000
+    chat_window = args.chat_window_ms / 1000
+    chat_rate = args.chat_rate
+    chat_burst = args.chat_burst
+    workers = args.workers or os.cpu_count() or 1
+    if args.relay_upstream and workers != 1:
+        parser.error("a relay runs as one process; chain more relays to serve more spectators")
+    if workers == 1:
+        serve(args)
+    else:
+        from server.shards import run_supervisor
+        listener = None if REUSE_PORT else listen_socket(args.host, args.port)
+        log.info("Server listening on %s:%s with %d workers (%s)", args.host, args.port, workers, args.mode)
+        try:
+            run_supervisor(workers, lambda worker_shard: run_worker(args, worker_shard, listener))
+        finally:
+            log_listener.stop()
+
+def run_worker(args, worker_shard, listener=None):
+    """
+    Entry point of a forked worker: host the rooms that hash to this shard.
+    """
+    global shard, log_listener
+    shard = worker_shard
+    # The parent's log writer thread did not survive the fork
+    log_listener = configure_logging(args.log_level)
+    registry.owns = shard.owns
+    if listener is None:
+        listener = listen_socket(args.host, args.port, reuse_port=True)
+    log.info("Worker %d started (pid %d)", shard.index, os.getpid())
+    serve(args, listener)
+
+def serve(args, listener=None):
+    global analysis, heartbeat, matchmaker, archive, relay
+    if args.journal:
+        directory = args.journal
+        if shard is not None:
+            # Rooms always hash to the same worker, so each keeps its own journal
+            directory = os.path.join(directory, f"worker-{shard.index}")
+        open_journal(directory, args.journal_fsync_ms / 1000, int(args.journal_segment_mb * 1024 * 1024))
+    if args.archive:
+        from server.archive import Archive
+        archive = Archive(args.archive, args.archive_index_plies)
+        archive.start()
+    if journal is not None or archive is not None:
+        # Unwind on SIGTERM too, so the last queued records and games are written
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    if args.engine:
+        analysis = AnalysisPool(shlex.split(args.engine), args.engine_pool, args.analysis_depth, args.analysis_time)
+    heartbeat = Heartbeat(scheduler, args.ping_interval, args.idle_timeout)
+    heartbeat.start()
+    matchmaker = Matchmaker(scheduler, start_match, window=args.match_window, widen=args.match_widen,
+                            max_window=args.match_max_window)
+    matchmaker.start()
+    if args.relay_upstream:
+        from server.relay import RelayLink
+        relay = RelayLink(args.relay_upstream, registry.relayed(args.relay_room, args.relay_upstream), args.relay_name,
+                          on_end=close_relayed_room)
+    register_gauges()
+    if args.metrics_port:
+        port = args.metrics_port + (shard.index if shard is not None else 0)
+        serve_metrics(args.metrics_host, port)
+        log.info("Metrics on http://%s:%d/metrics", args.metrics_host, port)
+    if args.stats_interval > 0:
+        threading.Thread(target=report_stats, args=(args.stats_interval,), daemon=True).start()
+    try:
+        if args.mode == 'threaded':
+            scheduler.start()
+            if analysis is not None:
+                analysis.start()
+            if relay is not None:
+                relay.start()
+            serve_threaded(args.host, args.port, listener)
+        else:
+            from server.async_server import serve_asyncio, watch_inbox
+
+            def on_start(loop):
+                # Flag-fall callbacks must run on the event loop, like every other handler
+                scheduler.start(loop.call_soon_threadsafe)
+                if analysis is not None:
+                    analysis.start(loop.call_soon_threadsafe)
+                if relay is not None:
+                    relay.start(loop.call_soon_threadsafe)
+                if shard is not None:
+                    watch_inbox(loop, shard, on_connect, handle_message, on_disconnect)
+            serve_asyncio(args.host, args.port, on_connect, handle_message, on_disconnect,
+                          on_start=on_start, sock=listener)
+    finally:
+        if relay is not None:
+            relay.close()
+        if analysis is not None:
+            analysis.close()
+        if journal is not None:
+            journal.close()
+        if archive is not None:
+            archive.close()
+        log_listener.stop()
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,127 @@
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+import zlib
+from common.protocol import make_message
+
+# Largest handoff datagram: the frames a worker already read from a client travel with its fd
+MAX_HANDOFF_BYTES = 256 * 1024
+# A worker that dies sooner than this after starting is restarted only after a pause
+MIN_WORKER_LIFETIME = 1.0
+
+log = logging.getLogger('server.shards')
+
+def shard_of(room_id, count):
+    """
+    The worker that owns room_id. crc32 rather than hash() so every process, and every
+    restart, agrees on it.
+    """
+    return zlib.crc32(room_id.encode()) % count
+
+def handoff_payload(messages, decoder):
+    """
+    Everything read from a connection that this worker has not handled: the decoded
+    messages re-encoded as frames, then any partial frame left in the decoder.
+    """
+    frames = [make_message(msg_obj.get('type'), msg_obj.get('content')) for msg_obj in messages]
+    frames.append(decoder.unconsumed())
+    return b''.join(frames)
+
+class Shard:
+    """
+    One worker's place among its siblings. Every game lives on exactly one worker, so
+    a connection whose first lobby message names another worker's room is passed to
+    that worker's inbox: the socket fd plus the bytes already read, over AF_UNIX.
+    """
+    def __init__(self, index, count, inboxes):
+        self.index = index
+        self.count = count
+        self.outboxes = [send_end for send_end, _ in inboxes]
+        self.inbox = inboxes[index][1]
+        self.handed_off = 0
+        self.adopted = 0
+
+    def owner(self, room_id):
+        if room_id is None:
+            return self.index
+        return shard_of(room_id, self.count)
+
+    def owns(self, room_id):
+        return self.owner(room_id) == self.index
+
+    def send_connection(self, target, sock, data):
+        if len(data) > MAX_HANDOFF_BYTES:
+            raise ValueError(f"{len(data)} bytes read before the join is too many to hand off")
+        socket.send_fds(self.outboxes[target], [data], [sock.fileno()])
+        self.handed_off += 1
+
+    def receive_connection(self):
+        """
+        Take the next connection handed to this worker. Returns (socket, bytes already read).
+        """
+        data, fds, _, _ = socket.recv_fds(self.inbox, MAX_HANDOFF_BYTES, 1)
+        self.adopted += 1
+        return socket.socket(fileno=fds[0]), data
+
+def run_supervisor(workers, start_worker):
+    """
+    Fork one worker per shard and restart any that die. start_worker(shard) runs in the
+    child and serves until the process is stopped. Rooms on a worker that dies are lost.
+    """
+    inboxes = []
+    for _ in range(workers):
+        send_end, recv_end = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        send_end.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, MAX_HANDOFF_BYTES * 2)
+        recv_end.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, MAX_HANDOFF_BYTES * 2)
+        inboxes.append((send_end, recv_end))
+    children = {}
+
+    def spawn(index):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            code = 0
+            try:
+                start_worker(Shard(index, workers, inboxes))
+            except (KeyboardInterrupt, SystemExit):
+                pass
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                sys.stdout.flush()
+                os._exit(code)
+        children[pid] = (index, time.monotonic())
+
+    # Stopping the supervisor stops its workers
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    for index in range(workers):
+        spawn(index)
+    log.info("Supervisor %d started %d workers", os.getpid(), workers)
+    try:
+        while children:
+            pid, status = os.wait()
+            if pid not in children:
+                continue
+            index, started = children.pop(pid)
+            log.warning("Worker %d (pid %d) exited with status %d; restarting", index, pid, status)
+            if time.monotonic() - started < MIN_WORKER_LIFETIME:
+                time.sleep(MIN_WORKER_LIFETIME)
+            spawn(index)
+    except (KeyboardInterrupt, SystemExit):
+        log.info("Shutting down workers.")
+    finally:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in children:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
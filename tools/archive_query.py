@@ -0,0 +1,72 @@
+# Search the game archive written by `server_main --archive FILE`, or export it as PGN.
+# Run from the project root:
+#   python -m tools.archive_query games.db --player Alice
+#   python -m tools.archive_query games.db --fen "rnbqkbnr/pppp1ppp/8/4p3/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2"
+#   python -m tools.archive_query games.db --pgn > all.pgn
+import argparse
+import datetime
+import sys
+import time
+import chess
+from server.archive import Archive
+
+def print_games(games):
+    for game in games:
+        ended = datetime.datetime.fromtimestamp(game['ended']).strftime('%Y-%m-%d %H:%M')
+        reached = f"  (ply {game['ply']})" if 'ply' in game else ''
+        print(f"{game['id']:>8}  {ended}  {game['white'] or '?'} - {game['black'] or '?'}  "
+              f"{game['result']}  {game['plies']} plies{reached}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the game archive")
+    parser.add_argument('archive', help="SQLite archive file")
+    parser.add_argument('--player', help="a player's most recent games")
+    parser.add_argument('--fen', help="games that reached this position")
+    parser.add_argument('--moves', help="games that reached the position after these UCI moves, space separated")
+    parser.add_argument('--result', choices=('1-0', '0-1', '1/2-1/2'))
+    parser.add_argument('--since', help="games that ended on or after this date (YYYY-MM-DD)")
+    parser.add_argument('--until', help="with --since, games that ended before this date")
+    parser.add_argument('--game', type=int, help="print one game's moves")
+    parser.add_argument('--limit', type=int, default=100)
+    parser.add_argument('--pgn', action='store_true',
+                        help="write PGN to stdout: the games matched by --player/--game, or the whole archive")
+    args = parser.parse_args()
+    archive = Archive(args.archive)
+
+    if args.pgn:
+        game_ids = [args.game] if args.game is not None else None
+        for text in archive.export_pgn(game_ids, args.player):
+            sys.stdout.write(text + "\n")
+        return
+    started = time.perf_counter()
+    if args.game is not None:
+        game = archive.game(args.game)
+        if game is None:
+            sys.exit(f"No game {args.game}")
+        print_games([game])
+        print(" ".join(game['moves']))
+        return
+    if args.player:
+        games = archive.by_player(args.player, args.limit)
+    elif args.fen or args.moves:
+        position = args.fen
+        if args.moves:
+            board = chess.Board()
+            for move in args.moves.split():
+                board.push_uci(move)
+            position = board
+        games = archive.with_position(position, args.limit)
+    elif args.result:
+        games = archive.by_result(args.result, args.limit)
+    elif args.since:
+        until = datetime.datetime.fromisoformat(args.until) if args.until else None
+        games = archive.by_date(datetime.datetime.fromisoformat(args.since), until, args.limit)
+    else:
+        print(f"{archive.count()} games")
+        return
+    elapsed = time.perf_counter() - started
+    print_games(games)
+    print(f"{len(games)} games in {elapsed * 1000:.1f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+# Fills a scratch game archive with random games and times the indexed queries.
+# Run from the project root: python -m tools.bench_archive [--games 20000] [--players 1000]
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+import chess
+from common.chess_game import pack_move
+from server.archive import Archive
+
+# Games start from one of these so that opening positions are shared by many games,
+# as they are in real archives
+OPENINGS = (
+    'e2e4 e7e5 g1f3 b8c6 f1b5', 'e2e4 c7c5 g1f3 d7d6 d2d4', 'd2d4 d7d5 c2c4 e7e6 b1c3',
+    'd2d4 g8f6 c2c4 g7g6 b1c3', 'e2e4 e7e6 d2d4 d7d5 b1c3', 'c2c4 e7e5 b1c3 g8f6 g2g3',
+)
+
+def random_game(rng, plies):
+    board = chess.Board()
+    codes = []
+    for uci in rng.choice(OPENINGS).split():
+        move = chess.Move.from_uci(uci)
+        board.push(move)
+        codes.append(pack_move(move))
+    while len(codes) < plies and not board.is_game_over():
+        move = rng.choice(list(board.legal_moves))
+        board.push(move)
+        codes.append(pack_move(move))
+    return codes
+
+def timed(func, repeat=20):
+    """
+    Median milliseconds per call, and the last call's result.
+    """
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples), result
+
+def main():
+    parser = argparse.ArgumentParser(description="Game archive insert and query speed")
+    parser.add_argument('--games', type=int, default=20000)
+    parser.add_argument('--players', type=int, default=1000)
+    parser.add_argument('--plies', type=int, default=60)
+    parser.add_argument('--archive', help="archive file to fill (a temporary file by default)")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    path = args.archive or os.path.join(tempfile.mkdtemp(), 'bench.db')
+    archive = Archive(path)
+    archive.start()
+    # Games are generated ahead of time so only the archive's work is timed
+    names = [f"player{index}" for index in range(args.players)]
+    day = 24 * 3600
+    now = time.time()
+    games = [random_game(rng, args.plies) for _ in range(min(args.games, 2000))]
+    started = time.perf_counter()
+    for index in range(args.games):
+        white, black = rng.sample(names, 2)
+        archive.record(f"room{index}", white, black, rng.choice(('white', 'black', None)), 'board',
+                       games[index % len(games)], (1800, 0, 0), now - (args.games - index) * day / 1000)
+    archive.close()
+    elapsed = time.perf_counter() - started
+    print(f"archived {args.games} games in {elapsed:.1f}s ({args.games / elapsed:.0f} games/s), "
+          f"{os.path.getsize(path) / args.games:.0f} bytes/game with indexes")
+
+    common = chess.Board()
+    for uci in OPENINGS[0].split()[:2]:
+        common.push_uci(uci)
+    rare = chess.Board()
+    for code in games[0][:30]:
+        rare.push(chess.Move(code & 0x3F, (code >> 6) & 0x3F, (code >> 12) or None))
+    queries = [
+        ("a player's last 100 games", lambda: archive.by_player(names[0])),
+        ("last 100 games reaching 1.e4 e5", lambda: archive.with_position(common)),
+        ("games reaching a ply-30 position", lambda: archive.with_position(rare)),
+        ("last 100 draws", lambda: archive.by_result('1/2-1/2')),
+        ("first 100 games of one day", lambda: archive.by_date(now - 10 * day, now - 9 * day)),
+    ]
+    for label, query in queries:
+        ms, result = timed(query)
+        print(f"{label:<36} {ms:8.2f} ms  ({len(result)} games)")
+    started = time.perf_counter()
+    exported = sum(1 for _ in zip(range(1000), archive.export_pgn()))
+    elapsed = time.perf_counter() - started
+    print(f"PGN export: {exported / elapsed:.0f} games/s")
+    if args.archive is None:
+        os.remove(path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+# Move latency in a watched game while spectators flood the chat.
+# Starts a local server for each scenario, plays one bot game with --spectators watching,
+# and has --flooders of those spectators send --flood-rate chat lines per second each.
+# Latency is from a player sending a move to each spectator receiving it. Scenarios:
+#   quiet      no chat at all
+#   unlimited  the flood with batching and rate limits turned off (one frame per line)
+#   limited    the flood with the server's default chat window and token buckets
+# Run from the project root: python -m tools.bench_chat_flood [--spectators 100] [--flooders 20] [--flood-rate 200]
+import argparse
+import asyncio
+import random
+import sys
+import time
+from tools.bot_client import BotClient
+from tools.load_test import percentile, raise_fd_limit
+from tools.relay_demo import free_port, start_server
+
+ROOM = 'flood'
+UNLIMITED = ['--chat-window-ms', '0', '--chat-rate', '1e9', '--chat-burst', str(10 ** 9)]
+
+class FloodStats:
+    def __init__(self):
+        self.latencies = []
+        self.chat_frames = 0
+        self.chat_lines = 0
+        self.limited = 0
+
+async def play(args, port, flooding):
+    stats = FloodStats()
+    sent_at = {}
+    rng = random.Random(args.seed)
+
+    def on_event(bot, msg_obj, received_at):
+        msg_type = msg_obj['type']
+        if msg_type == 'sent':
+            sent_at[msg_obj['content']['ply']] = received_at
+        elif msg_type == 'move' and bot.color == 'spectator':
+            started = sent_at.get(msg_obj['content'].get('ply'))
+            if started is not None:
+                stats.latencies.append(received_at - started)
+        elif msg_type in ('chat', 'chat_batch') and bot.color == 'spectator':
+            stats.chat_frames += 1
+            stats.chat_lines += len(msg_obj['content'].get('lines', ())) or 1
+        elif msg_type == 'error' and 'too fast' in msg_obj['content'].get('text', ''):
+            stats.limited += 1
+
+    def new_bot(name, think=0.0):
+        return BotClient(name, random.Random(rng.random()), think, on_event)
+
+    white, black = new_bot('white', args.think), new_bot('black', args.think)
+    spectators = [new_bot(f"spectator{i}") for i in range(args.spectators)]
+    await white.connect('127.0.0.1', port)
+    await white.create_room(ROOM)
+    for bot in spectators:
+        await bot.connect('127.0.0.1', port)
+        await bot.join_room(ROOM, spectate=True)
+    await black.connect('127.0.0.1', port)
+    await black.join_room(ROOM)
+    done = asyncio.Event()
+
+    async def flood(bot, index):
+        line = 0
+        while not done.is_set():
+            line += 1
+            bot.send('chat', {'text': f"spam {index}.{line} " + 'x' * args.line_length})
+            await bot.writer.drain()
+            await asyncio.sleep(1 / args.flood_rate)
+
+    flooders = [asyncio.create_task(flood(bot, i)) for i, bot in enumerate(spectators[:args.flooders])] if flooding else []
+    watching = [asyncio.create_task(bot.run(args.plies)) for bot in spectators]
+    await asyncio.wait_for(asyncio.gather(white.run(args.plies), black.run(args.plies)), args.timeout)
+    await asyncio.wait(watching, timeout=5)
+    done.set()
+    await asyncio.gather(*flooders, return_exceptions=True)
+    for bot in spectators + [white, black]:
+        await bot.close()
+    return stats
+
+def run(args, flooding, server_args=()):
+    port = free_port()
+    proc = start_server(port, args.mode, *server_args)
+    try:
+        started = time.perf_counter()
+        stats = asyncio.run(play(args, port, flooding))
+        elapsed = time.perf_counter() - started
+    finally:
+        proc.terminate()
+        proc.wait()
+    return stats, elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="Move latency during a chat flood")
+    parser.add_argument('--spectators', type=int, default=100)
+    parser.add_argument('--flooders', type=int, default=20, help="spectators that flood the chat")
+    parser.add_argument('--flood-rate', type=float, default=200.0, help="chat lines per second per flooder")
+    parser.add_argument('--line-length', type=int, default=60)
+    parser.add_argument('--plies', type=int, default=80)
+    parser.add_argument('--think', type=float, default=0.05, help="seconds each player waits before moving")
+    parser.add_argument('--mode', choices=('asyncio', 'threaded'), default='asyncio')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--timeout', type=float, default=300.0)
+    args = parser.parse_args()
+    raise_fd_limit(args.spectators + 256)
+
+    print(f"{args.spectators} spectators, {args.flooders} flooding at {args.flood_rate:g} lines/sec each "
+          f"({args.mode} server)")
+    print(f"{'scenario':>10} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'chat frames':>12} {'chat lines':>11} "
+          f"{'warned':>8} {'seconds':>8}")
+    for label, flooding, server_args in (('quiet', False, ()), ('unlimited', True, UNLIMITED), ('limited', True, ())):
+        stats, elapsed = run(args, flooding, server_args)
+        latencies = sorted(stats.latencies)
+        if not latencies:
+            sys.exit(f"No moves reached the spectators in the {label} run")
+        p50, p99 = percentile(latencies, 0.50), percentile(latencies, 0.99)
+        print(f"{label:>10} {p50 * 1000:>8.1f} {p99 * 1000:>8.1f} {latencies[-1] * 1000:>8.1f} "
+              f"{stats.chat_frames:>12} {stats.chat_lines:>11} {stats.limited:>8} {elapsed:>8.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+# Measures bytes held per active game at a given number of plies, and per position in
+# the shared legal-move cache at its default size, for sizing hosts.
+# Run from the project root: python -m tools.bench_game_memory [--games 500]
+import argparse
+import random
+import tracemalloc
+import chess
+from common.chess_game import ChessGame
+from common.position_cache import PositionCache, DEFAULT_MAX_POSITIONS
+
+class LegacyGame:
+    """
+    The previous representation: a full chess.Board move stack plus a list of UCI strings.
+    """
+    def __init__(self):
+        self.board = chess.Board()
+        self.turn = 'white'
+        self.winner = None
+        self.move_history = []
+
+    def push_move(self, move_uci):
+        self.board.push(chess.Move.from_uci(move_uci))
+        self.move_history.append(move_uci)
+        self.turn = 'black' if self.turn == 'white' else 'white'
+        return True
+
+def random_games(count, plies, seed):
+    """
+    Move lists of random games that last at least plies moves.
+    """
+    rng = random.Random(seed)
+    games = []
+    while len(games) < count:
+        board = chess.Board()
+        moves = []
+        while len(moves) < plies and not board.is_game_over():
+            move = rng.choice(list(board.legal_moves))
+            board.push(move)
+            moves.append(move.uci())
+        if len(moves) == plies:
+            games.append(moves)
+    return games
+
+def measure(factory, games):
+    # Each move string is built fresh, as it would be when decoded off the wire
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    live = []
+    for moves in games:
+        game = factory()
+        for move_uci in moves:
+            game.push_move(''.join(move_uci))
+        live.append(game)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / len(games)
+
+def measure_cache(games, positions):
+    """
+    Bytes per entry of a PositionCache filled with positions from games.
+    """
+    cache = PositionCache(max_positions=positions)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for moves in games:
+        game = ChessGame(cache)
+        for move_uci in moves:
+            game.push_move(move_uci)
+            if len(cache.entries) >= positions:
+                break
+        if len(cache.entries) >= positions:
+            break
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    # The games themselves are freed by now; what is left is the cache
+    return (after - before) / len(cache.entries), len(cache.entries)
+
+def main():
+    parser = argparse.ArgumentParser(description="Bytes per active game")
+    parser.add_argument('--games', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--cache-positions', type=int, default=20_000,
+                        help="positions to fill the legal-move cache with when measuring it")
+    args = parser.parse_args()
+    print(f"{'plies':>5} {'legacy B/game':>14} {'compact B/game':>15} {'100k games (compact)':>21}")
+    for plies in (40, 150):
+        games = random_games(args.games, plies, args.seed)
+        # Warm a private position cache first; it is shared by all games, not per-game state
+        cache = PositionCache(max_positions=10**7)
+        for moves in games:
+            game = ChessGame(cache)
+            for move_uci in moves:
+                game.push_move(move_uci)
+        legacy = measure(LegacyGame, games)
+        compact = measure(lambda: ChessGame(cache), games)
+        print(f"{plies:>5} {legacy:>14.0f} {compact:>15.0f} {compact * 100_000 / 2**20:>18.1f} MiB")
+    # Random games rarely repeat a position, so almost every ply adds an entry
+    per_position, filled = measure_cache(random_games(args.cache_positions // 40 + 1, 150, args.seed + 1),
+                                         args.cache_positions)
+    print(f"Position cache: {per_position:.0f} bytes per position over {filled} positions; "
+          f"{per_position * DEFAULT_MAX_POSITIONS / 2**20:.0f} MiB when full at the default "
+          f"{DEFAULT_MAX_POSITIONS:,} positions")
+
+if __name__ == "__main__":
+    main()
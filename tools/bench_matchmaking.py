@@ -0,0 +1,109 @@
+# Queue operations per second of the matchmaker, and how long players wait for a match.
+# Simulates --rate players joining per second for --seconds of simulated time, ratings
+# drawn around 1500, with --cancel of them leaving the queue before they are paired.
+# The matchmaker runs in this process on a simulated clock, so the wall time measured
+# is the cost of its own operations.
+# --index-sizes then times a join and a leave on a queue already holding that many
+# players, for the matchmaker's bucketed index and for one flat sorted list.
+# Run from the project root: python -m tools.bench_matchmaking [--rate 2000] [--seconds 60]
+import argparse
+import bisect
+import heapq
+import random
+import time
+from server.matchmaking import Matchmaker, Ratings, SortedKeys
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+def time_index(size, rng, rounds=20000):
+    """
+    Microseconds per insert plus remove with size keys queued: (buckets, flat list).
+    """
+    keys = sorted((rng.gauss(1500, 350), i) for i in range(size))
+    index = SortedKeys()
+    for key in keys:
+        index.add(key)
+    flat = list(keys)
+    probes = [(rng.gauss(1500, 350), size + i) for i in range(rounds)]
+    started = time.perf_counter()
+    for key in probes:
+        index.add(key)
+        index.neighbours(key)
+        index.remove(key)
+    buckets = time.perf_counter() - started
+    started = time.perf_counter()
+    for key in probes:
+        bisect.insort(flat, key)
+        bisect.bisect_left(flat, key)
+        del flat[bisect.bisect_left(flat, key)]
+    return buckets / rounds * 1e6, (time.perf_counter() - started) / rounds * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description="Matchmaking queue benchmark")
+    parser.add_argument('--rate', type=float, default=2000.0, help="players joining per simulated second")
+    parser.add_argument('--seconds', type=float, default=60.0, help="simulated seconds")
+    parser.add_argument('--players', type=int, default=100000, help="distinct rated players")
+    parser.add_argument('--spread', type=float, default=350.0, help="standard deviation of the ratings")
+    parser.add_argument('--cancel', type=float, default=0.1, help="share of players who give up waiting")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--index-sizes', default='1000,100000,1000000',
+                        help="comma-separated queue lengths to time the index at, or empty to skip")
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    ratings = Ratings()
+    for i in range(args.players):
+        ratings.players[f"p{i}"] = [rng.gauss(1500, args.spread), 50]
+
+    waits = []
+    gaps = []
+    clock = [0.0]
+
+    def on_match(first, second):
+        waits.append(clock[0] - first.joined)
+        waits.append(clock[0] - second.joined)
+        gaps.append(abs(first.rating - second.rating))
+
+    matchmaker = Matchmaker(None, on_match, ratings)
+    step = 1 / args.rate
+    cancels = []  # heap of (simulated time, conn)
+    operations = 0
+    refused = 0
+    elapsed = 0.0
+    next_sweep = matchmaker.sweep_interval
+    conn = 0
+    while clock[0] < args.seconds:
+        clock[0] += step
+        conn += 1
+        started = time.perf_counter()
+        if matchmaker.add(conn, f"p{rng.randrange(args.players)}", now=clock[0]) is None:
+            refused += 1  # that player is already queued
+        operations += 1
+        while cancels and cancels[0][0] <= clock[0]:
+            matchmaker.remove(heapq.heappop(cancels)[1])
+            operations += 1
+        if clock[0] >= next_sweep:
+            matchmaker.sweep(now=clock[0])
+            operations += 1
+            next_sweep += matchmaker.sweep_interval
+        elapsed += time.perf_counter() - started
+        if rng.random() < args.cancel:
+            heapq.heappush(cancels, (clock[0] + rng.uniform(1, 10), conn))
+
+    waits.sort()
+    gaps.sort()
+    print(f"{operations} queue operations in {elapsed:.2f} s: {operations / elapsed:,.0f} per second")
+    print(f"{matchmaker.matched} matches, {len(matchmaker)} still waiting at the end, "
+          f"{refused} joins refused for a name already queued")
+    print("wait seconds: p50 {:.2f}  p90 {:.2f}  p99 {:.2f}  max {:.2f}".format(
+        percentile(waits, 0.5), percentile(waits, 0.9), percentile(waits, 0.99), waits[-1]))
+    print("rating gap:   p50 {:.0f}  p90 {:.0f}  p99 {:.0f}  max {:.0f}".format(
+        percentile(gaps, 0.5), percentile(gaps, 0.9), percentile(gaps, 0.99), gaps[-1]))
+    for size in (int(value) for value in args.index_sizes.split(',') if value):
+        buckets, flat = time_index(size, rng)
+        print(f"index with {size:,} queued: join+leave {buckets:.2f} µs bucketed, {flat:.2f} µs flat list")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# Move throughput of the sharded server for different worker counts.
+# For each count it starts `server_main --workers N` and runs one load driver process per
+# worker (a single driver saturates long before eight workers do), then sums moves/sec.
+# Run from the project root: python -m tools.bench_shards [--workers 1 2 4 8] [--duration 15]
+# The drivers share the machine with the server; on a host with fewer than twice as many
+# cores as workers the curve flattens because of that, not because of the server.
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+def start_server(port, workers, mode):
+    proc = subprocess.Popen([sys.executable, '-m', 'server.server_main', '--host', '127.0.0.1', '--port', str(port),
+                             '--workers', str(workers), '--mode', mode], stdout=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.1).close()
+            return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.terminate()
+    raise SystemExit("Server did not start")
+
+def run_drivers(port, drivers, args):
+    """
+    Run the load drivers in parallel and return their JSON reports.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        procs = []
+        for i in range(drivers):
+            out = os.path.join(tmp, f"driver{i}.json")
+            cmd = [sys.executable, '-m', 'tools.load_test', '--port', str(port), '--games', str(args.games),
+                   '--spectators', str(args.spectators), '--duration', str(args.duration),
+                   '--room-prefix', f"bench{i}", '--seed', str(i + 1), '--save-baseline', out]
+            procs.append((subprocess.Popen(cmd, stdout=subprocess.DEVNULL), out))
+        reports = []
+        for proc, out in procs:
+            proc.wait()
+            with open(out) as f:
+                reports.append(json.load(f))
+    return reports
+
+def main():
+    parser = argparse.ArgumentParser(description="Sharded server scaling")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--games', type=int, default=20, help="concurrent games per driver")
+    parser.add_argument('--spectators', type=int, default=20, help="spectators per driver")
+    parser.add_argument('--duration', type=float, default=15.0)
+    parser.add_argument('--mode', choices=('asyncio', 'threaded'), default='asyncio')
+    args = parser.parse_args()
+    cores = os.cpu_count() or 1
+    if cores < 2 * max(args.workers):
+        print(f"Note: {cores} cores for up to {max(args.workers)} workers plus as many drivers; expect the curve to flatten early.")
+    print(f"{'workers':>7} {'moves/sec':>10} {'speedup':>8} {'per worker':>11} {'worst p99 ms':>13}")
+    single = None
+    for workers in args.workers:
+        port = free_port()
+        proc = start_server(port, workers, args.mode)
+        try:
+            reports = run_drivers(port, workers, args)
+        finally:
+            proc.terminate()
+            proc.wait()
+        rate = sum(r['results']['moves_per_sec'] for r in reports)
+        p99 = max((r['results']['latency_ms']['p99'] or 0) for r in reports)
+        if single is None:
+            single = rate / workers
+        print(f"{workers:>7} {rate:>10.1f} {rate / single:>7.2f}x {rate / workers:>11.1f} {p99:>13.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# Client start-up time, each measurement taken in a fresh interpreter so nothing is
+# already imported or cached:
+#   import      importing client.client_main, what runs before the welcome window opens
+#   load_gui    importing pygame, python-chess and the GUI modules, done on a thread
+#               while the welcome window is open
+#   eager       importing all of it up front, as the client did before
+#   atlas       loading the piece images at both sizes from the sprite atlas
+#   files       loading the twelve piece PNGs and scaling them to both sizes
+#   join        connecting, sending join and receiving the color reply
+#   preconnect  the same with the TCP connection already open, as after the welcome window
+# Run from the project root: python -m tools.bench_startup [--runs 7] [--save startup.json]
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from tools.relay_demo import free_port, start_server
+
+TIMED = """
+import os, sys, time
+os.environ['SDL_VIDEODRIVER'] = 'dummy'
+os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'
+{setup}
+started = time.perf_counter()
+{body}
+print(time.perf_counter() - started)
+"""
+
+DISPLAY = "import pygame\npygame.display.init()\npygame.display.set_mode((1, 1))"
+JOIN = """
+from common.protocol import make_message, MessageDecoder
+sock = {connect}
+sock.sendall(make_message('join', {{'name': 'bench', 'encodings': ['binary', 'json']}}))
+decoder = MessageDecoder()
+messages = []
+while not any(m['type'] == 'color' for m in messages):
+    messages = decoder.recv_from(sock)
+    if messages is None:
+        sys.exit("Server closed the connection")
+"""
+CONNECT = "socket.create_connection(('127.0.0.1', {port}))"
+
+def cases(port):
+    return {
+        'import': ("", "import client.client_main"),
+        'load_gui': ("import client.client_main as cm", "cm.load_gui()"),
+        'eager': ("", "import pygame, chess, common.chess_game, client.board_renderer, client.events, "
+                      "client.prediction, tkinter, client.client_main"),
+        'atlas': (DISPLAY + "\nfrom client.board_renderer import atlas_images",
+                  "atlas_images(80); atlas_images(48)"),
+        'files': (DISPLAY + "\nfrom client.board_renderer import scale_piece_files",
+                  "scale_piece_files(80); scale_piece_files(48)"),
+        'join': ("import socket", JOIN.format(connect=CONNECT.format(port=port))),
+        'preconnect': ("import socket\nopened = " + CONNECT.format(port=port), JOIN.format(connect="opened")),
+    }
+
+def measure(setup, body):
+    out = subprocess.run([sys.executable, '-c', TIMED.format(setup=setup, body=body)],
+                         capture_output=True, text=True, check=True).stdout
+    return float(out.split()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description="Client start-up benchmark")
+    parser.add_argument('--runs', type=int, default=7, help="fresh interpreters per measurement")
+    parser.add_argument('--mode', choices=('asyncio', 'threaded'), default='asyncio')
+    parser.add_argument('--save', help="write the medians in milliseconds to this JSON file")
+    args = parser.parse_args()
+
+    port = free_port()
+    proc = start_server(port, args.mode)
+    results = {}
+    try:
+        print(f"{'':>11} {'median ms':>10} {'min ms':>8} {'max ms':>8}")
+        for label, (setup, body) in cases(port).items():
+            times = sorted(measure(setup, body) * 1000 for _ in range(args.runs))
+            results[label] = statistics.median(times)
+            print(f"{label:>11} {results[label]:>10.1f} {times[0]:>8.1f} {times[-1]:>8.1f}")
+    finally:
+        proc.terminate()
+        proc.wait()
+    print(f"Before the welcome window: {results['import']:.1f} ms, against {results['eager']:.1f} ms "
+          f"importing everything up front")
+    print(f"Piece images: {results['atlas']:.2f} ms from the atlas, {results['files']:.2f} ms from the files")
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# Bytes per message and encode/decode rate of the JSON and binary wire encodings.
+# Run from the project root: python -m tools.bench_wire [--plies 40] [--seconds 0.5]
+import argparse
+import random
+import time
+import chess
+from common.protocol import make_message, parse_message, FRAME_HEADER
+from common.wire import BINARY, JSON
+
+def sample_messages(plies, seed):
+    """
+    One message of each kind the server sends most, from a random game of plies moves.
+    """
+    rng = random.Random(seed)
+    board = chess.Board()
+    history = []
+    for _ in range(plies):
+        moves = list(board.legal_moves)
+        if not moves:
+            break
+        move = rng.choice(moves)
+        board.push(move)
+        history.append(move.uci())
+    times = {'white': 1523.417, 'black': 1688.052}
+    turn = 'white' if board.turn == chess.WHITE else 'black'
+    return [
+        ('move (client)', 'move', {'move': history[-1]}),
+        ('move (event)', 'move', {'seq': 412, 'ply': len(history), 'move': history[-1], 'turn': turn,
+                                  'game_over': False, 'winner': None, 'player_times': times}),
+        (f'board ({len(history)} plies)', 'board', {'seq': 412, 'ply': len(history), 'fen': board.fen(), 'turn': turn,
+                                                    'history': history, 'game_over': False, 'winner': None,
+                                                    'player_times': times, 'increment': 2, 'delay': 0,
+                                                    'both_connected': True}),
+        ('game_over', 'game_over', {'seq': 413, 'reason': 'time', 'winner': 'black', 'player_times': times}),
+        ('chat_batch (3)', 'chat_batch', {'seq': 414, 'lines': [{'sender': 'Player_1', 'text': 'good luck, have fun'},
+                                                                {'sender': 'Player_2', 'text': 'you too'},
+                                                                {'sender': 'watcher', 'text': 'gl hf'}]}),
+    ]
+
+def rate(func, seconds):
+    """
+    Calls per second of func, measured for about the given time.
+    """
+    count = 0
+    batch = 100
+    start = time.perf_counter()
+    while True:
+        for _ in range(batch):
+            func()
+        count += batch
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds:
+            return count / elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="Wire encoding microbenchmark")
+    parser.add_argument('--plies', type=int, default=40, help="length of the game in the board snapshot")
+    parser.add_argument('--seconds', type=float, default=0.5, help="time spent on each measurement")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    header = FRAME_HEADER.size
+    print(f"{'message':<18} {'encoding':<8} {'bytes':>6} {'encode/s':>11} {'decode/s':>11}")
+    for label, msg_type, content in sample_messages(args.plies, args.seed):
+        sizes = {}
+        for encoding in (JSON, BINARY):
+            frame = make_message(msg_type, content, encoding)
+            payload = frame[header:]
+            decoded = parse_message(payload)
+            if decoded['type'] != msg_type:
+                raise SystemExit(f"{label} did not survive the {encoding} round trip: {decoded}")
+            sizes[encoding] = len(frame)
+            encode_rate = rate(lambda: make_message(msg_type, content, encoding), args.seconds)
+            decode_rate = rate(lambda: parse_message(payload), args.seconds)
+            print(f"{label:<18} {encoding:<8} {len(frame):>6} {encode_rate:>11,.0f} {decode_rate:>11,.0f}")
+        print(f"{'':<18} {'saved':<8} {1 - sizes[BINARY] / sizes[JSON]:>6.0%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+# Headless client that speaks common/protocol.py and plays random legal moves.
+# Used by the load tools; can also be run on its own to give a GUI player an opponent:
+#   python -m tools.bot_client --room <room id> [--host 127.0.0.1] [--port 5555] [--think 1.0]
+#   python -m tools.bot_client --queue --name Alice
+import argparse
+import asyncio
+import random
+import time
+import chess
+from common.wire import JSON, ENCODINGS
+from common.protocol import make_message, make_create_room, make_join_room, make_queue, make_resume, MessageDecoder, RECV_SIZE
+
+class BotClient:
+    """
+    One connection to the server. Keeps a local board from the 'board' and 'move'
+    events and, when seated, answers its turn with a random legal move.
+    on_event(bot, msg_obj, received_at) is called for every message received, which
+    is how the load driver timestamps broadcasts.
+    encodings lists the wire encodings offered at join; the server's choice is in encoding.
+    """
+    def __init__(self, name, rng=None, think=0.0, on_event=None, encodings=None):
+        self.name = name
+        self.encodings = encodings
+        self.encoding = JSON
+        self.rng = rng or random.Random()
+        self.think = think
+        self.on_event = on_event
+        self.reader = None
+        self.writer = None
+        self.decoder = MessageDecoder()
+        self.color = None
+        self.room = None
+        self.session = None  # token for resuming after a reconnect
+        self.last_seq = 0
+        self.board = chess.Board()
+        self.ply = 0
+        self.started = False
+        self.game_over = False
+        self.moves_sent = 0
+        self.errors = []
+        self.pending = []  # messages that arrived together with the 'color' reply
+        self.waiting_ply = None  # ply we are waiting to see after sending a move
+        self.match = None  # the server's 'match' message when seated by the matchmaker
+
+    async def connect(self, host, port):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+
+    async def create_room(self, room_id=None, time_limit=None):
+        self.writer.write(make_create_room(self.name, room_id, time_limit, self.encodings))
+        return await self.wait_for_color()
+
+    async def join_room(self, room_id, spectate=False):
+        self.writer.write(make_join_room(self.name, room_id, spectate, self.encodings))
+        return await self.wait_for_color()
+
+    async def queue(self):
+        """
+        Wait in the matchmaking queue until the server pairs this bot. Returns the color.
+        """
+        self.writer.write(make_queue(self.name, self.encodings))
+        return await self.wait_for_color()
+
+    async def resume(self, host, port):
+        """
+        Reconnect and take back this bot's seat. Returns the color, or None if the
+        session expired.
+        """
+        await self.close()
+        self.decoder = MessageDecoder()
+        await self.connect(host, port)
+        self.writer.write(make_resume(self.room, self.session, self.last_seq, self.encodings))
+        self.waiting_ply = None
+        return await self.wait_for_color()
+
+    async def wait_for_color(self):
+        """
+        Read until the server's reply to a lobby message. Returns the color, or None
+        if the server refused.
+        """
+        while True:
+            messages = await self.read_messages()
+            if messages is None:
+                return None
+            for i, msg_obj in enumerate(messages):
+                if msg_obj['type'] == 'match':
+                    self.match = msg_obj['content']
+                if msg_obj['type'] == 'color':
+                    self.color = msg_obj['content']['color']
+                    self.room = msg_obj['content'].get('room')
+                    self.session = msg_obj['content'].get('session')
+                    self.encoding = msg_obj['content'].get('encoding', JSON)
+                    self.pending = messages[i + 1:]
+                    return self.color
+                if msg_obj['type'] == 'error':
+                    self.errors.append(msg_obj['content'].get('text', ''))
+                    return None
+
+    async def read_messages(self):
+        data = await self.reader.read(RECV_SIZE)
+        if not data:
+            return None
+        return self.decoder.feed(data)
+
+    def send(self, msg_type, content):
+        self.writer.write(make_message(msg_type, content, self.encoding))
+
+    async def run(self, max_plies=None):
+        """
+        Play (or watch) until the game ends, max_plies is reached or the server
+        closes the connection.
+        """
+        pending, self.pending = self.pending, []
+        for msg_obj in pending:
+            self.handle(msg_obj, time.perf_counter())
+        await self.maybe_move(max_plies)
+        while not self.game_over and (max_plies is None or self.ply < max_plies):
+            messages = await self.read_messages()
+            if messages is None:
+                break
+            now = time.perf_counter()
+            for msg_obj in messages:
+                self.handle(msg_obj, now)
+            await self.maybe_move(max_plies)
+
+    def handle(self, msg_obj, received_at):
+        msg_type = msg_obj['type']
+        content = msg_obj.get('content') or {}
+        if isinstance(content.get('seq'), int):
+            self.last_seq = max(self.last_seq, content['seq'])
+        if msg_type == 'board':
+            self.board = chess.Board(content.get('fen', chess.STARTING_FEN))
+            self.ply = content.get('ply', 0)
+            self.started = True
+            self.game_over = content.get('game_over', False)
+            self.waiting_ply = None
+        elif msg_type == 'move':
+            if content.get('ply') == self.ply + 1:
+                self.board.push_uci(content['move'])
+                self.ply += 1
+                self.game_over = content.get('game_over', False)
+            elif content.get('ply', 0) > self.ply:
+                self.send('resync', {})
+        elif msg_type == 'game_over':
+            self.game_over = True
+        elif msg_type == 'error':
+            self.errors.append(content.get('text', ''))
+            self.waiting_ply = None
+        elif msg_type == 'ping':
+            self.send('pong', {'id': content.get('id')})
+        if self.on_event is not None:
+            self.on_event(self, msg_obj, received_at)
+
+    async def maybe_move(self, max_plies=None):
+        if not self.started or self.game_over or self.color not in ('white', 'black'):
+            return
+        if max_plies is not None and self.ply >= max_plies:
+            return
+        my_turn = self.board.turn == (chess.WHITE if self.color == 'white' else chess.BLACK)
+        if not my_turn or self.waiting_ply == self.ply + 1:
+            return
+        if self.think:
+            await asyncio.sleep(self.think)
+        move = self.rng.choice(list(self.board.legal_moves))
+        self.waiting_ply = self.ply + 1
+        self.moves_sent += 1
+        self.send('move', {'move': move.uci()})
+        if self.on_event is not None:
+            self.on_event(self, {'type': 'sent', 'content': {'ply': self.ply + 1, 'move': move.uci()}}, time.perf_counter())
+        await self.writer.drain()
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+
+async def play_one(args):
+    bot = BotClient(args.name, think=args.think, encodings=[args.encoding])
+    await bot.connect(args.host, args.port)
+    if args.queue:
+        color = await bot.queue()
+    else:
+        color = await bot.join_room(args.room, spectate=args.spectate)
+        if color is None:
+            color = await bot.create_room(args.room)
+    if color is None:
+        print(f"Could not join room {args.room}: {bot.errors}")
+        await bot.close()
+        return
+    if bot.match is not None:
+        print(f"Matched with {bot.match['opponent']} ({bot.match['opponent_rating']})")
+    print(f"{bot.name} seated as {color} in room {bot.room}")
+    await bot.run()
+    print(f"Game over after {bot.ply} plies: {bot.board.fen()}")
+    await bot.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Random-move bot")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5555)
+    parser.add_argument('--room', default='main')
+    parser.add_argument('--name', default='Bot')
+    parser.add_argument('--think', type=float, default=1.0, help="seconds to wait before each move")
+    parser.add_argument('--spectate', action='store_true')
+    parser.add_argument('--queue', action='store_true', help="find an opponent through the matchmaking queue")
+    parser.add_argument('--encoding', choices=ENCODINGS, default=JSON, help="wire encoding to ask for")
+    args = parser.parse_args()
+    asyncio.run(play_one(args))
+
+if __name__ == "__main__":
+    main()
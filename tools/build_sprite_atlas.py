@@ -0,0 +1,24 @@
+# Writes client/assets/pieces_atlas.bmp: every piece image scaled once, at build time, to
+# each size in client.board_renderer.ATLAS_SIZES, so the client loads one file and
+# scales nothing. Run from the project root after changing a piece image or a size:
+#   python -m tools.build_sprite_atlas
+import os
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+import pygame
+from client.board_renderer import ATLAS_FILE, ATLAS_SIZES, PIECE_FILES, scale_piece_files
+
+def main():
+    pygame.init()
+    atlas = pygame.Surface((len(PIECE_FILES) * max(ATLAS_SIZES), sum(ATLAS_SIZES)), pygame.SRCALPHA)
+    top = 0
+    for size in ATLAS_SIZES:
+        images = scale_piece_files(size)
+        for column, symbol in enumerate(PIECE_FILES):
+            atlas.blit(images[symbol], (column * size, top))
+        top += size
+    pygame.image.save(atlas, ATLAS_FILE)
+    print(f"Wrote {ATLAS_FILE}: {atlas.get_width()}x{atlas.get_height()}, {os.path.getsize(ATLAS_FILE)} bytes")
+    pygame.quit()
+
+if __name__ == "__main__":
+    main()
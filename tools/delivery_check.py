@@ -0,0 +1,133 @@
+# Checks that messages sent outside the move stream reach the client while nothing
+# else is happening in the room, against a local server in the chosen mode:
+#   chat     two players sit in a room without moving and one sends a chat line; the
+#            other must receive it in a chat_batch
+#   eval     white plays a move; the spectator must receive its evaluation
+#   analyse  the spectator asks for the evaluation of the starting position
+#   replay   the spectator asks for a replay of the game and must receive every ply
+# The server runs the stub UCI engine for the evaluations.
+# Exits non-zero if any message does not arrive within --timeout seconds.
+# Run from the project root: python -m tools.delivery_check [--mode threaded]
+import argparse
+import asyncio
+import sys
+from tools.bot_client import BotClient
+from tools.relay_demo import free_port, start_server
+
+async def seat(port, name, room_id, create=False, spectate=False):
+    bot = BotClient(name)
+    await bot.connect('127.0.0.1', port)
+    color = await (bot.create_room(room_id) if create else bot.join_room(room_id, spectate))
+    if color is None:
+        raise SystemExit(f"{name} could not join {room_id}: {bot.errors}")
+    return bot
+
+async def receive(bot, wanted, timeout):
+    """
+    Read until a message satisfies wanted(msg_obj). Returns it, or None on timeout.
+    """
+    messages, bot.pending = bot.pending, []
+    deadline = asyncio.get_running_loop().time() + timeout
+    while messages is not None:
+        for msg_obj in messages:
+            if wanted(msg_obj):
+                return msg_obj
+        remaining = deadline - asyncio.get_running_loop().time()
+        if remaining <= 0:
+            return None
+        try:
+            messages = await asyncio.wait_for(bot.read_messages(), remaining)
+        except asyncio.TimeoutError:
+            return None
+    return None
+
+async def check_chat(port, timeout):
+    white = await seat(port, 'chat-white', 'idle-chat', create=True)
+    black = await seat(port, 'chat-black', 'idle-chat')
+    try:
+        white.send('chat', {'text': 'hello'})
+        batch = await receive(black, lambda msg_obj: msg_obj['type'] == 'chat_batch' and any(
+            line.get('text') == 'hello' for line in msg_obj['content'].get('lines', ())), timeout)
+        return [] if batch is not None else ["chat line never arrived in an idle room"]
+    finally:
+        await white.close()
+        await black.close()
+
+async def watched_game(port, room_id, timeout):
+    """
+    Two players and a spectator in room_id, after white's first move has reached the
+    spectator. Returns the three bots, or None if the move never arrived.
+    """
+    bots = [await seat(port, 'white', room_id, create=True), await seat(port, 'black', room_id),
+            await seat(port, 'spectator', room_id, spectate=True)]
+    bots[0].send('move', {'move': 'e2e4'})
+    if await receive(bots[2], lambda msg_obj: msg_obj['type'] == 'move', timeout) is None:
+        await close_all(bots)
+        return None
+    return bots
+
+async def close_all(bots):
+    for bot in bots:
+        await bot.close()
+
+def is_eval(ply):
+    return lambda msg_obj: msg_obj['type'] == 'eval' and msg_obj['content'].get('ply') == ply
+
+async def check_eval(port, timeout):
+    bots = await watched_game(port, 'eval', timeout)
+    if bots is None:
+        return ["the spectator never saw the move"]
+    try:
+        result = await receive(bots[2], is_eval(1), timeout)
+        return [] if result is not None else ["no evaluation of the move reached the spectator"]
+    finally:
+        await close_all(bots)
+
+async def check_analyse(port, timeout):
+    bots = await watched_game(port, 'analyse', timeout)
+    if bots is None:
+        return ["the spectator never saw the move"]
+    try:
+        bots[2].send('analyse', {'ply': 0})
+        result = await receive(bots[2], is_eval(0), timeout)
+        return [] if result is not None else ["no reply to analyse"]
+    finally:
+        await close_all(bots)
+
+async def check_replay(port, timeout):
+    bots = await watched_game(port, 'replay', timeout)
+    if bots is None:
+        return ["the spectator never saw the move"]
+    try:
+        bots[2].send('replay', {'ply': 0, 'speed': 50})
+        last = await receive(bots[2], lambda msg_obj: msg_obj['type'] == 'replay' and
+                             msg_obj['content']['ply'] >= msg_obj['content']['plies'], timeout)
+        return [] if last is not None else ["the replay never reached its last ply"]
+    finally:
+        await close_all(bots)
+
+CHECKS = {'chat': check_chat, 'eval': check_eval, 'analyse': check_analyse, 'replay': check_replay}
+
+def main():
+    parser = argparse.ArgumentParser(description="Check delivery of messages sent outside the move stream")
+    parser.add_argument('--mode', choices=('asyncio', 'threaded'), default='asyncio')
+    parser.add_argument('--timeout', type=float, default=5.0, help="seconds to wait for each message")
+    args = parser.parse_args()
+
+    port = free_port()
+    # No pings, so nothing but the message under test wakes the client's writer
+    proc = start_server(port, args.mode, '--ping-interval', '0', '--engine', f"{sys.executable} -m tools.stub_uci_engine")
+    failed = False
+    try:
+        for label, check in CHECKS.items():
+            problems = asyncio.run(check(port, args.timeout))
+            print(f"{label:>8}: {'; '.join(problems) or 'ok'}")
+            failed = failed or bool(problems)
+    finally:
+        proc.terminate()
+        proc.wait()
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+# Load driver: N concurrent games of random-move bots plus M spectators against a server.
+# Reports moves/sec and move-to-broadcast latency (send of a move to each member receiving
+# it), and can save or compare a JSON baseline so regressions show up between releases.
+# Run from the project root:
+#   python -m tools.load_test --games 50 --spectators 100 --duration 20 --spawn
+#   python -m tools.load_test ... --save-baseline baseline.json
+#   python -m tools.load_test ... --compare baseline.json
+import argparse
+import asyncio
+import json
+import platform
+import random
+import socket
+import subprocess
+import sys
+import time
+from common.wire import JSON, ENCODINGS
+from tools.bot_client import BotClient
+
+class LoadStats:
+    def __init__(self):
+        self.moves = 0
+        self.games = 0
+        self.latencies = []  # seconds, one per member that received a move
+        self.errors = 0
+        self.connect_failures = 0
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+async def run_game(slot, game_no, spectators, args, stats, rng):
+    room_id = f"{args.room_prefix}-{slot}-{game_no}"
+    sent_at = {}  # ply -> when the mover sent it
+    white = None
+
+    def on_event(bot, msg_obj, received_at):
+        msg_type = msg_obj['type']
+        if msg_type == 'sent':
+            sent_at[msg_obj['content']['ply']] = received_at
+        elif msg_type == 'move':
+            started = sent_at.get(msg_obj['content'].get('ply'))
+            if started is not None:
+                stats.latencies.append(received_at - started)
+            if bot is white:
+                stats.moves += 1
+        elif msg_type == 'error':
+            stats.errors += 1
+
+    def new_bot(name):
+        return BotClient(name, random.Random(rng.random()), args.think, on_event, [args.encoding])
+
+    white = new_bot(f"w{slot}")
+    black = new_bot(f"b{slot}")
+    watchers = [new_bot(f"s{slot}.{i}") for i in range(spectators)]
+    bots = [white] + watchers + [black]
+    try:
+        await white.connect(args.host, args.port)
+        if await white.create_room(room_id, args.time_limit) is None:
+            stats.errors += 1
+            return
+        # Spectators join before black so they also see the game start
+        for bot in watchers:
+            await bot.connect(args.host, args.port)
+            await bot.join_room(room_id, spectate=True)
+        await black.connect(args.host, args.port)
+        await black.join_room(room_id)
+        await asyncio.gather(*(bot.run(args.max_plies) for bot in bots))
+        stats.games += 1
+    except OSError:
+        stats.connect_failures += 1
+    finally:
+        for bot in bots:
+            await bot.close()
+
+async def run_slot(slot, args, stats, deadline):
+    rng = random.Random(args.seed * 100_003 + slot)
+    # Spectators are spread as evenly as possible over the games
+    spectators = args.spectators // args.games + (1 if slot < args.spectators % args.games else 0)
+    game_no = 0
+    while time.perf_counter() < deadline:
+        await run_game(slot, game_no, spectators, args, stats, rng)
+        game_no += 1
+
+async def run_load(args):
+    stats = LoadStats()
+    start = time.perf_counter()
+    deadline = start + args.duration
+    tasks = [asyncio.ensure_future(run_slot(slot, args, stats, deadline)) for slot in range(args.games)]
+    # Games in progress at the deadline are cut off; their moves so far still count
+    await asyncio.wait(tasks, timeout=args.duration)
+    elapsed = time.perf_counter() - start
+    moves = stats.moves
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return stats, moves, elapsed
+
+def summarize(stats, moves, elapsed, args):
+    latencies = sorted(stats.latencies)
+    def ms(value):
+        return round(value * 1000, 3) if value is not None else None
+    return {
+        'config': {
+            'games': args.games,
+            'spectators': args.spectators,
+            'duration': args.duration,
+            'think': args.think,
+            'max_plies': args.max_plies,
+            'encoding': args.encoding,
+            'server_mode': args.server_mode if args.spawn else None,
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+        },
+        'results': {
+            'moves': moves,
+            'moves_per_sec': round(moves / elapsed, 1) if elapsed else 0.0,
+            'games_finished': stats.games,
+            'deliveries': len(latencies),
+            'latency_ms': {
+                'p50': ms(percentile(latencies, 0.50)),
+                'p99': ms(percentile(latencies, 0.99)),
+                'p999': ms(percentile(latencies, 0.999)),
+                'max': ms(latencies[-1] if latencies else None),
+            },
+            'errors': stats.errors,
+            'connect_failures': stats.connect_failures,
+        },
+    }
+
+def print_report(report):
+    results = report['results']
+    latency = results['latency_ms']
+    print(f"moves: {results['moves']}  ({results['moves_per_sec']} moves/sec), games finished: {results['games_finished']}")
+    print(f"move-to-broadcast over {results['deliveries']} deliveries: "
+          f"p50 {latency['p50']} ms, p99 {latency['p99']} ms, p999 {latency['p999']} ms, max {latency['max']} ms")
+    print(f"errors: {results['errors']}, connect failures: {results['connect_failures']}")
+
+def compare(report, baseline, tolerance):
+    """
+    Print the change against a saved baseline. Returns False if throughput fell or any
+    latency percentile rose by more than tolerance (a fraction).
+    """
+    ok = True
+    rows = [('moves_per_sec', baseline['results']['moves_per_sec'], report['results']['moves_per_sec'], True)]
+    for key in ('p50', 'p99', 'p999'):
+        rows.append((f"latency {key} ms", baseline['results']['latency_ms'][key], report['results']['latency_ms'][key], False))
+    print(f"{'metric':<18} {'baseline':>10} {'now':>10} {'change':>8}")
+    for name, before, now, higher_is_better in rows:
+        if not before or now is None:
+            print(f"{name:<18} {before!s:>10} {now!s:>10} {'-':>8}")
+            continue
+        change = (now - before) / before
+        worse = -change if higher_is_better else change
+        flag = "  REGRESSION" if worse > tolerance else ""
+        if flag:
+            ok = False
+        print(f"{name:<18} {before:>10} {now:>10} {change:>+7.1%}{flag}")
+    return ok
+
+def spawn_server(args):
+    """
+    Start a server on a free local port and wait until it accepts connections.
+    """
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        args.port = probe.getsockname()[1]
+    args.host = '127.0.0.1'
+    cmd = [sys.executable, '-m', 'server.server_main', '--host', args.host, '--port', str(args.port),
+           '--mode', args.server_mode] + args.server_arg
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection((args.host, args.port), timeout=0.1).close()
+            return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.terminate()
+    raise SystemExit("Server did not start")
+
+def raise_fd_limit(needed):
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < needed:
+        limit = needed if hard == resource.RLIM_INFINITY else min(needed, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (limit, hard))
+
+def main():
+    parser = argparse.ArgumentParser(description="Server load test")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5555)
+    parser.add_argument('--games', type=int, default=20, help="concurrent games")
+    parser.add_argument('--spectators', type=int, default=0, help="spectators, spread over the games")
+    parser.add_argument('--duration', type=float, default=10.0, help="seconds")
+    parser.add_argument('--think', type=float, default=0.0, help="seconds each bot waits before moving")
+    parser.add_argument('--max-plies', type=int, default=200, help="start a new game after this many plies")
+    parser.add_argument('--time-limit', type=int, default=3600, help="seconds per player in each game")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--encoding', choices=ENCODINGS, default=JSON, help="wire encoding the bots ask for")
+    parser.add_argument('--room-prefix', default='load', help="room ids are <prefix>-<game>-<n>; must differ between concurrent drivers")
+    parser.add_argument('--spawn', action='store_true', help="start a local server for the run")
+    parser.add_argument('--server-mode', choices=('asyncio', 'threaded'), default='asyncio')
+    parser.add_argument('--server-arg', action='append', default=[], help="extra argument for the spawned server")
+    parser.add_argument('--save-baseline', metavar='FILE')
+    parser.add_argument('--compare', metavar='FILE')
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed fractional regression")
+    args = parser.parse_args()
+    raise_fd_limit(2 * (2 * args.games + args.spectators) + 256)
+
+    proc = spawn_server(args) if args.spawn else None
+    try:
+        stats, moves, elapsed = asyncio.run(run_load(args))
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+    report = summarize(stats, moves, elapsed, args)
+    print_report(report)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.save_baseline}")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if not compare(report, baseline, args.tolerance):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
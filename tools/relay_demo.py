@@ -0,0 +1,147 @@
+# Runs one game on an origin server watched through a chain of relays, all as local
+# processes, and compares the origin's egress with the same audience watching directly:
+#
+#   origin <- relay A <- relay B
+#
+# Spectators are spread over relay A and relay B; a few more join relay B mid-game to
+# check that a late joiner is caught up from the relay's own snapshot. At the end every
+# spectator's board must match the players'.
+# Run from the project root: python -m tools.relay_demo [--spectators 200] [--plies 60] [--mode threaded]
+import argparse
+import asyncio
+import random
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from tools.bot_client import BotClient
+from tools.load_test import raise_fd_limit
+
+ROOM = 'relay-demo'
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+def start_server(port, mode, *extra):
+    proc = subprocess.Popen([sys.executable, '-m', 'server.server_main', '--host', '127.0.0.1', '--port', str(port),
+                             '--mode', mode, '--log-level', 'warning'] + list(extra), stdout=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.1).close()
+            return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.terminate()
+    raise SystemExit("Server did not start")
+
+def bytes_out(metrics_port):
+    """
+    Sum of the origin's chess_bytes_out_total over every message type.
+    """
+    with urllib.request.urlopen(f"http://127.0.0.1:{metrics_port}/metrics", timeout=5) as response:
+        text = response.read().decode()
+    return sum(float(line.rsplit(' ', 1)[1]) for line in text.splitlines()
+               if line.startswith('chess_bytes_out_total{'))
+
+async def watch(port, name):
+    """
+    A spectator that has joined and received its first board.
+    """
+    bot = BotClient(name)
+    await bot.connect('127.0.0.1', port)
+    if await bot.join_room(ROOM, spectate=True) is None:
+        raise SystemExit(f"{name} could not join: {bot.errors}")
+    while not any(msg_obj['type'] == 'board' for msg_obj in bot.pending):
+        messages = await bot.read_messages()
+        if messages is None:
+            raise SystemExit(f"{name} was disconnected before the first board")
+        bot.pending.extend(messages)
+    return bot
+
+async def run_game(args, origin_port, spectator_ports, late_port):
+    """
+    Seat two bots on the origin, let the spectators join, then play. Returns the
+    players' final FEN, every spectator's, and the ply each late joiner started at.
+    """
+    rng = random.Random(args.seed)
+    white = BotClient('white', rng=random.Random(rng.random()), think=args.think)
+    black = BotClient('black', rng=random.Random(rng.random()), think=args.think)
+    await white.connect('127.0.0.1', origin_port)
+    await white.create_room(ROOM)
+    await black.connect('127.0.0.1', origin_port)
+    await black.join_room(ROOM)
+    spectators = []
+    for i in range(args.spectators):
+        spectators.append(await watch(spectator_ports[i % len(spectator_ports)], f"spectator{i}"))
+    watching = [asyncio.create_task(bot.run(args.plies)) for bot in spectators]
+    playing = [asyncio.create_task(white.run(args.plies)), asyncio.create_task(black.run(args.plies))]
+    late = []
+    if late_port is not None:
+        while white.ply < args.plies // 2 and not white.game_over:
+            await asyncio.sleep(0.05)
+        for i in range(args.late):
+            bot = await watch(late_port, f"late{i}")
+            board = next(msg_obj for msg_obj in bot.pending if msg_obj['type'] == 'board')
+            late.append(board['content']['ply'])
+            spectators.append(bot)
+            watching.append(asyncio.create_task(bot.run(args.plies)))
+    await asyncio.wait_for(asyncio.gather(*playing), args.timeout)
+    await asyncio.wait_for(asyncio.gather(*watching), args.timeout)
+    fens = [bot.board.fen() for bot in spectators]
+    for bot in spectators + [white, black]:
+        await bot.close()
+    return white.board.fen(), fens, late
+
+def run(args, relayed):
+    origin_port, metrics_port = free_port(), free_port()
+    procs = [start_server(origin_port, args.mode, '--metrics-port', str(metrics_port))]
+    try:
+        spectator_ports, late_port = [origin_port], None
+        if relayed:
+            relay_a, relay_b = free_port(), free_port()
+            # The relays retry until the room exists upstream, so they can start first
+            procs.append(start_server(relay_a, args.mode, '--relay-upstream', f"127.0.0.1:{origin_port}",
+                                      '--relay-room', ROOM, '--relay-name', 'relay-a'))
+            procs.append(start_server(relay_b, args.mode, '--relay-upstream', f"127.0.0.1:{relay_a}",
+                                      '--relay-room', ROOM, '--relay-name', 'relay-b'))
+            spectator_ports, late_port = [relay_a, relay_b], relay_b
+        started = time.perf_counter()
+        final, fens, late = asyncio.run(run_game(args, origin_port, spectator_ports, late_port))
+        elapsed = time.perf_counter() - started
+        egress = bytes_out(metrics_port)
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            proc.wait()
+    mismatched = sum(fen != final for fen in fens)
+    return {'egress': egress, 'elapsed': elapsed, 'mismatched': mismatched, 'watched': len(fens), 'late': late}
+
+def main():
+    parser = argparse.ArgumentParser(description="Relay tree demo: origin egress with and without relays")
+    parser.add_argument('--spectators', type=int, default=100)
+    parser.add_argument('--late', type=int, default=5, help="spectators joining relay B mid-game")
+    parser.add_argument('--plies', type=int, default=60)
+    parser.add_argument('--think', type=float, default=0.02, help="seconds each player waits before moving")
+    parser.add_argument('--mode', choices=('asyncio', 'threaded'), default='asyncio')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--timeout', type=float, default=120.0)
+    args = parser.parse_args()
+    raise_fd_limit(2 * args.spectators + 256)
+
+    direct = run(args, relayed=False)
+    relayed = run(args, relayed=True)
+    print(f"{'':>8} {'origin bytes out':>17} {'spectators':>11} {'boards differ':>14} {'seconds':>8}")
+    for label, result in (('direct', direct), ('relayed', relayed)):
+        print(f"{label:>8} {result['egress']:>17.0f} {result['watched']:>11} {result['mismatched']:>14} "
+              f"{result['elapsed']:>8.1f}")
+    print(f"Origin egress through relays: {relayed['egress'] / direct['egress']:.1%} of direct")
+    print(f"Late joiners on relay B started at plies {relayed['late']}")
+    if direct['mismatched'] or relayed['mismatched'] or not all(relayed['late']):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
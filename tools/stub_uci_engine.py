@@ -0,0 +1,78 @@
+# A tiny UCI engine for exercising the analysis pool without a real engine installed.
+# It "searches" by counting material and plays the first legal move, optionally after
+# sleeping to stand in for the time a real search takes.
+# python -m server.server_main --engine "python -m tools.stub_uci_engine --delay 0.05"
+import argparse
+import sys
+import time
+import chess
+
+PIECE_VALUES = {chess.PAWN: 100, chess.KNIGHT: 300, chess.BISHOP: 300, chess.ROOK: 500, chess.QUEEN: 900, chess.KING: 0}
+
+def material(board):
+    score = 0
+    for piece in board.piece_map().values():
+        value = PIECE_VALUES[piece.piece_type]
+        score += value if piece.color == chess.WHITE else -value
+    return score
+
+def set_position(tokens):
+    if tokens[:1] == ['startpos']:
+        board = chess.Board()
+        rest = tokens[1:]
+    elif tokens[:1] == ['fen']:
+        board = chess.Board(' '.join(tokens[1:7]))
+        rest = tokens[7:]
+    else:
+        return chess.Board()
+    if rest[:1] == ['moves']:
+        for uci in rest[1:]:
+            board.push_uci(uci)
+    return board
+
+def go(board, tokens, delay, out):
+    depth = 1
+    if 'depth' in tokens:
+        depth = int(tokens[tokens.index('depth') + 1])
+    if delay:
+        time.sleep(delay)
+    moves = list(board.legal_moves)
+    score = material(board) * (1 if board.turn == chess.WHITE else -1)
+    if moves:
+        out(f"info depth {depth} score cp {score} nodes {len(moves)} pv {moves[0].uci()}")
+        out(f"bestmove {moves[0].uci()}")
+    else:
+        out(f"info depth 0 score {'mate 0' if board.is_check() else 'cp 0'}")
+        out("bestmove 0000")
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub UCI engine")
+    parser.add_argument('--delay', type=float, default=0, help="seconds each search takes")
+    args = parser.parse_args()
+
+    def out(line):
+        sys.stdout.write(line + "\n")
+        sys.stdout.flush()
+    board = chess.Board()
+    for line in sys.stdin:
+        tokens = line.split()
+        if not tokens:
+            continue
+        command = tokens[0]
+        if command == 'uci':
+            out("id name StubEngine")
+            out("id author chess server tools")
+            out("uciok")
+        elif command == 'isready':
+            out("readyok")
+        elif command == 'ucinewgame':
+            board = chess.Board()
+        elif command == 'position':
+            board = set_position(tokens[1:])
+        elif command == 'go':
+            go(board, tokens, args.delay, out)
+        elif command == 'quit':
+            break
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+# Joins a room as a spectator and prints a server-side replay of its game, or of an
+# archived game, as the frames arrive.
+# Run from the project root: python -m tools.watch_replay --room <room id> [--speed 4] [--ply 0] [--game ID] [--board]
+import argparse
+import asyncio
+import chess
+from tools.bot_client import BotClient
+
+async def watch(args):
+    bot = BotClient('replay-viewer')
+    await bot.connect(args.host, args.port)
+    if await bot.join_room(args.room, spectate=True) is None:
+        print(f"Could not join room {args.room}: {bot.errors}")
+        return
+    request = {'ply': args.ply, 'speed': args.speed}
+    if args.game is not None:
+        request['game'] = args.game
+    bot.send('replay', request)
+    messages = bot.pending
+    while messages is not None:
+        for msg_obj in messages:
+            content = msg_obj.get('content') or {}
+            if msg_obj['type'] == 'error':
+                print("Error:", content.get('text'))
+                return
+            if msg_obj['type'] != 'replay':
+                continue
+            print(f"ply {content['ply']}/{content['plies']}  {content.get('move') or '(start)'}")
+            if args.board:
+                print(chess.Board(content['fen']).unicode(empty_square='.'), end="\n\n")
+            if content['ply'] >= content['plies']:
+                await bot.close()
+                return
+        messages = await bot.read_messages()
+
+def main():
+    parser = argparse.ArgumentParser(description="Watch a server-side game replay")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5555)
+    parser.add_argument('--room', required=True, help="room to join as a spectator")
+    parser.add_argument('--game', type=int, help="replay this archived game instead of the room's")
+    parser.add_argument('--ply', type=int, default=0, help="ply to start from")
+    parser.add_argument('--speed', type=float, default=4.0, help="plies per second")
+    parser.add_argument('--board', action='store_true', help="print the board after every ply")
+    asyncio.run(watch(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()